@@ -0,0 +1,225 @@
+"""
+corpus.py
+
+Generates synthetic Standard Ebooks source trees for the benchmarks.
+
+A generated book has the layout of a real Standard Ebooks repo: `src/epub`
+with a `content.opf` (metadata, manifest and spine), front and back matter
+(titlepage, imprint, dedication, colophon, uncopyright, toc) that the parser
+filters out, `chapter-N.xhtml` files of `<section epub:type="chapter">` with
+italics, block quotes, section breaks and noteref links, and an
+`endnotes.xhtml`. Text is drawn from a fixed vocabulary with a seeded RNG, so
+the same parameters always produce the same bytes.
+"""
+
+import os
+import random
+import subprocess
+
+WORDS = (
+    "the of and to a in that he was it his her with as had for she you not on be at by "
+    "which but have from this they all were my one so said him there would when an what "
+    "been no if more their who or out them into could upon will about then some time now "
+    "little very man such only must before any great over being well old our other made "
+    "house long thought came through good never much down again after might door hand "
+    "evening letter morning garden window carriage silence lady gentleman captain river "
+    "country fortune moment countenance astonishment presently perhaps nevertheless"
+).split()
+
+OPF_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" dir="ltr" prefix="se: https://standardebooks.org/vocab/1.0" unique-identifier="uid" version="3.0" xml:lang="en-US">
+	<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+		<dc:identifier id="uid">url:https://standardebooks.org/ebooks/{name}</dc:identifier>
+		<dc:title id="title">{title}</dc:title>
+		<dc:creator id="author">{author}</dc:creator>
+		<dc:language>en-US</dc:language>
+		<dc:subject>Fiction</dc:subject>
+		<meta property="dcterms:modified">2024-01-01T00:00:00Z</meta>
+	</metadata>
+	<manifest>
+{manifest}
+	</manifest>
+	<spine>
+{spine}
+	</spine>
+</package>
+'''
+
+XHTML_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" epub:prefix="z3998: http://www.daisy.org/z3998/2012/vocab/structure/, se: https://standardebooks.org/vocab/1.0" xml:lang="en-US">
+	<head>
+		<title>{title}</title>
+		<link href="../css/core.css" rel="stylesheet" type="text/css"/>
+		<link href="../css/local.css" rel="stylesheet" type="text/css"/>
+	</head>
+	<body epub:type="{body_type}">
+{body}
+	</body>
+</html>
+'''
+
+FRONT_MATTER = ["titlepage", "imprint", "dedication"]
+BACK_MATTER = ["colophon", "uncopyright"]
+
+
+def _sentence(rng, min_words=6, max_words=24):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + rng.choice([".", ".", ".", "!", "?"])
+
+
+def _paragraph(rng, words, note_ids):
+    sentences = []
+    count = 0
+    while count < words:
+        sentence = _sentence(rng)
+        count += sentence.count(" ") + 1
+        if rng.random() < 0.1:
+            # Italicised foreign phrase or ship name, as SE marks them up
+            sentence = sentence.replace(" ", f' <i xml:lang="fr">{rng.choice(WORDS)}</i> ', 1)
+        if note_ids and rng.random() < 0.05:
+            note = note_ids.pop(0)
+            sentence += f'<a href="endnotes.xhtml#note-{note}" id="noteref-{note}" epub:type="noteref">{note}</a>'
+        sentences.append(sentence)
+    return " ".join(sentences)
+
+
+def _chapter(rng, number, paragraphs, words, note_ids):
+    lines = [
+        f'\t\t<section id="chapter-{number}" data-parent="book-1" epub:type="chapter">',
+        f'\t\t\t<h2 epub:type="ordinal z3998:roman">{_roman(number)}</h2>',
+    ]
+    for i in range(paragraphs):
+        if i and rng.random() < 0.03:
+            lines.append("\t\t\t<hr/>")
+        if rng.random() < 0.04:
+            lines.append("\t\t\t<blockquote>")
+            lines.append(f"\t\t\t\t<p>{_paragraph(rng, words // 2, [])}</p>")
+            lines.append("\t\t\t</blockquote>")
+        lines.append(f"\t\t\t<p>{_paragraph(rng, words, note_ids)}</p>")
+    lines.append("\t\t</section>")
+    return "\n".join(lines)
+
+
+def _endnotes(rng, count):
+    lines = [
+        '\t\t<section id="endnotes" epub:type="backmatter endnotes">',
+        '\t\t\t<h2 epub:type="title">Endnotes</h2>',
+        "\t\t\t<ol>",
+    ]
+    for note in range(1, count + 1):
+        lines.append(f'\t\t\t\t<li id="note-{note}" epub:type="endnote">')
+        lines.append(f'\t\t\t\t\t<p>{_sentence(rng)} <a href="chapter-1.xhtml#noteref-{note}" epub:type="backlink">↩</a></p>')
+        lines.append("\t\t\t\t</li>")
+    lines += ["\t\t\t</ol>", "\t\t</section>"]
+    return "\n".join(lines)
+
+
+def _roman(number):
+    numerals = [(1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+                (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I")]
+    out = ""
+    for value, numeral in numerals:
+        while number >= value:
+            out += numeral
+            number -= value
+    return out
+
+
+def generate_book(name, chapters=30, paragraphs=40, words=90, endnotes=20, seed=0):
+    """
+    Return the src/epub tree of a synthetic book as {relative path: bytes}.
+    A book with the defaults has about 700 KB of chapter XHTML, the size of a typical novel.
+    """
+    rng = random.Random(f"{name}:{seed}")
+    title = " ".join(rng.choice(WORDS) for _ in range(3)).title()
+    author = f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+    files = {}
+    spine = []
+
+    def add(file_id, title_text, body_type, body):
+        files[f"text/{file_id}.xhtml"] = XHTML_TEMPLATE.format(
+            title=title_text, body_type=body_type, body=body
+        ).encode("utf-8")
+        spine.append(file_id)
+
+    for matter in FRONT_MATTER:
+        add(matter, matter.title(), "frontmatter", f'\t\t<section id="{matter}" epub:type="{matter}">\n'
+            f"\t\t\t<p>{_sentence(rng)}</p>\n\t\t</section>")
+    note_ids = list(range(1, endnotes + 1))
+    for number in range(1, chapters + 1):
+        add(f"chapter-{number}", _roman(number), "bodymatter z3998:fiction",
+            _chapter(rng, number, paragraphs, words, note_ids))
+    if endnotes:
+        add("endnotes", "Endnotes", "backmatter", _endnotes(rng, endnotes))
+    for matter in BACK_MATTER:
+        add(matter, matter.title(), "backmatter", f'\t\t<section id="{matter}" epub:type="{matter}">\n'
+            f"\t\t\t<p>{_sentence(rng)}</p>\n\t\t</section>")
+
+    files["text/toc.xhtml"] = XHTML_TEMPLATE.format(
+        title="Table of Contents", body_type="frontmatter",
+        body="\n".join(f'\t\t<a href="{item}.xhtml">{item}</a>' for item in spine)
+    ).encode("utf-8")
+    files["css/core.css"] = b"p { text-indent: 1em; }\n"
+    files["css/local.css"] = b"h2 { text-align: center; }\n"
+
+    manifest = [
+        f'\t\t<item href="text/{item}.xhtml" id="{item}.xhtml" media-type="application/xhtml+xml"/>'
+        for item in spine + ["toc"]
+    ] + [
+        '\t\t<item href="css/core.css" id="core.css" media-type="text/css"/>',
+        '\t\t<item href="css/local.css" id="local.css" media-type="text/css"/>',
+    ]
+    files["content.opf"] = OPF_TEMPLATE.format(
+        name=name, title=title, author=author,
+        manifest="\n".join(manifest),
+        spine="\n".join(f'\t\t<itemref idref="{item}.xhtml"/>' for item in spine),
+    ).encode("utf-8")
+    return files
+
+
+def write_book(root, name, **options):
+    """
+    Write a synthetic book to `root`/`name`/src/epub and return the repo directory.
+    `options` are passed to `generate_book`.
+    """
+    repo_dir = os.path.join(root, name)
+    epub_dir = os.path.join(repo_dir, "src", "epub")
+    for rel_path, data in generate_book(name, **options).items():
+        path = os.path.join(epub_dir, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return repo_dir
+
+
+def _git(args, cwd):
+    subprocess.run(
+        ["git", "-c", "user.name=Benchmark", "-c", "user.email=benchmark@example.com"] + args,
+        cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def create_repos(root, count, prefix="synthetic-book", **options):
+    """
+    Create `count` git repos of synthetic books under `root`, as the
+    GitHub API would list them but with file:// clone URLs.
+    Returns the repo list in the format of src/github_api.fetch_repo_list.
+    """
+    repos = []
+    for i in range(count):
+        name = f"{prefix}-{i:04d}"
+        repo_dir = write_book(root, name, seed=i, **options)
+        _git(["init", "-q", "-b", "master"], repo_dir)
+        # Needed for the --filter=blob:none clones of the git and mirror backends
+        _git(["config", "uploadpack.allowFilter", "true"], repo_dir)
+        _git(["add", "-A"], repo_dir)
+        _git(["commit", "-q", "-m", "Initial commit"], repo_dir)
+        url = "file://" + os.path.abspath(repo_dir)
+        repos.append({
+            "name": name,
+            "link": url,
+            "updated_at": "2024-01-01T00:00:00Z",
+            "clone_url": url,
+            "default_branch": "master",
+        })
+    return repos
@@ -0,0 +1,301 @@
+"""
+run.py
+
+Benchmark harness for the dataset builder.
+
+Benchmarks:
+- parse.memory / parse.directory: parse_opf_and_extract_text throughput in
+  MB/s of source XHTML, over in-memory files and over a src/epub checkout.
+- update_dataset.rows_N: milliseconds per update_dataset call (half replacing
+  an existing book, half adding one) once the store holds N rows, and
+  compact_dataset.rows_N: seconds to compact N rows.
+- end_to_end.<fetch>: books per second of a full `main.py` run against local
+  file:// git repos of synthetic books (benchmarks/corpus.py), plus
+  end_to_end.<fetch>.noop: seconds of a second run with nothing to do. The
+  stage totals of the run's run_report.json are included.
+
+Results are written as JSON together with the commit, Python and pyarrow
+versions and the machine, and `--compare old.json` reports every benchmark
+that got worse by more than `--threshold` (exit status 1 if any did).
+
+    python -m benchmarks.run --out bench_results.json
+    python -m benchmarks.run --quick --compare bench_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+
+import pyarrow as pa
+
+from benchmarks.corpus import WORDS, generate_book, write_book, create_repos
+from src.opf_parser import parse_opf_and_extract_text
+from src.dataset import update_dataset, update_dataset_batch, compact_dataset
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = "bench_results.json"
+BENCHMARKS = ("parse", "update", "e2e")
+DEFAULT_THRESHOLD = 0.1
+
+FULL = {
+    "parse_books": 8, "repeat": 3,
+    "update_sizes": (250, 500, 1000, 2000), "updates": 40, "text_kb": 64,
+    "e2e_books": 24, "e2e_fetch": ("git", "mirror"), "e2e_workers": 4,
+    "book": {},
+}
+QUICK = {
+    "parse_books": 2, "repeat": 1,
+    "update_sizes": (50, 100), "updates": 10, "text_kb": 8,
+    "e2e_books": 4, "e2e_fetch": ("git",), "e2e_workers": 1,
+    "book": {"chapters": 6, "paragraphs": 20},
+}
+
+
+def _result(value, unit, higher_is_better, **details):
+    return {"value": round(value, 6), "unit": unit, "higher_is_better": higher_is_better, **details}
+
+
+def _source_bytes(files):
+    return sum(len(data) for path, data in files.items() if path.endswith((".xhtml", ".opf")))
+
+
+def bench_parse(books=8, repeat=3, **book_options):
+    """
+    Throughput of parse_opf_and_extract_text over in-memory files and a directory tree.
+    """
+    corpus = [generate_book(f"parse-book-{i}", seed=i, **book_options) for i in range(books)]
+    source_bytes = sum(_source_bytes(files) for files in corpus)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        epub_dirs = [
+            os.path.join(write_book(tmp, f"parse-book-{i}", seed=i, **book_options), "src", "epub")
+            for i in range(books)
+        ]
+        for mode, sources in (("memory", corpus), ("directory", epub_dirs)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                text_chars = sum(len(parse_opf_and_extract_text(source)["text"]) for source in sources)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[f"parse.{mode}"] = _result(
+                source_bytes / best / 1024**2, "MB/s", True,
+                books=books, source_mb=round(source_bytes / 1024**2, 3), seconds=round(best, 6),
+                books_per_second=round(books / best, 3), text_chars=text_chars,
+            )
+    return results
+
+
+def _book_entry(rng, index, text_kb, revision=0):
+    words = []
+    size = 0
+    while size < text_kb * 1024:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return {
+        "link": f"https://example.com/book-{index}",
+        "title": f"Book {index}",
+        "author": f"Author {index % 97}",
+        "text": f"# Revision {revision}\n\n" + " ".join(words),
+        "language": "en-US",
+    }
+
+
+def bench_update_dataset(sizes=(250, 500, 1000, 2000), updates=40, text_kb=64, seed=0):
+    """
+    Cost of one update_dataset call and of compaction as the store grows.
+    """
+    rng = random.Random(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books_dataset.arrow")
+        rows = 0
+        for size in sizes:
+            while rows < size:
+                count = min(100, size - rows)
+                update_dataset_batch([_book_entry(rng, rows + i, text_kb) for i in range(count)], dataset_path)
+                rows += count
+            start = time.perf_counter()
+            compact_dataset(dataset_path)
+            compact_seconds = time.perf_counter() - start
+
+            timings = []
+            for i in range(updates):
+                # Alternate between a changed existing book and a new one
+                index = rng.randrange(rows) if i % 2 == 0 else rows
+                entry = _book_entry(rng, index, text_kb, revision=i + 1)
+                start = time.perf_counter()
+                update_dataset(entry, dataset_path)
+                timings.append(time.perf_counter() - start)
+                if index == rows:
+                    rows += 1
+            timings.sort()
+            results[f"update_dataset.rows_{size}"] = _result(
+                sum(timings) / len(timings) * 1000, "ms", False,
+                rows=size, updates=updates, text_kb=text_kb,
+                p50_ms=round(timings[len(timings) // 2] * 1000, 3), max_ms=round(timings[-1] * 1000, 3),
+            )
+            results[f"compact_dataset.rows_{size}"] = _result(compact_seconds, "s", False, rows=size)
+    return results
+
+
+def _run_main(workdir, args):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    # Local repos: change detection falls back to git ls-remote
+    env.pop("GITHUB_TOKEN", None)
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_ROOT, "main.py")] + args,
+        cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def bench_end_to_end(books=24, fetch_modes=("git", "mirror"), workers=4, **book_options):
+    """
+    Full main.py runs over local file:// repos, one fresh working directory per fetch backend.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        repos = create_repos(os.path.join(tmp, "remotes"), books, **book_options)
+        source_bytes = sum(
+            _source_bytes(generate_book(repo["name"], seed=i, **book_options)) for i, repo in enumerate(repos)
+        )
+        repo_list = os.path.join(tmp, "repos.json")
+        with open(repo_list, "w", encoding="utf-8") as f:
+            json.dump(repos, f)
+
+        for fetch in fetch_modes:
+            workdir = os.path.join(tmp, f"run-{fetch}")
+            os.makedirs(workdir)
+            args = ["--repo-list", repo_list, "--fetch", fetch, "--workers", str(workers), "--no-md-cache"]
+            seconds = _run_main(workdir, args)
+            with open(os.path.join(workdir, "run_report.json"), "r", encoding="utf-8") as f:
+                report = json.load(f)
+            results[f"end_to_end.{fetch}"] = _result(
+                books / seconds, "books/s", True,
+                books=books, workers=workers, seconds=round(seconds, 6),
+                source_mb_per_second=round(source_bytes / seconds / 1024**2, 3),
+                written=report["counters"].get("written", 0),
+                stages={stage: s["total_seconds"] for stage, s in report["stages"].items()},
+            )
+            # Nothing changed: only the listing and change detection should run
+            seconds = _run_main(workdir, args)
+            results[f"end_to_end.{fetch}.noop"] = _result(seconds, "s", False, books=books)
+            shutil.rmtree(workdir)
+    return results
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True, text=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, check=True, text=True
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def environment():
+    commit, dirty = _git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "pyarrow": pa.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(only=BENCHMARKS, config=FULL):
+    results = {}
+    if "parse" in only:
+        results.update(bench_parse(config["parse_books"], config["repeat"], **config["book"]))
+    if "update" in only:
+        results.update(bench_update_dataset(config["update_sizes"], config["updates"], config["text_kb"]))
+    if "e2e" in only:
+        results.update(bench_end_to_end(
+            config["e2e_books"], config["e2e_fetch"], config["e2e_workers"], **config["book"]
+        ))
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two `benchmarks` dicts. Returns a list of
+    (name, old value, new value, relative change, regressed), where a positive
+    change is an improvement and `regressed` means worse by more than `threshold`.
+    """
+    rows = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or not old["value"] or old.get("unit") != result["unit"]:
+            continue
+        change = (result["value"] - old["value"]) / old["value"]
+        if not result["higher_is_better"]:
+            change = -change
+        rows.append((name, old["value"], result["value"], change, change < -threshold))
+    return rows
+
+
+def write_results(path, results):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "benchmarks": results}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parsing, dataset updates and full builds.")
+    parser.add_argument(
+        "--only", default=",".join(BENCHMARKS),
+        help=f"Comma-separated benchmarks to run, of {', '.join(BENCHMARKS)} (default: all)."
+    )
+    parser.add_argument("--quick", action="store_true", help="Small corpus and sizes, for a smoke run.")
+    parser.add_argument("--out", default=RESULTS_FILE, help=f"JSON results file (default: {RESULTS_FILE}).")
+    parser.add_argument("--compare", default=None, help="Results file of an earlier run to compare against.")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help=f"Relative slowdown reported as a regression (default: {DEFAULT_THRESHOLD})."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    only = [name.strip() for name in args.only.split(",") if name.strip()]
+    unknown = set(only) - set(BENCHMARKS)
+    if unknown:
+        sys.exit(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = run_benchmarks(only, QUICK if args.quick else FULL)
+    # Read the baseline first: --compare and --out may be the same file
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    write_results(args.out, results)
+    for name, result in results.items():
+        print(f"{name:40} {result['value']:12.3f} {result['unit']}")
+    print(f"Results written to {args.out}.")
+    if baseline is not None:
+        rows = compare(results, baseline["benchmarks"], args.threshold)
+        print(f"\nCompared to {baseline['environment'].get('commit') or args.compare}:")
+        for name, old, new, change, regressed in rows:
+            print(f"{name:40} {old:12.3f} -> {new:12.3f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+        if any(row[4] for row in rows):
+            sys.exit(1)
@@ -1,73 +1,338 @@
 import os
-from tqdm import tqdm
+import sys
+import json
+import argparse
+from functools import partial
+from collections import Counter
 
-from src.github_api import fetch_repo_list
+from src.github_api import fetch_repo_list, make_github_session
+from src.change_detection import annotate_content_shas, needs_processing, carry_over_shas
+from src.http_cache import HTTPCache
 from src.downloader import download_repo, cleanup_repo
+from src.git_blobs import clone_objects, GitBlobFiles
+from src.archive import archive_url, fetch_epub_archive
+from src.local_source import find_local_books, open_local_book
+from src.mirror_cache import MirrorCache
+from src.md_cache import MarkdownCache
 from src.opf_parser import parse_opf_and_extract_text
-from src.dataset import update_dataset
-from src.progress import load_books_list, save_books_list
+from src.dataset import update_dataset, compact_dataset
+from src.chapters import update_chapters, stored_text_hash, compact_chapters
+from src.progress import ProgressJournal
+from src.pipeline import run_pipeline
+from src.metrics import RunMetrics, timed, profile_call, keep_slowest_profiles
+from src.sharding import parse_shard, in_shard, shard_path, merge_main
 
 BOOKS_LIST_FILE = "books_list.json"
+JOURNAL_FILE = "progress.jsonl"
 DATASET_FILE = "books_dataset.arrow"
+CHAPTERS_FILE = "books_chapters.arrow"
 TMP_ROOT = "tmp_books"
+MIRROR_CACHE_DIR = "mirror_cache"
+MD_CACHE_FILE = "markdown_cache.sqlite"
+GITHUB_CACHE_FILE = "github_cache.json"
+RUN_REPORT_FILE = "run_report.json"
+# Files a --shard build suffixes with its shard and `main.py merge` combines
+OUTPUT_FILES = {
+    "dataset": DATASET_FILE,
+    "chapters": CHAPTERS_FILE,
+    "journal": JOURNAL_FILE,
+    "books_list": BOOKS_LIST_FILE,
+}
+PROFILE_DIR = "profiles"
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Standard Ebooks dataset.")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of processes used to parse books (default: 1, parse inline)."
+    )
+    parser.add_argument(
+        "--clones", type=int, default=4,
+        help="Number of concurrent git clones (default: 4)."
+    )
+    parser.add_argument(
+        "--max-checkouts", type=int, default=8,
+        help="Maximum number of checkouts in the temp directory at once (default: 8)."
+    )
+    parser.add_argument(
+        "--fetch", choices=["git", "blobs", "archive", "mirror"], default="git",
+        help="How to fetch src/epub: sparse git checkout, a bare clone read with git cat-file "
+             "(no working tree), an in-memory tar.gz archive download, "
+             "or incremental fetches into the persistent mirror cache."
+    )
+    parser.add_argument(
+        "--mirror-cache", default=MIRROR_CACHE_DIR,
+        help=f"Directory of bare git mirrors used by --fetch mirror (default: {MIRROR_CACHE_DIR})."
+    )
+    parser.add_argument(
+        "--mirror-cache-max-gb", type=float, default=20.0,
+        help="Evict least recently used mirrors beyond this size (default: 20)."
+    )
+    parser.add_argument(
+        "--md-cache", default=MD_CACHE_FILE,
+        help=f"SQLite cache of converted chapters, keyed on the XHTML bytes (default: {MD_CACHE_FILE})."
+    )
+    parser.add_argument(
+        "--md-cache-max-mb", type=float, default=2048,
+        help="Evict least recently used chapters beyond this size (default: 2048)."
+    )
+    parser.add_argument(
+        "--no-md-cache", action="store_true",
+        help="Convert every chapter, without reading or filling the chapter cache."
+    )
+    parser.add_argument(
+        "--shard", type=parse_shard, default=None, metavar="i/N",
+        help="Only build the repos whose name hashes to shard i of N (0-based), into shard-suffixed "
+             "output files (e.g. books_dataset.shard-0-of-4.arrow). Combine them with `main.py merge`."
+    )
+    parser.add_argument(
+        "--no-chapters", action="store_true",
+        help=f"Do not write the per-chapter companion table ({CHAPTERS_FILE})."
+    )
+    parser.add_argument(
+        "--repo-list", default=None,
+        help="Read the repo list from this JSON file (same fields as the GitHub API listing) "
+             "instead of fetching it, e.g. to build from local file:// repos."
+    )
+    parser.add_argument(
+        "--local", default=None,
+        help="Build from the .epub files and repo checkouts in this directory instead of GitHub. "
+             ".epub files are read in place, without extracting them."
+    )
+    parser.add_argument(
+        "--metrics-report", default=RUN_REPORT_FILE,
+        help=f"JSON report of per-stage timings and memory of the run (default: {RUN_REPORT_FILE})."
+    )
+    parser.add_argument(
+        "--prometheus-textfile", default=None,
+        help="Also write the run metrics to this file for node_exporter's textfile collector."
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Record the tracemalloc peak of each stage (slower)."
+    )
+    parser.add_argument(
+        "--profile-slowest", type=int, default=0,
+        help="Profile parsing with cProfile and keep the dumps of the N slowest books (default: 0, off)."
+    )
+    parser.add_argument(
+        "--profile-dir", default=PROFILE_DIR,
+        help=f"Directory of the cProfile dumps, one <book>.prof each (default: {PROFILE_DIR})."
+    )
+    args = parser.parse_args(argv)
+    if args.local and args.repo_list:
+        parser.error("--local and --repo-list are mutually exclusive")
+    return args
+
+def make_book_entry(repo, book):
+    """
+    Build the dataset row for a parsed book.
+    """
+    return {
+        "link": repo["link"],
+        "title": book["title"] or "",
+        "author": book["author"] or "",
+        "text": book["text"],
+        "language": book["language"] or "",
+        "text_hash": book.get("text_hash")
+    }
+
+def main(argv=None):
     """
     Orchestrate the dataset initialization process:
-    1. Fetch repo list.
-    2. Compare to old list.
-    3. For each repo to process:
-        - Download
-        - Parse and extract
-        - Update dataset
+    1. Fetch repo list and the src/epub tree (or head commit) SHA of each repo.
+    2. Compare the SHAs to the old list.
+    3. Run each repo through the concurrent pipeline (src/pipeline.py):
+        - Download (--clones N at a time; --fetch blobs/archive/mirror skip the git checkout;
+          --local reads .epub files and checkouts from a directory instead)
+        - Parse and extract (in a process pool with --workers N)
+        - Update dataset (and the chapters table, unless --no-chapters)
         - Cleanup
+    Per-stage timings and memory go to --metrics-report (src/metrics.py).
+
+    `main.py merge [DIR ...]` instead merges the outputs of --shard builds (src/sharding.py).
     """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] == "merge":
+        merge_main(argv[1:], OUTPUT_FILES)
+        return
+    args = parse_args(argv)
+    dataset_file = shard_path(DATASET_FILE, args.shard)
+    chapters_file = shard_path(CHAPTERS_FILE, args.shard)
+    metrics_report = shard_path(args.metrics_report, args.shard)
     os.makedirs(TMP_ROOT, exist_ok=True)
-    fresh_repos = fetch_repo_list()
+    metrics = RunMetrics(trace_memory=args.trace_memory)
+    # Conditional requests: unchanged pages of the repo list come back as 304
+    session = make_github_session()
+    with timed(metrics, "fetch_list"):
+        if args.local:
+            fresh_repos = find_local_books(args.local)
+        elif args.repo_list:
+            with open(args.repo_list, "r", encoding="utf-8") as f:
+                fresh_repos = json.load(f)
+        else:
+            fresh_repos = fetch_repo_list(cache=HTTPCache(GITHUB_CACHE_FILE), session=session)
+    if args.shard:
+        fresh_repos = [repo for repo in fresh_repos if in_shard(repo, args.shard)]
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(fresh_repos)} repos.")
+    if not args.local:
+        # Local books are compared by modification time
+        with timed(metrics, "change_detection"):
+            annotate_content_shas(fresh_repos, session=session, token=os.environ.get("GITHUB_TOKEN"))
 
-    # Load previous successful list
-    old_list = load_books_list(BOOKS_LIST_FILE)
-    # Only process if not present or updated
+    # Per-book progress of earlier runs; books_list.json is its snapshot of written books
+    journal = ProgressJournal(shard_path(JOURNAL_FILE, args.shard), shard_path(BOOKS_LIST_FILE, args.shard))
+    # Only process if not present or its src/epub content changed
     to_process = []
+    # Books an interrupted run left checked out, at the same content
+    resumable = set()
     for repo in fresh_repos:
-        old = old_list.get(repo["name"])
-        if not old or repo["updated_at"] > old["updated_at"]:
+        old = journal.written.get(repo["name"])
+        if needs_processing(repo, old):
             to_process.append(repo)
-    print(f"{len(to_process)} repos to process (new or updated).")
+            previous = journal.entry(repo["name"])
+            if (previous and previous["state"] in ("downloaded", "parsed")
+                    and not needs_processing(repo, previous["repo"])):
+                resumable.add(repo["name"])
+            journal.record(repo, "queued")
+        elif repo != old:
+            # Metadata-only update: record the new updated_at and SHAs without reprocessing,
+            # keeping stored SHAs this run could not resolve
+            repo = carry_over_shas(repo, old)
+            if repo != old:
+                journal.record(repo, "written")
+    print(f"{len(to_process)} repos to process (new or content changed).")
+
+    changes = Counter()
+    # cProfile dump of each parsed book, with --profile-slowest
+    profiles = {}
+
+    def write_book(repo, book):
+        # Single writer: only the main process touches the dataset
+        if book:
+            metrics.record_timings(repo["name"], book.pop("timings", {}))
+            if "profile_path" in book:
+                profiles[repo["name"]] = book.pop("profile_path")
+        if not book or not book.get("text"):
+            print(f"Failed to extract book text for {repo['name']}, skipping.")
+            return False
+        chapters = book.pop("chapters", None)
+        if chapters is not None:
+            # Compared with the book's own hash, so a crash between the two writes heals on the next run
+            with timed(metrics, "chapters_write", repo["name"]):
+                if stored_text_hash(repo["link"], chapters_file) != book["text_hash"]:
+                    update_chapters(repo["link"], chapters, chapters_file, text_hash=book["text_hash"])
+        # Rows whose text hash and metadata are unchanged are not rewritten
+        with timed(metrics, "dataset_write", repo["name"]):
+            changes[update_dataset(make_book_entry(repo, book), dataset_file)] += 1
+
+    def record_state(repo, state, error=None):
+        with timed(metrics, "progress_save", repo["name"]):
+            journal.record(repo, state, error)
+        if state in ("written", "failed"):
+            metrics.count(state)
+
+    def fetch_epub_from_archive(repo):
+        with timed(metrics, "fetch_archive", repo["name"]):
+            files = fetch_epub_archive(archive_url(repo))
+        if "content.opf" not in files:
+            print(f"src/epub not found in {repo['name']}, skipping.")
+            return None, None
+        return None, files
+
+    mirror_cache = None
+    if args.fetch == "mirror":
+        mirror_cache = MirrorCache(args.mirror_cache, max_bytes=int(args.mirror_cache_max_gb * 1024**3))
+
+    def fetch_epub_from_mirror(repo):
+        with timed(metrics, "fetch_mirror", repo["name"]):
+            files = mirror_cache.fetch_epub(
+                repo["clone_url"], repo["name"], branch=repo.get("default_branch", "master")
+            )
+        if "content.opf" not in files:
+            print(f"src/epub not found in {repo['name']}, skipping.")
+            return None, None
+        return None, files
+
+    def fetch_local_book(repo):
+        # Only reads META-INF/container.xml; members are read by the parser
+        with timed(metrics, "open_local", repo["name"]):
+            return None, open_local_book(repo)
+
+    def fetch_epub(repo):
+        tmp_dir = os.path.join(TMP_ROOT, repo["name"])
+        epub_dir = os.path.join(tmp_dir, "src", "epub")
+        if repo["name"] in resumable and os.path.isdir(epub_dir):
+            print(f"Reusing checkout of {repo['name']} from the interrupted run.")
+            return tmp_dir, epub_dir
+        download_repo(
+            repo["clone_url"], tmp_dir, branch=repo.get("default_branch", "master"),
+            metrics=metrics, book=repo["name"]
+        )
+        if not os.path.exists(epub_dir):
+            print(f"src/epub not found in {repo['name']}, skipping.")
+            return tmp_dir, None
+        return tmp_dir, epub_dir
+
+    def fetch_epub_blobs(repo):
+        tmp_dir = os.path.join(TMP_ROOT, repo["name"] + ".git")
+        tree = clone_objects(
+            repo["clone_url"], tmp_dir, branch=repo.get("default_branch", "master"),
+            metrics=metrics, book=repo["name"]
+        )
+        if "content.opf" not in tree:
+            print(f"src/epub not found in {repo['name']}, skipping.")
+            return tmp_dir, None
+        return tmp_dir, GitBlobFiles(tmp_dir, tree)
+
+    md_cache = None
+    with_chapters = not args.no_chapters
+    parse_book = partial(parse_opf_and_extract_text, measure=True, with_chapters=with_chapters)
+    if not args.no_md_cache:
+        md_cache = MarkdownCache(args.md_cache, max_bytes=int(args.md_cache_max_mb * 1024**2))
+        cache_before = md_cache.stats()
+        parse_book = partial(parse_opf_and_extract_text, md_cache=md_cache, measure=True, with_chapters=with_chapters)
+    if args.profile_slowest > 0:
+        parse_book = partial(profile_call, args.profile_dir, parse_book)
 
-    successful_repos = dict(old_list)
     try:
-        for repo in tqdm(to_process, desc="Processing books"):
-            tmp_dir = os.path.join(TMP_ROOT, repo["name"])
-            try:
-                download_repo(repo["clone_url"], tmp_dir, branch=repo.get("default_branch", "master"))
-                epub_dir = os.path.join(tmp_dir, "src", "epub")
-                if not os.path.exists(epub_dir):
-                    print(f"src/epub not found in {repo['name']}, skipping.")
-                    continue
-                book = parse_opf_and_extract_text(epub_dir)
-                if not book or not book.get("text"):
-                    print(f"Failed to extract book text for {repo['name']}, skipping.")
-                    continue
-                book_entry = {
-                    "link": repo["link"],
-                    "title": book["title"] or "",
-                    "author": book["author"] or "",
-                    "text": book["text"],
-                    "language": book["language"] or ""
-                }
-                update_dataset(book_entry, DATASET_FILE)
-                successful_repos[repo["name"]] = repo
-                save_books_list(successful_repos, BOOKS_LIST_FILE)
-                cleanup_repo(tmp_dir)
-
-
-            except Exception as e:
-                print(f"Exception for {repo['name']}: {e}")
+        run_pipeline(
+            to_process,
+            fetch_local_book if args.local else
+            {
+                "git": fetch_epub, "blobs": fetch_epub_blobs,
+                "archive": fetch_epub_from_archive, "mirror": fetch_epub_from_mirror,
+            }[args.fetch],
+            parse_book, write_book, cleanup_repo,
+            clone_workers=args.clones, parse_workers=args.workers, max_checkouts=args.max_checkouts,
+            on_state=record_state
+        )
     except KeyboardInterrupt:
         print("\nInterrupted by user. Cleaning up and exiting.")
     finally:
-        pass
+        journal.close()
+        with timed(metrics, "dataset_compact"):
+            compact_dataset(dataset_file)
+            compact_chapters(chapters_file)
+        print(f"Content changes: {changes['new']} new, {changes['text_changed']} text changed, "
+              f"{changes['metadata_changed']} metadata only, {changes['unchanged']} unchanged (not rewritten).")
+        if md_cache is not None:
+            cache_after = md_cache.stats()
+            md_cache.close()
+            hits = cache_after["hits"] - cache_before["hits"]
+            misses = cache_after["misses"] - cache_before["misses"]
+            print(f"Chapter cache: {hits} hits, {misses} misses, "
+                  f"{cache_after['entries']} entries ({cache_after['bytes'] / (1024*1024):.1f} MB).")
+        if args.profile_slowest > 0:
+            kept = keep_slowest_profiles(metrics, profiles, args.profile_slowest)
+            print(f"Kept {len(kept)} parse profiles of the slowest books in {args.profile_dir}.")
+        summary = metrics.write_report(metrics_report)
+        if args.prometheus_textfile:
+            metrics.write_prometheus(args.prometheus_textfile)
+        slowest = ", ".join(f"{b['book']} ({b['total_seconds']:.1f}s)" for b in summary["slowest_books"][:3])
+        print(f"Run report written to {metrics_report} "
+              f"({summary['duration_seconds']:.1f}s, peak RSS {summary['peak_rss_bytes'] / (1024*1024):.0f} MB). "
+              f"Slowest books: {slowest or 'none'}.")
     print("Dataset update complete.")
 
 if __name__ == "__main__":
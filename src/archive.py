@@ -0,0 +1,91 @@
+"""
+archive.py
+
+Alternative fetch backend: downloads a repository archive (tar.gz or zip) at a
+given ref and keeps only the src/epub entries, in memory.
+
+Unlike the git backend this needs a single HTTP request per book and never
+writes a working tree to disk. The result is a mapping of paths relative to
+src/epub to bytes, which `parse_opf_and_extract_text` accepts directly.
+"""
+
+import io
+import tarfile
+import zipfile
+import posixpath
+import requests
+
+EPUB_PREFIX = "src/epub/"
+ARCHIVE_URL_TEMPLATE = "{link}/archive/refs/heads/{branch}.tar.gz"
+
+
+def archive_url(repo, template=ARCHIVE_URL_TEMPLATE):
+    """
+    Build the archive URL of a repo dict from fetch_repo_list.
+    """
+    return template.format(
+        link=repo["link"].rstrip("/"),
+        name=repo["name"],
+        branch=repo.get("default_branch", "master"),
+    )
+
+
+def _epub_relative_path(member_name):
+    """
+    Map an archive member name to its path relative to src/epub, or None.
+    GitHub archives wrap everything in a single `<repo>-<ref>/` directory.
+    """
+    parts = member_name.split("/", 1)
+    if len(parts) != 2:
+        return None
+    path = posixpath.normpath(parts[1])
+    if not path.startswith(EPUB_PREFIX):
+        return None
+    return path[len(EPUB_PREFIX):]
+
+
+def extract_epub_from_tar(fileobj, mode="r|gz"):
+    """
+    Stream a tar.gz archive and collect the src/epub files.
+    The archive is read sequentially, so `fileobj` may be a network stream or a pipe.
+    """
+    files = {}
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            rel_path = _epub_relative_path(member.name)
+            if not rel_path:
+                continue
+            files[rel_path] = tar.extractfile(member).read()
+    return files
+
+
+def extract_epub_from_zip(fileobj):
+    """
+    Collect the src/epub files of a zip archive (zip needs a seekable file).
+    """
+    files = {}
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            rel_path = _epub_relative_path(info.filename)
+            if rel_path:
+                files[rel_path] = archive.read(info)
+    return files
+
+
+def fetch_epub_archive(url, session=None, timeout=300):
+    """
+    Download the archive at `url` and return its src/epub files as {relative path: bytes}.
+    tar.gz archives are streamed; zip archives are buffered in memory because
+    their index sits at the end of the file.
+    """
+    http = session or requests
+    with http.get(url, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        if url.endswith(".zip"):
+            return extract_epub_from_zip(io.BytesIO(resp.content))
+        return extract_epub_from_tar(resp.raw)
@@ -0,0 +1,144 @@
+"""
+change_detection.py
+
+Detect which books changed content since the last run.
+
+GitHub's `updated_at` also moves on stars, description and topic edits, so it
+re-queues books whose text never changed. Instead each repo is tagged with the
+SHA of its `src/epub` tree (one batched GraphQL query per 50 repos, when a
+token is available) or, failing that, the head commit of its default branch
+(`git ls-remote`, no token needed). The SHAs are stored in books_list.json and
+a book is only reprocessed when its SHA differs from the stored one.
+"""
+
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+GITHUB_GRAPHQL = "https://api.github.com/graphql"
+GRAPHQL_BATCH_SIZE = 50
+
+# Keys written to each repo dict, most specific first
+SHA_KEYS = ("epub_tree", "commit")
+
+
+def _owner_and_name(repo):
+    """
+    ("standardebooks", "author_title") from the repo's html link.
+    """
+    owner, name = repo["link"].rstrip("/").split("/")[-2:]
+    return owner, name
+
+
+def _graphql_query(batch):
+    fields = []
+    for i, repo in enumerate(batch):
+        owner, name = _owner_and_name(repo)
+        branch = repo.get("default_branch", "master")
+        fields.append(
+            f"r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ "
+            f"epub: object(expression: {json.dumps(branch + ':src/epub')}) {{ oid }} "
+            f"head: ref(qualifiedName: {json.dumps('refs/heads/' + branch)}) {{ target {{ oid }} }} }}"
+        )
+    return "query { " + " ".join(fields) + " }"
+
+
+def fetch_epub_trees(repos, session, url=GITHUB_GRAPHQL, batch_size=GRAPHQL_BATCH_SIZE, workers=4):
+    """
+    Query the src/epub tree SHA and head commit of every repo with batched GraphQL requests.
+    `session` must carry an Authorization header. Returns {name: {"epub_tree", "commit"}};
+    repos of failed batches are left out.
+    """
+    batches = [repos[i:i + batch_size] for i in range(0, len(repos), batch_size)]
+
+    def run_batch(batch):
+        try:
+            resp = session.post(url, json={"query": _graphql_query(batch)}, timeout=60)
+            resp.raise_for_status()
+            data = resp.json().get("data") or {}
+        except Exception as e:
+            print(f"GitHub GraphQL batch failed: {e}")
+            return {}
+        shas = {}
+        for i, repo in enumerate(batch):
+            result = data.get(f"r{i}")
+            if not result:
+                continue
+            shas[repo["name"]] = {
+                "epub_tree": (result.get("epub") or {}).get("oid"),
+                "commit": ((result.get("head") or {}).get("target") or {}).get("oid"),
+            }
+        return shas
+
+    shas = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(run_batch, batches):
+            shas.update(result)
+    return shas
+
+
+def ls_remote_heads(repos, workers=16, timeout=60):
+    """
+    Head commit of every repo's default branch via `git ls-remote`.
+    Returns {name: {"commit": sha}}; repos that fail are left out.
+    """
+    def ls_remote(repo):
+        branch = repo.get("default_branch", "master")
+        try:
+            out = subprocess.run(
+                ["git", "ls-remote", repo["clone_url"], f"refs/heads/{branch}"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                check=True, timeout=timeout, text=True
+            ).stdout
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            print(f"git ls-remote failed for {repo['clone_url']}")
+            return repo["name"], None
+        sha = out.split()[0] if out.strip() else None
+        return repo["name"], sha
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {name: {"commit": sha} for name, sha in executor.map(ls_remote, repos) if sha}
+
+
+def annotate_content_shas(repos, session=None, token=None):
+    """
+    Add "epub_tree" and/or "commit" to each repo dict in place.
+    Uses GraphQL when a token is given (it requires authentication), otherwise git ls-remote.
+    """
+    shas = {}
+    if token and session is not None:
+        shas = fetch_epub_trees(repos, session)
+    missing = [repo for repo in repos if repo["name"] not in shas]
+    if missing:
+        shas.update(ls_remote_heads(missing))
+    for repo in repos:
+        for key, value in shas.get(repo["name"], {}).items():
+            if value:
+                repo[key] = value
+    print(f"Content SHAs: {sum(1 for r in repos if 'epub_tree' in r)} src/epub trees, "
+          f"{sum(1 for r in repos if 'epub_tree' not in r and 'commit' in r)} head commits only, "
+          f"{sum(1 for r in repos if not any(k in r for k in SHA_KEYS))} unknown.")
+    return repos
+
+
+def needs_processing(repo, old):
+    """
+    Whether `repo` changed since `old` (its books_list.json entry, or None).
+    Compares the most specific SHA both entries have; falls back to `updated_at`.
+    """
+    if not old:
+        return True
+    for key in SHA_KEYS:
+        if repo.get(key) and old.get(key):
+            return repo[key] != old[key]
+    return repo["updated_at"] > old["updated_at"]
+
+
+def carry_over_shas(repo, old):
+    """
+    `repo` with the SHAs of `old` that this run did not resolve (e.g. GraphQL and
+    ls-remote failed for it). Only valid when the content is known to be unchanged,
+    i.e. `needs_processing(repo, old)` is False.
+    """
+    missing = {key: old[key] for key in SHA_KEYS if old and old.get(key) and not repo.get(key)}
+    return {**repo, **missing} if missing else repo
@@ -0,0 +1,126 @@
+"""
+chapters.py
+
+Companion table of the books dataset with one record per chapter.
+
+Chapters come from `src.opf_parser.iter_chapters` (spine index, file name,
+heading and Markdown text of every spine file that made it into the book's
+text). They are kept in the same append-only segmented Arrow store as the
+books (src/dataset.py), keyed by `link`: each row holds one book's chapters
+as a list of structs, so replacing a book's chapters tombstones the old row
+exactly like a book update. Each row also stores the `text_hash` of the
+book's text, so chapters of unchanged books are not rewritten.
+`iter_chapter_batches` flattens the rows into one row per chapter (link,
+spine_index, file_name, heading, text).
+"""
+
+import os
+import argparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from src.dataset import DatasetReader, append_segment, compact_dataset
+
+CHAPTER_TYPE = pa.struct([
+    ("spine_index", pa.int32()),
+    ("file_name", pa.string()),
+    ("heading", pa.string()),
+    ("text", pa.string()),
+])
+CHAPTERS_SCHEMA = pa.schema([
+    ("link", pa.string()),
+    ("text_hash", pa.string()),
+    ("chapters", pa.list_(CHAPTER_TYPE)),
+])
+FLAT_SCHEMA = pa.schema([("link", pa.string())] + list(CHAPTER_TYPE))
+
+
+def open_chapters(chapters_path):
+    """
+    DatasetReader over the chapters store.
+    """
+    return DatasetReader(chapters_path, CHAPTERS_SCHEMA)
+
+
+def update_chapters(link, chapters, chapters_path, text_hash=None):
+    """
+    Replace the chapters of the book at `link` with `chapters` (dicts from iter_chapters).
+    `text_hash` is the hash of the book text they were joined into (see src.dataset.text_hash).
+    """
+    table = pa.table({
+        "link": pa.array([link], type=pa.string()),
+        "text_hash": pa.array([text_hash], type=pa.string()),
+        "chapters": pa.array([chapters], type=pa.list_(CHAPTER_TYPE)),
+    }, schema=CHAPTERS_SCHEMA)
+    append_segment(table, chapters_path)
+
+
+def stored_text_hash(link, chapters_path):
+    """
+    Text hash the stored chapters of `link` were written with, or None if there are none.
+    Reads no chapter text.
+    """
+    with open_chapters(chapters_path) as reader:
+        row = reader.get(link, columns=["text_hash"])
+    return row["text_hash"] if row else None
+
+
+def compact_chapters(chapters_path):
+    compact_dataset(chapters_path, CHAPTERS_SCHEMA)
+
+
+def read_chapters(link, chapters_path):
+    """
+    Return the chapters of one book as a list of dicts, or None if it has none stored.
+    """
+    with open_chapters(chapters_path) as reader:
+        row = reader.get(link)
+    return row["chapters"] if row else None
+
+
+def flatten_chapters(batch):
+    """
+    Turn a batch of CHAPTERS_SCHEMA rows into one row per chapter (FLAT_SCHEMA).
+    """
+    chapters = batch.column("chapters")
+    links = pc.take(batch.column("link"), pc.list_parent_indices(chapters))
+    flat = pc.list_flatten(chapters)
+    return pa.record_batch([links] + [flat.field(name) for name in CHAPTER_TYPE.names], schema=FLAT_SCHEMA)
+
+
+def iter_chapter_batches(chapters_path):
+    """
+    Yield the live chapters of every book, one record batch of FLAT_SCHEMA per stored batch.
+    """
+    with open_chapters(chapters_path) as reader:
+        for batch in reader.iter_batches():
+            if batch.num_rows:
+                yield flatten_chapters(batch)
+
+
+def export_flat(chapters_path, out_path):
+    """
+    Write the chapters as a flat Arrow IPC file with one row per chapter. Returns the row count.
+    """
+    total = 0
+    tmp_path = out_path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, FLAT_SCHEMA) as writer:
+        for batch in iter_chapter_batches(chapters_path):
+            writer.write_batch(batch)
+            total += batch.num_rows
+    os.replace(tmp_path, out_path)
+    return total
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the chapters table with one row per chapter.")
+    parser.add_argument("--chapters", default="books_chapters.arrow", help="Chapters store written by main.py.")
+    parser.add_argument("--out", default="chapters_flat.arrow", help="Arrow file to write (default: chapters_flat.arrow).")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"Wrote {export_flat(args.chapters, args.out)} chapters to {args.out}.")
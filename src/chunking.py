@@ -0,0 +1,208 @@
+"""
+chunking.py
+
+Splits book texts into training chunks.
+
+The books dataset is read one record batch at a time. Each text is cut at
+paragraph boundaries (blank lines, which is also how headings are separated
+in the Markdown output) into chunks of at most `limit` characters or UTF-8
+bytes, optionally overlapping by up to `overlap` whole paragraphs. A chunk
+never ends on a heading, and paragraphs longer than the limit are split at
+line, then sentence, then character boundaries. Paragraph splitting and
+length measurement use pyarrow compute over the whole batch; only the
+packing of paragraph lengths into chunks runs per book.
+
+The output is an Arrow IPC file with one row per chunk: link, chunk_idx,
+offset (in characters, into the book's text) and text, where text is
+exactly text[offset:offset + len(chunk)].
+"""
+
+import os
+import re
+import argparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from src.dataset import DatasetReader
+
+PARAGRAPH_SEPARATOR = "\n\n"
+# Same default as references/consolidator.EpubConsolidator
+DEFAULT_LIMIT = 350000
+UNITS = ("chars", "bytes")
+
+CHUNK_SCHEMA = pa.schema([
+    ("link", pa.string()),
+    ("chunk_idx", pa.int32()),
+    ("offset", pa.int64()),
+    ("text", pa.string()),
+])
+
+re_heading = re.compile(r'#{1,6} ')
+re_sentence_end = re.compile(r'(?<=[.!?…])\s+')
+
+
+def _size(text, unit):
+    return len(text.encode("utf-8")) if unit == "bytes" else len(text)
+
+
+def _hard_split(text, start, end, limit, unit):
+    spans = []
+    while start < end:
+        stop = min(end, start + limit)
+        if unit == "bytes":
+            # Cut at the last whole character within `limit` bytes
+            fitting = text[start:stop].encode("utf-8")[:limit].decode("utf-8", errors="ignore")
+            stop = start + max(1, len(fitting))
+        spans.append((start, stop))
+        start = stop
+    return spans
+
+
+_SPLIT_PATTERNS = (re.compile(r'\n'), re_sentence_end)
+
+
+def _split_oversized(text, start, end, limit, unit, level=0):
+    """
+    Split text[start:end] into contiguous spans of at most `limit`, preferring
+    line breaks, then sentence ends, then a hard cut. Returns [(start, end)].
+    """
+    if _size(text[start:end], unit) <= limit:
+        return [(start, end)]
+    if level == len(_SPLIT_PATTERNS):
+        return _hard_split(text, start, end, limit, unit)
+    piece = text[start:end]
+    bounds = [start] + [start + m.end() for m in _SPLIT_PATTERNS[level].finditer(piece) if m.end() < len(piece)] + [end]
+    spans = []
+    for span_start, span_end in zip(bounds, bounds[1:]):
+        for sub_start, sub_end in _split_oversized(text, span_start, span_end, limit, unit, level + 1):
+            if spans and _size(text[spans[-1][0]:sub_end], unit) <= limit:
+                spans[-1] = (spans[-1][0], sub_end)
+            else:
+                spans.append((sub_start, sub_end))
+    return spans
+
+
+def chunk_spans(text, paragraph_chars, paragraph_sizes, limit, overlap=0, unit="chars"):
+    """
+    Pack the paragraphs of `text` into chunks. `paragraph_chars` and
+    `paragraph_sizes` are the lengths of text.split("\\n\\n") in characters and
+    in `unit`. Returns [(start, end)] character spans.
+    """
+    separator_size = len(PARAGRAPH_SEPARATOR)
+    # (start char, end char, start position in unit, end position in unit, is heading)
+    pieces = []
+    char_position = 0
+    unit_position = 0
+    for chars, size in zip(paragraph_chars, paragraph_sizes):
+        if chars:
+            if size <= limit:
+                spans = [(char_position, char_position + chars)]
+            else:
+                spans = _split_oversized(text, char_position, char_position + chars, limit, unit)
+            for start, end in spans:
+                unit_start = unit_position + (start - char_position if unit == "chars"
+                                              else _size(text[char_position:start], unit))
+                unit_end = unit_start + (end - start if unit == "chars" else _size(text[start:end], unit))
+                pieces.append((start, end, unit_start, unit_end, re_heading.match(text, start) is not None))
+        char_position += chars + separator_size
+        unit_position += size + separator_size
+
+    chunks = []
+    i = 0
+    while i < len(pieces):
+        j = i + 1
+        while j < len(pieces) and pieces[j][3] - pieces[i][2] <= limit:
+            j += 1
+        # A heading belongs with the text that follows it
+        while j - 1 > i and pieces[j - 1][4]:
+            j -= 1
+        chunks.append((pieces[i][0], pieces[j - 1][1]))
+        if j == len(pieces):
+            break
+        # Repeat trailing whole paragraphs of this chunk at the start of the next
+        k = j
+        while k - 1 > i and pieces[j - 1][3] - pieces[k - 1][2] <= overlap:
+            k -= 1
+        i = k
+    return chunks
+
+
+def chunk_batch(batch, limit=DEFAULT_LIMIT, overlap=0, unit="chars"):
+    """
+    Chunk every text of a record batch of the books dataset. Returns a record batch of CHUNK_SCHEMA.
+    """
+    texts = batch.column("text")
+    paragraphs = pc.split_pattern(texts, PARAGRAPH_SEPARATOR)
+    flat = paragraphs.flatten()
+    paragraph_chars = pc.utf8_length(flat).to_pylist()
+    paragraph_sizes = pc.binary_length(flat).to_pylist() if unit == "bytes" else paragraph_chars
+    list_offsets = paragraphs.offsets.to_pylist()
+    base = list_offsets[0] if list_offsets else 0
+
+    links, indices, offsets, chunk_texts = [], [], [], []
+    for row, (link, text) in enumerate(zip(batch.column("link").to_pylist(), texts.to_pylist())):
+        if not text:
+            continue
+        a, b = list_offsets[row] - base, list_offsets[row + 1] - base
+        spans = chunk_spans(text, paragraph_chars[a:b], paragraph_sizes[a:b], limit, overlap, unit)
+        for idx, (start, end) in enumerate(spans):
+            links.append(link)
+            indices.append(idx)
+            offsets.append(start)
+            chunk_texts.append(text[start:end])
+    return pa.record_batch([
+        pa.array(links, type=pa.string()),
+        pa.array(indices, type=pa.int32()),
+        pa.array(offsets, type=pa.int64()),
+        pa.array(chunk_texts, type=pa.string()),
+    ], schema=CHUNK_SCHEMA)
+
+
+def build_chunks(dataset_path, chunks_path, limit=DEFAULT_LIMIT, overlap=0, unit="chars"):
+    """
+    Stream the books dataset into an Arrow IPC file of chunks, one input batch at a time.
+    Returns the number of chunks written, or None if there is no dataset.
+    """
+    if unit not in UNITS:
+        raise ValueError(f"unit must be one of {UNITS}")
+    if overlap >= limit:
+        raise ValueError("overlap must be smaller than limit")
+
+    with DatasetReader(dataset_path) as reader:
+        if not reader.exists():
+            print(f"No dataset at {dataset_path}.")
+            return None
+        tmp_path = chunks_path + ".tmp"
+        total = 0
+        with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, CHUNK_SCHEMA) as writer:
+            for batch in reader.iter_batches(columns=["link", "text"]):
+                chunks = chunk_batch(batch, limit, overlap, unit)
+                if chunks.num_rows:
+                    writer.write_batch(chunks)
+                    total += chunks.num_rows
+    os.replace(tmp_path, chunks_path)
+    print(f"Wrote {total} chunks to {chunks_path}.")
+    return total
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Split the books dataset into training chunks.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to read.")
+    parser.add_argument("--out", default="chunks.arrow", help="Arrow file to write (default: chunks.arrow).")
+    parser.add_argument(
+        "--limit", type=int, default=DEFAULT_LIMIT,
+        help=f"Maximum chunk size (default: {DEFAULT_LIMIT})."
+    )
+    parser.add_argument("--unit", choices=UNITS, default="chars", help="Unit of --limit and --overlap.")
+    parser.add_argument(
+        "--overlap", type=int, default=0,
+        help="Repeat up to this much trailing text (whole paragraphs) at the start of the next chunk."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_chunks(args.dataset, args.out, limit=args.limit, overlap=args.overlap, unit=args.unit)
@@ -1,36 +1,474 @@
+"""
+dataset.py
+
+Append-only segmented Arrow IPC storage for the books dataset.
+
+The dataset lives at `dataset_path` (the compacted base file) plus a sibling
+`<dataset_path>.segments/` directory. Every update writes a new small segment
+and records in the segment manifest where the newest row for each link lives.
+Older rows for the same link are tombstoned by the manifest and dropped the
+next time the store is compacted.
+
+Reads go through `DatasetReader`, which memory-maps every file and resolves
+links through the manifest plus a persisted `<dataset_path>.index.json`
+sidecar for the base file, so lookups never scan the `text` column.
+
+Every row carries a `text_hash` of its text. Upserts compare it (and the
+metadata columns) with the stored row and skip books that did not change, so
+re-extracting an unchanged book causes no churn in the store or the exports.
+Files written before `text_hash` existed read it as null until the next
+compaction fills it in.
+
+The store itself only needs a `link` column: `DatasetReader`,
+`append_segment` and `compact_dataset` take the schema of other tables kept
+the same way (see src/chapters.py).
+"""
+
 import os
+import json
+import shutil
+import hashlib
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.ipc as ipc
 
-def update_dataset(book_entry, dataset_path):
+FIELDS = ["link", "title", "author", "text", "language", "text_hash"]
+METADATA_FIELDS = ["link", "title", "author", "language", "text_hash"]
+SCHEMA = pa.schema([(k, pa.string()) for k in FIELDS])
+SEGMENTS_SUFFIX = ".segments"
+INDEX_SUFFIX = ".index.json"
+MANIFEST_FILE = "manifest.json"
+# Compact automatically once this many segments have piled up
+MAX_SEGMENTS = 256
+
+
+def text_hash(text):
     """
-    Overwrite any existing entry for the same book (by link) in the Arrow IPC dataset.
+    Content hash of a book's text (hex blake2b-128 of its UTF-8 bytes).
+    """
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _conform(batch, schema=SCHEMA):
+    """
+    Return `batch` with exactly the `schema` columns; columns missing from older files are null.
+    """
+    if batch.schema.names == schema.names:
+        return batch
+    names = batch.schema.names
+    columns = [
+        batch.column(field.name) if field.name in names else pa.nulls(batch.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.record_batch(columns, schema=schema)
+
+
+def _fill_text_hash(batch):
+    """
+    Compute `text_hash` for rows that lack it (rows from files older than the column).
+    """
+    hashes = batch.column("text_hash")
+    if not hashes.null_count:
+        return batch
+    texts = batch.column("text").to_pylist()
+    filled = [h if h is not None else text_hash(t) for h, t in zip(hashes.to_pylist(), texts)]
+    index = batch.schema.get_field_index("text_hash")
+    return batch.set_column(index, "text_hash", pa.array(filled, type=pa.string()))
+
+
+def _segments_dir(dataset_path):
+    return dataset_path + SEGMENTS_SUFFIX
+
+
+def _manifest_path(dataset_path):
+    return os.path.join(_segments_dir(dataset_path), MANIFEST_FILE)
+
+
+def _index_path(dataset_path):
+    return dataset_path + INDEX_SUFFIX
+
+
+def _write_json(path, data):
+    """
+    Atomically replace a small JSON file.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _load_manifest(dataset_path):
+    """
+    Load the segment manifest.
+    `links` maps each link to [segment, batch, row] of its newest row.
+    Returns an empty manifest if the store has no segments yet.
+    """
+    path = _manifest_path(dataset_path)
+    if not os.path.exists(path):
+        return {"next_id": 1, "segments": [], "links": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(dataset_path, manifest):
+    _write_json(_manifest_path(dataset_path), manifest)
+
+
+def _save_base_index(dataset_path, links):
     """
-    fields = ["link", "title", "author", "text", "language"]
-    arr = {k: [book_entry.get(k, "")] for k in fields}
-    new_table = pa.table(arr)
-
-    if os.path.exists(dataset_path):
-        with open(dataset_path, 'rb') as f:
-            reader = ipc.RecordBatchFileReader(f)
-            old_table = reader.read_all()
-        mask = [val != book_entry["link"] for val in old_table.column("link").to_pylist()]
-        filtered_table = old_table.filter(mask)
-        table = pa.concat_tables([filtered_table, new_table])
-    else:
-        table = new_table
-
-    with open(dataset_path, 'wb') as f:
+    Persist the link -> [batch, row] index of the base file.
+    The file size and mtime are stored so a replaced base file invalidates it.
+    """
+    st = os.stat(dataset_path)
+    _write_json(_index_path(dataset_path), {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "links": links,
+    })
+
+
+def _load_base_index(dataset_path):
+    """
+    Load the link -> [batch, row] index of the base file.
+    If the sidecar is missing or stale, rebuild it from the `link` column only.
+    """
+    st = os.stat(dataset_path)
+    path = _index_path(dataset_path)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index["size"] == st.st_size and index["mtime_ns"] == st.st_mtime_ns:
+            return index["links"]
+
+    links = {}
+    with pa.memory_map(dataset_path, 'r') as source:
+        reader = ipc.open_file(source)
+        for b in range(reader.num_record_batches):
+            for r, link in enumerate(reader.get_batch(b).column("link").to_pylist()):
+                links[link] = [b, r]
+    try:
+        _save_base_index(dataset_path, links)
+    except OSError as e:
+        # Reading must not need write access (read-only mounts, someone else's store)
+        print(f"Could not save the index of {dataset_path} ({e}), keeping it in memory.")
+    return links
+
+
+def _write_table(path, table):
+    """
+    Write a table as an Arrow IPC file, replacing `path` atomically.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
         writer = ipc.RecordBatchFileWriter(f, table.schema)
         writer.write_table(table)
         writer.close()
+    os.replace(tmp_path, path)
+
 
-def read_dataset(dataset_path):
+class DatasetReader:
     """
-    Read the Arrow IPC dataset and return a pyarrow Table.
+    Memory-mapped, read-only view of the dataset (base file plus segments).
+
+    Only the buffers that are actually accessed are paged in, so listing links,
+    reading metadata columns or fetching a single book's text touches a few
+    kilobytes instead of the whole corpus.
     """
-    if not os.path.exists(dataset_path):
+
+    def __init__(self, dataset_path, schema=SCHEMA):
+        self.dataset_path = dataset_path
+        self._schema = schema
+        self.manifest = _load_manifest(dataset_path)
+        self.has_base = os.path.exists(dataset_path)
+        self._base_index = _load_base_index(dataset_path) if self.has_base else {}
+        self._maps = []
+        self._readers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory maps. Tables already returned stay valid.
+        """
+        for source in self._maps:
+            source.close()
+        self._maps = []
+        self._readers = {}
+
+    def exists(self):
+        return self.has_base or bool(self.manifest["segments"])
+
+    def _open(self, segment):
+        """
+        Open (and cache) the IPC reader for a segment; `None` is the base file.
+        """
+        if segment not in self._readers:
+            if segment is None:
+                path = self.dataset_path
+            else:
+                path = os.path.join(_segments_dir(self.dataset_path), segment)
+            source = pa.memory_map(path, 'r')
+            self._maps.append(source)
+            self._readers[segment] = ipc.open_file(source)
+        return self._readers[segment]
+
+    def schema(self):
+        return self._schema
+
+    def locate(self, link):
+        """
+        Return (segment, batch, row) of the live row for `link`, or None.
+        """
+        loc = self.manifest["links"].get(link)
+        if loc is not None:
+            return tuple(loc)
+        loc = self._base_index.get(link)
+        if loc is not None:
+            return (None, loc[0], loc[1])
         return None
-    with open(dataset_path, 'rb') as f:
-        reader = ipc.RecordBatchFileReader(f)
-        return reader.read_all()
+
+    def __contains__(self, link):
+        return self.locate(link) is not None
+
+    def links(self):
+        """
+        Return all live links without reading any Arrow data.
+        """
+        links = [link for link in self._base_index if link not in self.manifest["links"]]
+        links.extend(self.manifest["links"])
+        return links
+
+    def __len__(self):
+        return len(self.links())
+
+    def get(self, link, columns=None):
+        """
+        Fetch one book as a dict, optionally restricted to `columns`.
+        Returns None if the link is not in the dataset.
+        """
+        loc = self.locate(link)
+        if loc is None:
+            return None
+        segment, b, r = loc
+        batch = _conform(self._open(segment).get_batch(b).slice(r, 1), self._schema)
+        if columns is not None:
+            batch = batch.select(columns)
+        return batch.to_pylist()[0]
+
+    def iter_batches(self, columns=None, predicate=None):
+        """
+        Yield the live rows of every file, one record batch at a time.
+        Tombstoned rows are filtered out using the `link` column only,
+        so projected-away columns are never touched.
+        `predicate(batch)`, if given, returns a boolean mask of the rows to keep;
+        it should only read the columns it filters on (e.g. METADATA_FIELDS). Rows
+        it rejects are dropped before any other column is copied, and batches
+        without a match are skipped entirely.
+        """
+        by_segment = {}
+        for link, loc in self.manifest["links"].items():
+            by_segment.setdefault(loc[0], []).append(link)
+
+        sources = []
+        if self.has_base:
+            sources.append((None, list(self.manifest["links"]), True))
+        for segment in self.manifest["segments"]:
+            if segment in by_segment:
+                sources.append((segment, by_segment[segment], False))
+
+        for segment, links, exclude in sources:
+            reader = self._open(segment)
+            value_set = pa.array(links, type=pa.string())
+            for b in range(reader.num_record_batches):
+                batch = _conform(reader.get_batch(b), self._schema)
+                projected = batch.select(columns) if columns is not None else batch
+                mask = None
+                if not (exclude and not links):
+                    mask = pc.is_in(batch.column("link"), value_set=value_set)
+                    if exclude:
+                        mask = pc.invert(mask)
+                if predicate is not None:
+                    matches = pc.fill_null(predicate(batch), False)
+                    mask = matches if mask is None else pc.and_(mask, matches)
+                    if not pc.any(mask).as_py():
+                        continue
+                yield projected if mask is None else projected.filter(mask)
+
+    def read(self, columns=None):
+        """
+        Return the live rows as one table, optionally restricted to `columns`.
+        """
+        batches = [b for b in self.iter_batches(columns) if b.num_rows]
+        if not batches:
+            schema = self.schema()
+            if columns is not None:
+                schema = pa.schema([schema.field(c) for c in columns])
+            return schema.empty_table()
+        return pa.Table.from_batches(batches)
+
+
+def _change_status(entry, stored):
+    """
+    "new", "text_changed", "metadata_changed" or "unchanged" for an upsert of `entry` over `stored`.
+    """
+    if stored is None:
+        return "new"
+    stored_hash = stored["text_hash"] or text_hash(stored["text"])
+    if stored_hash != entry["text_hash"]:
+        return "text_changed"
+    if any(stored[k] != entry[k] for k in METADATA_FIELDS if k != "text_hash"):
+        return "metadata_changed"
+    return "unchanged"
+
+
+def update_dataset(book_entry, dataset_path):
+    """
+    Overwrite any existing entry for the same book (by link) in the Arrow IPC dataset.
+    The book is appended as a new segment; the old row is tombstoned.
+    Returns the change status of the book (see `update_dataset_batch`).
+    """
+    return update_dataset_batch([book_entry], dataset_path)[book_entry["link"]]
+
+
+def update_dataset_batch(book_entries, dataset_path):
+    """
+    Append a batch of books to the dataset as a single new segment.
+    If a link appears more than once, the last entry wins.
+
+    Books whose text hash and metadata match the stored row are not written.
+    Returns {link: status} with status "new", "text_changed",
+    "metadata_changed" or "unchanged" (skipped).
+    """
+    latest = {}
+    for book_entry in book_entries:
+        entry = {k: book_entry.get(k, "") for k in FIELDS}
+        entry["text_hash"] = book_entry.get("text_hash") or text_hash(entry["text"])
+        latest[entry["link"]] = entry
+    if not latest:
+        return {}
+
+    with DatasetReader(dataset_path) as reader:
+        statuses = {}
+        for link, entry in latest.items():
+            # The stored text is only read for legacy rows without a hash
+            stored = reader.get(link, columns=METADATA_FIELDS)
+            if stored is not None and stored["text_hash"] is None:
+                stored = reader.get(link)
+            statuses[link] = _change_status(entry, stored)
+    latest = {link: entry for link, entry in latest.items() if statuses[link] != "unchanged"}
+    if not latest:
+        return statuses
+
+    arr = {k: [b[k] for b in latest.values()] for k in FIELDS}
+    append_segment(pa.table(arr, schema=SCHEMA), dataset_path)
+    return statuses
+
+
+def append_segment(table, dataset_path):
+    """
+    Write `table` (one row per link, in the store's schema) as a new segment
+    and point the manifest at its rows, tombstoning older rows of the same links.
+    """
+    # Manifest locations assume a single record batch
+    table = table.combine_chunks()
+    manifest = _load_manifest(dataset_path)
+    os.makedirs(_segments_dir(dataset_path), exist_ok=True)
+    segment = f"seg-{manifest['next_id']:06d}.arrow"
+    _write_table(os.path.join(_segments_dir(dataset_path), segment), table)
+
+    # The manifest is only updated once the segment is fully on disk,
+    # so a crash leaves at worst an orphaned segment file.
+    manifest["next_id"] += 1
+    manifest["segments"].append(segment)
+    for row, link in enumerate(table.column("link").to_pylist()):
+        manifest["links"][link] = [segment, 0, row]
+    _save_manifest(dataset_path, manifest)
+
+    if len(manifest["segments"]) >= MAX_SEGMENTS:
+        compact_dataset(dataset_path, table.schema)
+
+
+def compact_dataset(dataset_path, schema=SCHEMA):
+    """
+    Merge the base file and all segments into a new base file, dropping tombstoned rows.
+    Streams one record batch at a time, so memory stays bounded by the largest batch.
+    """
+    if not os.path.exists(_manifest_path(dataset_path)):
+        return
+
+    tmp_path = dataset_path + ".compact.tmp"
+    with DatasetReader(dataset_path, schema) as reader:
+        batches = reader.iter_batches()
+        # Only hashes of a `text` column in the same row can be backfilled (not the chapters')
+        if "text_hash" in schema.names and "text" in schema.names:
+            batches = (_fill_text_hash(batch) for batch in batches)
+        index = _write_batches(tmp_path, batches, schema)
+    _install_base(dataset_path, tmp_path, index)
+
+
+def write_dataset(dataset_path, batches, schema=SCHEMA):
+    """
+    Write `batches` (at most one row per link) as the new base file of the
+    store at `dataset_path`, replacing it and dropping its segments.
+    Batches are written as they come, so memory stays bounded by the largest batch.
+    """
+    tmp_path = dataset_path + ".compact.tmp"
+    _install_base(dataset_path, tmp_path, _write_batches(tmp_path, batches, schema))
+
+
+def _write_batches(path, batches, schema):
+    """
+    Write the non-empty `batches` to an IPC file. Returns the link -> [batch, row] index.
+    """
+    index = {}
+    with open(path, 'wb') as f:
+        writer = ipc.RecordBatchFileWriter(f, schema)
+        b = 0
+        for batch in batches:
+            if not batch.num_rows:
+                continue
+            for r, link in enumerate(batch.column("link").to_pylist()):
+                index[link] = [b, r]
+            writer.write_batch(batch)
+            b += 1
+        writer.close()
+    return index
+
+
+def _install_base(dataset_path, tmp_path, index):
+    os.replace(tmp_path, dataset_path)
+    _save_base_index(dataset_path, index)
+
+    # Drop the manifest first: once it is gone the new base file is authoritative.
+    if os.path.exists(_manifest_path(dataset_path)):
+        os.remove(_manifest_path(dataset_path))
+    if os.path.exists(_segments_dir(dataset_path)):
+        shutil.rmtree(_segments_dir(dataset_path))
+
+
+def read_dataset(dataset_path, columns=None):
+    """
+    Read the Arrow IPC dataset and return a pyarrow Table.
+    The base file and all segments are combined into one logical, memory-mapped table.
+    Pass `columns` (e.g. METADATA_FIELDS) to skip the `text` column entirely.
+    """
+    with DatasetReader(dataset_path) as reader:
+        if not reader.exists():
+            return None
+        return reader.read(columns)
+
+
+def remove_dataset(dataset_path):
+    """
+    Delete the base file, its index and all segments.
+    """
+    for path in [dataset_path, _index_path(dataset_path)]:
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(_segments_dir(dataset_path)):
+        shutil.rmtree(_segments_dir(dataset_path))
@@ -0,0 +1,280 @@
+"""
+dedup.py
+
+Near-duplicate detection across the corpus with MinHash and banded LSH.
+
+Omnibus editions and collections repeat the text of individual titles. Each
+book is reduced to the set of hashed word 5-gram shingles of its text and a
+MinHash signature of `num_perm` 32-bit values, computed with NumPy in a
+process pool (one book per task, at most two tasks per worker in flight, so
+memory stays bounded by a few books however large the corpus is). Signatures
+are bucketed band by band; books sharing a bucket in any band are candidate
+pairs, whose Jaccard similarity is estimated from their signatures.
+Containment (shared shingles over the smaller book's shingles) is derived
+from that and the shingle counts, so a collection and a title it contains
+are linked even though their Jaccard similarity is low. Pairs at or above
+`threshold` containment are merged into duplicate clusters.
+
+The report lists every cluster with its members and pair similarities, and
+`write_dedup_groups` writes a (link, dedup_group) table that the Parquet
+export can add as a `dedup_group` column.
+"""
+
+import os
+import re
+import json
+import zlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from src.dataset import DatasetReader
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# 64 bands of 2 rows: pairs with a Jaccard similarity of 0.2 become candidates
+# with ~93% probability, which catches a title inside a 5-book collection
+NUM_BANDS = 64
+THRESHOLD = 0.8
+SEED = 1
+# Shingles hashed per NumPy step: NUM_PERM * 32768 * 8 bytes = 32 MB
+SHINGLE_BLOCK = 1 << 15
+
+re_word = re.compile(r'\w+')
+_SHINGLE_PRIME = np.uint64(1099511628211)
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+
+
+def permutations(num_perm=NUM_PERM, seed=SEED):
+    """
+    Parameters (a, b) of the num_perm hash functions h(x) = (a * x + b) mod 2**64 >> 32.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(text, k=SHINGLE_SIZE):
+    """
+    Unique 64-bit hashes of the lowercased word k-grams of `text`.
+    """
+    tokens = re_word.findall(text.lower())
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    token_hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.uint64, count=len(tokens))
+    n = max(1, len(tokens) - k + 1)
+    hashes = np.zeros(n, dtype=np.uint64)
+    for j in range(min(k, len(tokens))):
+        # Polynomial rolling hash; uint64 arithmetic wraps around
+        hashes = hashes * _SHINGLE_PRIME + token_hashes[j:j + n]
+    return np.unique(hashes)
+
+
+def minhash(shingles, a, b):
+    """
+    MinHash signature (uint32[num_perm]) of a set of shingle hashes.
+    """
+    signature = np.full(len(a), _MAX_HASH, dtype=np.uint32)
+    for start in range(0, len(shingles), SHINGLE_BLOCK):
+        block = shingles[start:start + SHINGLE_BLOCK]
+        hashed = (np.outer(a, block) + b[:, None]) >> np.uint64(32)
+        np.minimum(signature, hashed.min(axis=1).astype(np.uint32), out=signature)
+    return signature
+
+
+def _signature(text, a, b, k):
+    shingles = shingle_hashes(text, k)
+    return minhash(shingles, a, b), len(shingles)
+
+
+def compute_signatures(dataset_path, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=SEED, workers=None):
+    """
+    Return (links, titles, signatures uint32[n, num_perm], shingle counts) for every book.
+    """
+    a, b = permutations(num_perm, seed)
+    workers = workers or os.cpu_count() or 1
+    links, titles, signatures, sizes = [], [], [], []
+
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        pending = []
+
+        def collect(limit):
+            while len(pending) > limit:
+                link, title, result = pending.pop(0)
+                signature, size = result.result() if pool is not None else result
+                if size:
+                    links.append(link)
+                    titles.append(title)
+                    signatures.append(signature)
+                    sizes.append(size)
+
+        with DatasetReader(dataset_path) as reader:
+            for batch in reader.iter_batches(columns=["link", "title", "text"]):
+                for link, title, text in zip(*(batch.column(c).to_pylist() for c in ("link", "title", "text"))):
+                    if pool is not None:
+                        pending.append((link, title, pool.submit(_signature, text or "", a, b, shingle_size)))
+                    else:
+                        pending.append((link, title, _signature(text or "", a, b, shingle_size)))
+                    # Bound the texts held by in-flight tasks
+                    collect(2 * workers)
+        collect(0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    signatures = np.vstack(signatures) if signatures else np.empty((0, num_perm), dtype=np.uint32)
+    return links, titles, signatures, np.array(sizes, dtype=np.int64)
+
+
+def candidate_pairs(signatures, bands=NUM_BANDS):
+    """
+    Pairs of row indices that share a bucket in at least one LSH band.
+    """
+    num_perm = signatures.shape[1]
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+    rows = num_perm // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i, key in enumerate(keys):
+            buckets.setdefault(key.tobytes(), []).append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return sorted(pairs)
+
+
+def find_duplicates(dataset_path, num_perm=NUM_PERM, bands=NUM_BANDS, threshold=THRESHOLD,
+                    shingle_size=SHINGLE_SIZE, seed=SEED, workers=None):
+    """
+    Find clusters of near-duplicate books. Returns the report dict.
+    """
+    links, titles, signatures, sizes = compute_signatures(
+        dataset_path, num_perm=num_perm, shingle_size=shingle_size, seed=seed, workers=workers
+    )
+
+    parent = list(range(len(links)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    pairs = []
+    candidates = candidate_pairs(signatures, bands)
+    for i, j in candidates:
+        jaccard = float(np.mean(signatures[i] == signatures[j]))
+        shared = jaccard * (sizes[i] + sizes[j]) / (1 + jaccard)
+        containment = min(1.0, shared / min(sizes[i], sizes[j]))
+        if containment >= threshold:
+            pairs.append({
+                "a": links[i], "b": links[j],
+                "jaccard": round(jaccard, 4), "containment": round(containment, 4),
+            })
+            parent[find(i)] = find(j)
+
+    members = {}
+    for i in range(len(links)):
+        members.setdefault(find(i), []).append(i)
+    clusters = sorted((m for m in members.values() if len(m) > 1), key=lambda m: links[m[0]])
+    pairs_by_link = {}
+    for pair in pairs:
+        pairs_by_link.setdefault(pair["a"], []).append(pair)
+
+    report_clusters = []
+    for group, cluster in enumerate(clusters):
+        cluster_links = {links[i] for i in cluster}
+        report_clusters.append({
+            "dedup_group": group,
+            # The book with the most shingles (usually the omnibus) first
+            "members": [
+                {"link": links[i], "title": titles[i], "shingles": int(sizes[i])}
+                for i in sorted(cluster, key=lambda i: (-sizes[i], links[i]))
+            ],
+            "pairs": [p for link in sorted(cluster_links) for p in pairs_by_link.get(link, [])],
+        })
+
+    return {
+        "num_books": len(links),
+        "num_perm": num_perm,
+        "bands": bands,
+        "shingle_size": shingle_size,
+        "threshold": threshold,
+        "candidate_pairs": len(candidates),
+        "duplicate_pairs": len(pairs),
+        "clusters": report_clusters,
+    }
+
+
+def write_report(report, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def write_dedup_groups(report, path):
+    """
+    Write the (link, dedup_group) table of the books that are in a duplicate cluster.
+    """
+    links, groups = [], []
+    for cluster in report["clusters"]:
+        for member in cluster["members"]:
+            links.append(member["link"])
+            groups.append(cluster["dedup_group"])
+    table = pa.table({"link": pa.array(links, type=pa.string()), "dedup_group": pa.array(groups, type=pa.int32())})
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def load_dedup_groups(path):
+    """
+    Return {link: dedup_group} from a table written by `write_dedup_groups`.
+    """
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+    return dict(zip(table.column("link").to_pylist(), table.column("dedup_group").to_pylist()))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find near-duplicate books with MinHash LSH.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to read.")
+    parser.add_argument("--report", default="dedup_report.json", help="Cluster report (default: dedup_report.json).")
+    parser.add_argument(
+        "--groups", default=None,
+        help="Also write a (link, dedup_group) Arrow table, e.g. for `python -m src.export --dedup-groups`."
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Processes used for signatures (default: all CPUs).")
+    parser.add_argument("--num-perm", type=int, default=NUM_PERM, help=f"MinHash size (default: {NUM_PERM}).")
+    parser.add_argument("--bands", type=int, default=NUM_BANDS, help=f"LSH bands (default: {NUM_BANDS}).")
+    parser.add_argument(
+        "--threshold", type=float, default=THRESHOLD,
+        help=f"Minimum estimated containment of a duplicate pair (default: {THRESHOLD})."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = find_duplicates(
+        args.dataset, num_perm=args.num_perm, bands=args.bands, threshold=args.threshold, workers=args.workers
+    )
+    write_report(report, args.report)
+    if args.groups:
+        write_dedup_groups(report, args.groups)
+    print(f"{report['num_books']} books, {report['candidate_pairs']} candidate pairs, "
+          f"{len(report['clusters'])} duplicate clusters written to {args.report}.")
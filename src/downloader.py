@@ -8,11 +8,14 @@ import os
 import shutil
 import subprocess
 
-def download_repo(repo_link, dest_dir, branch="master"):
+from src.metrics import timed
+
+def download_repo(repo_link, dest_dir, branch="master", metrics=None, book=None):
     """
     Download the repo (shallow clone with sparse checkout of src/epub).
     Uses subprocess.run for robust timeout and exception handling.
     Suppresses git output.
+    With `metrics` (a RunMetrics), the clone and sparse checkout are timed for `book`.
     """
     # Prepare destination directory
     if os.path.exists(dest_dir):
@@ -21,20 +24,21 @@ def download_repo(repo_link, dest_dir, branch="master"):
 
     # Clone repository
     try:
-        subprocess.run(
-            [
-                "git", "clone",
-                "--depth=1",
-                "--filter=blob:none",
-                "--sparse",
-                "--branch", branch,
-                repo_link, dest_dir
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True,
-            timeout=300
-        )
+        with timed(metrics, "clone", book):
+            subprocess.run(
+                [
+                    "git", "clone",
+                    "--depth=1",
+                    "--filter=blob:none",
+                    "--sparse",
+                    "--branch", branch,
+                    repo_link, dest_dir
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                timeout=300
+            )
     except subprocess.TimeoutExpired:
         print(f"Timeout cloning {repo_link}")
         cleanup_repo(dest_dir)
@@ -51,20 +55,21 @@ def download_repo(repo_link, dest_dir, branch="master"):
         ["git", "pull"]
     ]
 
-    for cmd in sparse_commands:
-        try:
-            subprocess.run(
-                cmd,
-                cwd=dest_dir,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=True
-            )
-        except subprocess.CalledProcessError:
-            cmd_str = " ".join(cmd)
-            print(f"Sparse checkout step failed ({cmd_str}) in {dest_dir}")
-            cleanup_repo(dest_dir)
-            raise
+    with timed(metrics, "sparse_checkout", book):
+        for cmd in sparse_commands:
+            try:
+                subprocess.run(
+                    cmd,
+                    cwd=dest_dir,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True
+                )
+            except subprocess.CalledProcessError:
+                cmd_str = " ".join(cmd)
+                print(f"Sparse checkout step failed ({cmd_str}) in {dest_dir}")
+                cleanup_repo(dest_dir)
+                raise
 
     return dest_dir
 
@@ -0,0 +1,228 @@
+"""
+export.py
+
+Exports the dataset as size-bounded, zstd-compressed Parquet shards.
+
+The Arrow store is streamed one record batch at a time into row groups of
+`row_group_size` rows, so peak memory is one row group however large the
+corpus is. A new shard is started once the current one reaches
+`max_shard_bytes` on disk. `author` and `language` are dictionary-encoded.
+Shards are named the way the Hugging Face loader expects
+(data/train-00000-of-00004.parquet), so they can be read in parallel, and a
+manifest.json lists each shard's rows and bytes.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.dataset import DatasetReader
+
+DATA_DIR = "data"
+MANIFEST_FILE = "manifest.json"
+DICTIONARY_COLUMNS = ["author", "language"]
+DEFAULT_ROW_GROUP_SIZE = 128
+DEFAULT_MAX_SHARD_BYTES = 256 * 1024**2
+
+
+def shard_name(split, index, total):
+    return f"{split}-{index:05d}-of-{total:05d}.parquet"
+
+
+def shard_of(link, num_shards):
+    """
+    Stable shard of a book: a hash of its link, independent of row order and Python's hash seed.
+    """
+    digest = hashlib.blake2b(link.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+class _ShardWriter:
+    """
+    Parquet writer for one shard. Buffers rows into row groups of `row_group_size`
+    and tracks the shard's rows, row groups and bytes on disk.
+    """
+
+    def __init__(self, path, schema, row_group_size, compression, compression_level):
+        self.path = path
+        self.row_group_size = row_group_size
+        self.sink = pa.OSFile(path, "wb")
+        self.writer = pq.ParquetWriter(
+            self.sink, schema,
+            compression=compression,
+            compression_level=compression_level,
+            use_dictionary=[c for c in DICTIONARY_COLUMNS if c in schema.names],
+        )
+        self.pending = []
+        self.pending_rows = 0
+        self.num_rows = 0
+        self.num_row_groups = 0
+
+    def add(self, batch):
+        """
+        Buffer `batch`, writing out every row group that fills up.
+        """
+        offset = 0
+        while offset < batch.num_rows:
+            take = min(self.row_group_size - self.pending_rows, batch.num_rows - offset)
+            self.pending.append(batch.slice(offset, take))
+            self.pending_rows += take
+            offset += take
+            if self.pending_rows >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        table = pa.Table.from_batches(self.pending)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.num_rows += table.num_rows
+        self.num_row_groups += 1
+        self.pending, self.pending_rows = [], 0
+
+    def bytes_written(self):
+        return self.sink.tell()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.sink.close()
+        return {
+            "tmp_path": self.path,
+            "num_rows": self.num_rows,
+            "num_row_groups": self.num_row_groups,
+            "num_bytes": os.path.getsize(self.path),
+        }
+
+
+def _with_dedup_group(batch, dedup_groups):
+    groups = [dedup_groups.get(link) for link in batch.column("link").to_pylist()]
+    return batch.append_column(pa.field("dedup_group", pa.int32()), pa.array(groups, type=pa.int32()))
+
+
+def export_parquet(dataset_path, out_dir, split="train", row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                   max_shard_bytes=DEFAULT_MAX_SHARD_BYTES, num_shards=None,
+                   compression="zstd", compression_level=None, dedup_groups=None):
+    """
+    Stream the dataset at `dataset_path` into Parquet shards under `out_dir`/data.
+    Returns the manifest dict, or None if there is no dataset.
+
+    By default rows are written in store order and a new shard is started once
+    the current one reaches `max_shard_bytes`. With `num_shards`, every book goes
+    to shard `shard_of(link, num_shards)` instead, so a changed book only changes
+    the bytes of its own shard (what delta uploads need). Each shard is then one
+    pass over the memory-mapped store that reads the `link` column and the
+    selected rows only.
+
+    With `dedup_groups` ({link: group}, see src/dedup.py) a nullable
+    `dedup_group` column is added, so near-duplicates can be filtered downstream.
+    """
+    data_dir = os.path.join(out_dir, DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+
+    def new_writer(schema, index):
+        tmp_path = os.path.join(data_dir, f".{split}-{index:05d}.parquet.tmp")
+        return _ShardWriter(tmp_path, schema, row_group_size, compression, compression_level)
+
+    shards = []
+    with DatasetReader(dataset_path) as reader:
+        if not reader.exists():
+            print(f"No dataset at {dataset_path}.")
+            return None
+        schema = reader.schema()
+        batches = reader.iter_batches
+        if dedup_groups is not None:
+            schema = schema.append(pa.field("dedup_group", pa.int32()))
+            batches = lambda: (_with_dedup_group(batch, dedup_groups) for batch in reader.iter_batches())
+
+        if num_shards:
+            for index in range(num_shards):
+                writer = new_writer(schema, index)
+                for batch in batches():
+                    links = batch.column("link").to_pylist()
+                    mask = pa.array([shard_of(link, num_shards) == index for link in links], type=pa.bool_())
+                    writer.add(batch.filter(mask))
+                shards.append(writer.close())
+        else:
+            writer = None
+            for batch in batches():
+                if not batch.num_rows:
+                    continue
+                if writer is None:
+                    writer = new_writer(schema, len(shards))
+                writer.add(batch)
+                if writer.bytes_written() >= max_shard_bytes:
+                    shards.append(writer.close())
+                    writer = None
+            if writer is not None or not shards:
+                # An empty dataset still exports one (empty) shard so the layout is loadable
+                shards.append((writer or new_writer(schema, 0)).close())
+
+    # Shards of an earlier export with a different count would be read as well
+    for stale in glob.glob(os.path.join(data_dir, f"{split}-*-of-*.parquet")):
+        os.remove(stale)
+    for i, shard in enumerate(shards):
+        name = shard_name(split, i, len(shards))
+        os.replace(shard.pop("tmp_path"), os.path.join(data_dir, name))
+        shard["path"] = f"{DATA_DIR}/{name}"
+
+    manifest = {
+        "split": split,
+        "compression": compression,
+        "row_group_size": row_group_size,
+        "partitioning": "link-hash" if num_shards else "sequential",
+        "columns": schema.names,
+        "num_rows": sum(s["num_rows"] for s in shards),
+        "num_bytes": sum(s["num_bytes"] for s in shards),
+        "shards": [{k: s[k] for k in ("path", "num_rows", "num_row_groups", "num_bytes")} for s in shards],
+    }
+    tmp_path = os.path.join(out_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILE))
+    print(f"Exported {manifest['num_rows']} rows to {len(shards)} shards "
+          f"({manifest['num_bytes'] / (1024*1024):.1f} MB) in {data_dir}.")
+    return manifest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the dataset as sharded Parquet.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to export.")
+    parser.add_argument("--out", default="hf_export", help="Output directory (default: hf_export).")
+    parser.add_argument("--split", default="train", help="Split name used in shard file names.")
+    parser.add_argument(
+        "--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE,
+        help=f"Books per Parquet row group (default: {DEFAULT_ROW_GROUP_SIZE})."
+    )
+    parser.add_argument(
+        "--max-shard-mb", type=float, default=DEFAULT_MAX_SHARD_BYTES / 1024**2,
+        help=f"Start a new shard beyond this size (default: {DEFAULT_MAX_SHARD_BYTES // 1024**2})."
+    )
+    parser.add_argument(
+        "--num-shards", type=int, default=None,
+        help="Assign books to this many shards by a hash of their link instead of filling shards in order."
+    )
+    parser.add_argument("--compression-level", type=int, default=None, help="zstd level.")
+    parser.add_argument(
+        "--dedup-groups", default=None,
+        help="Add a dedup_group column from a table written by `python -m src.dedup --groups`."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    dedup_groups = None
+    if args.dedup_groups:
+        from src.dedup import load_dedup_groups
+        dedup_groups = load_dedup_groups(args.dedup_groups)
+    export_parquet(
+        args.dataset, args.out, split=args.split, row_group_size=args.row_group_size,
+        max_shard_bytes=int(args.max_shard_mb * 1024**2), num_shards=args.num_shards,
+        compression_level=args.compression_level, dedup_groups=dedup_groups
+    )
@@ -0,0 +1,156 @@
+"""
+git_blobs.py
+
+Reads src/epub straight from a git object store, without a working tree.
+
+`clone_objects` makes a bare, shallow, blob-less clone of a repo and fetches
+the blobs of the src/epub files the parser reads (content.opf and the XHTML)
+in one batch. `GitBlobFiles` maps paths relative to src/epub to their blob
+ids, listed once with `git ls-tree`, and reads the bytes through a single
+long-lived `git cat-file --batch` process, only when the parser asks for
+them. Nothing under src/epub is ever written to disk, so a book costs a few
+pack files instead of a checkout of every chapter.
+"""
+
+import os
+import shutil
+import subprocess
+from collections.abc import Mapping
+
+from src.metrics import timed
+
+# Files the parser reads; anything else is fetched on demand by git if it is ever read
+PREFETCH_SUFFIXES = (".opf", ".xhtml")
+
+
+def _git(args, cwd=None, timeout=300, **kwargs):
+    return subprocess.run(
+        ["git"] + args,
+        cwd=cwd,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        timeout=timeout,
+        **kwargs
+    )
+
+
+def list_tree(repo_dir, ref="HEAD", path="src/epub"):
+    """
+    Return {path relative to `path`: blob id} of the files under `path` at `ref`,
+    or {} if `path` does not exist there.
+    """
+    try:
+        listing = _git(
+            ["ls-tree", "-r", "-z", f"{ref}:{path}"], cwd=repo_dir, stdout=subprocess.PIPE
+        ).stdout
+    except subprocess.CalledProcessError:
+        return {}
+    tree = {}
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        info, name = entry.split(b"\t", 1)
+        _, kind, oid = info.split()
+        if kind == b"blob":
+            tree[name.decode("utf-8")] = oid.decode("ascii")
+    return tree
+
+
+def clone_objects(repo_link, dest_dir, branch="master", metrics=None, book=None, timeout=300):
+    """
+    Bare, shallow, blob-less clone of `repo_link` into `dest_dir`, then fetch the
+    src/epub blobs the parser needs in one request. Returns the src/epub tree
+    (see list_tree). With `metrics`, the clone and the blob fetch are timed for `book`.
+    """
+    if os.path.exists(dest_dir):
+        shutil.rmtree(dest_dir)
+    try:
+        with timed(metrics, "clone", book):
+            _git([
+                "clone", "--bare", "--depth=1", "--filter=blob:none", "--no-tags",
+                "--single-branch", "--branch", branch, repo_link, dest_dir
+            ], stdout=subprocess.DEVNULL, timeout=timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        print(f"Git clone failed for {repo_link}")
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        raise
+
+    tree = list_tree(dest_dir)
+    wanted = [oid for name, oid in tree.items() if name.endswith(PREFETCH_SUFFIXES)]
+    if wanted:
+        with timed(metrics, "fetch_blobs", book):
+            # As git's own on-demand fetches do: without the noop negotiation a
+            # shallow clone advertises commits whose parents it lacks, and the fetch fails
+            _git(
+                [
+                    "-c", "fetch.negotiationAlgorithm=noop", "fetch", "--no-tags",
+                    "--no-write-fetch-head", "--filter=blob:none", "--stdin", "origin"
+                ],
+                cwd=dest_dir, input="\n".join(wanted) + "\n", stdout=subprocess.DEVNULL,
+                text=True, timeout=timeout
+            )
+    return tree
+
+
+class GitBlobFiles(Mapping):
+    """
+    Read-only mapping of path relative to src/epub -> bytes over a git object store.
+    Blobs are read through one `git cat-file --batch` process, started on the first
+    read and stopped by `close()`.
+    """
+
+    def __init__(self, repo_dir, tree=None, ref="HEAD", timeout=300):
+        self.repo_dir = repo_dir
+        self.tree = list_tree(repo_dir, ref) if tree is None else tree
+        self.timeout = timeout
+        self._proc = None
+
+    def _cat_file(self):
+        if self._proc is None:
+            self._proc = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=self.repo_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        return self._proc
+
+    def __getitem__(self, key):
+        oid = self.tree[key]
+        proc = self._cat_file()
+        proc.stdin.write(oid.encode("ascii") + b"\n")
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header or header.endswith(b" missing\n"):
+            raise KeyError(key)
+        size = int(header.split()[2])
+        data = proc.stdout.read(size)
+        # Each object is followed by a newline
+        proc.stdout.read(1)
+        return data
+
+    def __contains__(self, key):
+        return key in self.tree
+
+    def __iter__(self):
+        return iter(sorted(self.tree))
+
+    def __len__(self):
+        return len(self.tree)
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.stdin.close()
+            self._proc.stdout.close()
+            try:
+                self._proc.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                self._proc.wait()
+            self._proc = None
+
+    def __getstate__(self):
+        # A running process does not pickle; parse workers start their own
+        return {"repo_dir": self.repo_dir, "tree": self.tree, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._proc = None
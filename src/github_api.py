@@ -5,36 +5,89 @@ Handles fetching and filtering Standard Ebooks repositories from GitHub.
 """
 
 import os
-import requests
+import json
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from src.http_cache import make_session, parse_links
 
 GITHUB_ORG = "standardebooks"
 GITHUB_API = f"https://api.github.com/orgs/{GITHUB_ORG}/repos?per_page=100&type=public"
 
-def fetch_repo_list():
+def make_github_session(pool_size=8):
     """
-    Use GitHub API to fetch all repos from standardebooks org.
-    Returns a list of dicts with: name, link, updated_at, clone_url, default_branch.
-    Skips meta/tool repos.
+    Pooled Session authenticated with $GITHUB_TOKEN when it is set.
     """
     GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
     headers = {}
     if GITHUB_TOKEN:
         headers["Authorization"] = f"token {GITHUB_TOKEN}"
-    repos = []
-    page = 1
+    return make_session(pool_size=pool_size, headers=headers)
 
-    while True:
-        url = f"{GITHUB_API}&page={page}"
-        resp = requests.get(url, headers=headers)
-        print(f"GitHub API page {page} status: {resp.status_code}")
-        if resp.status_code != 200:
-            print(f"GitHub API error body: {resp.text}")
-            break
-        data = resp.json()
-        if not data:
-            print(f"No more data on page {page}.")
-            break
+def _page_number(url):
+    """
+    Return the `page` query parameter of a pagination URL, or None.
+    """
+    values = parse_qs(urlparse(url).query).get("page")
+    return int(values[0]) if values and values[0].isdigit() else None
 
+def _get_page(session, url, cache=None):
+    """
+    GET one page of the repo list. Returns (status, data or None, links).
+    """
+    try:
+        if cache is not None:
+            status, body, links = cache.get(session, url)
+        else:
+            resp = session.get(url, timeout=60)
+            status, body, links = resp.status_code, resp.text, parse_links(resp.headers.get("Link"))
+    except Exception as e:
+        print(f"GitHub API request failed for {url}: {e}")
+        return None, None, {}
+    if status != 200:
+        print(f"GitHub API error body: {body}")
+        return status, None, links
+    return status, json.loads(body), links
+
+def fetch_repo_list(api_url=GITHUB_API, cache=None, session=None, workers=8):
+    """
+    Use GitHub API to fetch all repos from standardebooks org.
+    Returns a list of dicts with: name, link, updated_at, clone_url, default_branch.
+    Skips meta/tool repos.
+
+    Requests go through one pooled Session. Page 1's Link header gives the last
+    page, and the remaining pages are fetched concurrently with `workers` threads.
+    With an `HTTPCache`, pages are requested conditionally and unchanged pages
+    (304) are served from the cache.
+    """
+    if session is None:
+        session = make_github_session(pool_size=workers)
+
+    status, first, links = _get_page(session, f"{api_url}&page=1", cache)
+    print(f"GitHub API page 1 status: {status}")
+    pages = [first or []]
+    last_page = _page_number(links["last"]) if "last" in links else None
+
+    if first and last_page and last_page > 1:
+        urls = [f"{api_url}&page={page}" for page in range(2, last_page + 1)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page, (status, data, _) in enumerate(executor.map(lambda url: _get_page(session, url, cache), urls), 2):
+                if data is None:
+                    print(f"GitHub API page {page} status: {status}")
+                pages.append(data or [])
+    elif first and not last_page:
+        # No Link header: walk the pages until a short one
+        page = 1
+        while len(pages[-1]) == 100:
+            page += 1
+            status, data, _ = _get_page(session, f"{api_url}&page={page}", cache)
+            print(f"GitHub API page {page} status: {status}")
+            if not data:
+                break
+            pages.append(data)
+
+    repos = []
+    for data in pages:
         for repo in data:
             # Heuristic: HTML book repos have "standardebooks" as owner and are not meta/tools
             if repo["name"].startswith("standardebooks-") or repo["name"] in ["site", "tools", "se-builder"]:
@@ -47,12 +100,10 @@ def fetch_repo_list():
                 "default_branch": repo["default_branch"],
             })
 
-        # If we got fewer than 100 repos, we've reached the end
-        if len(data) < 100:
-            break
-        page += 1
-
-    print(f"Fetched {len(repos)} repos from GitHub API across {page} pages.")
+    if cache is not None:
+        cache.save()
+        print(f"GitHub API cache: {cache.hits} pages unchanged (304), {cache.misses} fetched.")
+    print(f"Fetched {len(repos)} repos from GitHub API across {len(pages)} pages.")
     return repos
 
 def filter_updated_repos(new_list, old_list_path):
@@ -0,0 +1,100 @@
+"""
+http_cache.py
+
+Pooled HTTP session and a persistent cache of GET responses for conditional
+requests.
+
+Each cached response keeps its ETag / Last-Modified validators, its Link header
+and its body. Re-requesting a URL sends If-None-Match / If-Modified-Since, so an
+unchanged resource comes back as an empty 304 (which GitHub does not count
+against the rate limit) and is served from the cache.
+"""
+
+import os
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import parse_header_links
+
+
+def make_session(pool_size=16, headers=None):
+    """
+    Return a requests Session whose connection pool holds `pool_size` connections
+    per host, so concurrent requests reuse TLS connections instead of reconnecting.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def parse_links(link_header):
+    """
+    Parse an RFC 8288 Link header into {rel: url}, like `Response.links`.
+    """
+    if not link_header:
+        return {}
+    return {link["rel"]: link["url"] for link in parse_header_links(link_header) if "rel" in link}
+
+
+class HTTPCache:
+    """
+    JSON file of {url: {"etag", "last_modified", "link", "body"}}.
+    Safe to share between threads; call `save()` once the requests are done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, session, url, timeout=60):
+        """
+        Conditional GET of `url`.
+        Returns (status, body text, links); a 304 is returned as the cached 200.
+        """
+        with self._lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        resp = session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and entry:
+            with self._lock:
+                self.hits += 1
+            return 200, entry["body"], parse_links(entry.get("link"))
+
+        with self._lock:
+            self.misses += 1
+            if resp.status_code == 200 and (resp.headers.get("ETag") or resp.headers.get("Last-Modified")):
+                self.entries[url] = {
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                    "link": resp.headers.get("Link"),
+                    "body": resp.text,
+                }
+        return resp.status_code, resp.text, parse_links(resp.headers.get("Link"))
@@ -0,0 +1,181 @@
+"""
+local_source.py
+
+Builds from local files instead of GitHub: a directory of compiled `.epub`
+files (e.g. a mirror of the Standard Ebooks releases) and/or repos that are
+already checked out.
+
+An `.epub` is read in place: `META-INF/container.xml` gives the path of the
+OPF, and `EpubZipFiles` maps paths relative to the OPF's directory to member
+bytes, reading each member from the zip only when the parser asks for it.
+Nothing is extracted to disk. The mapping only holds the zip's path until it
+is first read, so it can be sent to parse worker processes, which open the
+zip themselves; several archives are then parsed in parallel.
+
+Books are named like their GitHub repos (`author_title`, which is also how
+Standard Ebooks names its .epub downloads), so rows built locally have the
+same links as rows built from GitHub.
+"""
+
+import os
+import zipfile
+import posixpath
+from datetime import datetime, timezone
+from collections.abc import Mapping
+
+from lxml import etree
+
+CONTAINER_PATH = "META-INF/container.xml"
+CONTAINER_NS = {"c": "urn:oasis:names:tc:opendocument:xmlns:container"}
+OPF_MEDIA_TYPE = "application/oebps-package+xml"
+LINK_TEMPLATE = "https://github.com/standardebooks/{name}"
+# Standard Ebooks download variants of the same book
+EPUB_SUFFIXES = (".kepub.epub", "_advanced.epub", ".epub")
+
+
+def find_opf_path(archive):
+    """
+    Path of the OPF package document inside an open ZipFile, from META-INF/container.xml.
+    """
+    try:
+        container = etree.fromstring(archive.read(CONTAINER_PATH))
+    except KeyError:
+        raise ValueError(f"{CONTAINER_PATH} not found")
+    rootfiles = container.findall(".//c:rootfile", namespaces=CONTAINER_NS)
+    for rootfile in rootfiles:
+        if rootfile.get("media-type", OPF_MEDIA_TYPE) == OPF_MEDIA_TYPE and rootfile.get("full-path"):
+            return rootfile.get("full-path")
+    raise ValueError(f"No OPF rootfile in {CONTAINER_PATH}")
+
+
+class EpubZipFiles(Mapping):
+    """
+    Read-only mapping of path relative to the OPF's directory -> bytes over an .epub file.
+    "content.opf" is the OPF whatever its name in the archive, as in a src/epub tree.
+    """
+
+    def __init__(self, path, opf_path=None):
+        self.path = path
+        self._archive = None
+        self._names = None
+        self.opf_path = opf_path
+        if opf_path is None:
+            self.opf_path = find_opf_path(self._open())
+        self.base = posixpath.dirname(self.opf_path)
+
+    def _open(self):
+        if self._archive is None:
+            self._archive = zipfile.ZipFile(self.path)
+            self._names = {info.filename for info in self._archive.infolist() if not info.is_dir()}
+        return self._archive
+
+    def _member(self, key):
+        if key == "content.opf":
+            return self.opf_path
+        # Hrefs may step out of the OPF's directory (../Text/ch1.xhtml); zip names are never relative
+        return posixpath.normpath(posixpath.join(self.base, key)) if self.base else posixpath.normpath(key)
+
+    def __getitem__(self, key):
+        archive = self._open()
+        member = self._member(key)
+        if member not in self._names:
+            raise KeyError(key)
+        return archive.read(member)
+
+    def __contains__(self, key):
+        self._open()
+        return self._member(key) in self._names
+
+    def __iter__(self):
+        self._open()
+        prefix = self.base + "/" if self.base else ""
+        for name in sorted(self._names):
+            if name == self.opf_path:
+                yield "content.opf"
+            elif name.startswith(prefix):
+                yield name[len(prefix):]
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+            self._archive = None
+
+    def __getstate__(self):
+        # Open zip handles do not pickle; workers reopen the file
+        return {"path": self.path, "opf_path": self.opf_path, "base": self.base}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._archive = None
+        self._names = None
+
+
+def book_name(filename):
+    """
+    Repo name of a book from its .epub file name or checkout directory.
+    """
+    for suffix in EPUB_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def _timestamp(mtime):
+    return datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _tree_mtime(root):
+    mtimes = [os.path.getmtime(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(root) for name in names]
+    return _timestamp(max(mtimes, default=os.path.getmtime(root)))
+
+
+def find_local_books(root):
+    """
+    List the books under `root`: `*.epub` files and repo checkouts (directories
+    with src/epub/content.opf), in the format of src/github_api.fetch_repo_list.
+    Each entry's "path" is the .epub file or the src/epub directory, and its
+    "updated_at" the newest modification time of the book's files.
+    If the same book is both an .epub and a checkout, the checkout wins.
+    """
+    books = {}
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_file() and entry.name.endswith(".epub"):
+            name = book_name(entry.name)
+            if name in books:
+                continue
+            books[name] = {"path": entry.path, "kind": "epub", "updated_at": _timestamp(os.path.getmtime(entry.path))}
+        elif entry.is_dir() and os.path.isfile(os.path.join(entry.path, "src", "epub", "content.opf")):
+            epub_dir = os.path.join(entry.path, "src", "epub")
+            books[entry.name] = {"path": epub_dir, "kind": "checkout", "updated_at": _tree_mtime(epub_dir)}
+
+    repos = []
+    for name, book in books.items():
+        link = LINK_TEMPLATE.format(name=name)
+        repos.append({
+            "name": name,
+            "link": link,
+            "updated_at": book["updated_at"],
+            "clone_url": link + ".git",
+            "default_branch": "master",
+            "path": os.path.abspath(book["path"]),
+            "kind": book["kind"],
+        })
+    print(f"Found {sum(r['kind'] == 'epub' for r in repos)} .epub files and "
+          f"{sum(r['kind'] == 'checkout' for r in repos)} repo checkouts in {root}.")
+    return repos
+
+
+def open_local_book(repo):
+    """
+    Source of a book found by `find_local_books`, for parse_opf_and_extract_text:
+    an EpubZipFiles for .epub files, the src/epub directory for checkouts.
+    """
+    if repo["kind"] == "epub":
+        source = EpubZipFiles(repo["path"])
+        # The OPF location is known now; the handle is reopened where the book is parsed
+        source.close()
+        return source
+    return repo["path"]
@@ -0,0 +1,296 @@
+"""
+markdown_converter.py
+
+XHTML -> Markdown conversion that walks the lxml tree directly.
+
+This reproduces the output of markdownify with the options the parser uses
+(tag whitelist, ATX headings, "-" bullets, "*" emphasis, `---` for <hr> and
+blank-line paragraph spacing) without building a BeautifulSoup tree, without
+regex-extracting <body> and without re-parsing the file as HTML. Every
+element contributes its parts to one list per block, joined once.
+
+Files that are not well-formed XML return None so the caller can fall back to
+markdownify, whose HTML parser tolerates broken markup.
+"""
+
+import re
+from functools import lru_cache
+from lxml import etree
+
+XHTML_NS = "http://www.w3.org/1999/xhtml"
+
+# Same whitelist as the markdownify call this converter replaces
+CONVERT_TAGS = (
+    'p', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li',
+    'em', 'i', 'b', 'strong', 'abbr', 'blockquote', 'code', 'pre',
+)
+BULLETS = "-"
+EMPHASIS = "*"
+
+_BLOCK_TAGS = frozenset([
+    'p', 'blockquote', 'article', 'div', 'section', 'ol', 'ul', 'li',
+    'dl', 'dt', 'dd', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th',
+])
+_NOFORMAT_TAGS = frozenset(['pre', 'code', 'kbd', 'samp'])
+_CONVERT = frozenset(CONVERT_TAGS)
+
+re_heading = re.compile(r'h(\d+)')
+re_line_with_content = re.compile(r'^(.*)', flags=re.MULTILINE)
+re_whitespace = re.compile(r'[\t ]+')
+re_all_whitespace = re.compile(r'[\t \r\n]+')
+re_newline_whitespace = re.compile(r'[\t \r\n]*[\r\n][\t \r\n]*')
+re_pre_lstrip = re.compile(r'^[ \n]*\n')
+re_pre_rstrip = re.compile(r'[ \n]*$')
+re_extract_newlines = re.compile(r'^(\n*)((?:.*[^\n])?)(\n*)$', flags=re.DOTALL)
+re_backtick_runs = re.compile(r'`+')
+
+_PARSER = etree.XMLParser(resolve_entities=False, huge_tree=True)
+
+
+def _tag_name(el):
+    """
+    HTML-parser style tag name: local name for XHTML, `prefix:local` otherwise.
+    Comments and processing instructions have no name.
+    """
+    tag = el.tag
+    if not isinstance(tag, str):
+        return None
+    if tag[0] != '{':
+        return tag
+    namespace, local = tag[1:].split('}', 1)
+    if namespace == XHTML_NS or not el.prefix:
+        return local
+    return f"{el.prefix}:{local}"
+
+
+@lru_cache(maxsize=None)
+def _is_block(name):
+    return name is not None and (name in _BLOCK_TAGS or re_heading.match(name) is not None)
+
+
+@lru_cache(maxsize=None)
+def _is_block_or_pre(name):
+    return _is_block(name) or name == 'pre'
+
+
+def _child_nodes(el):
+    """
+    Children of `el` as a flat list of text strings and elements, like a DOM,
+    plus the tag name of each (None for text, comments and processing instructions).
+    """
+    nodes = []
+    names = []
+    if el.text:
+        nodes.append(el.text)
+        names.append(None)
+    for child in el:
+        nodes.append(child)
+        names.append(_tag_name(child))
+        if child.tail:
+            nodes.append(child.tail)
+            names.append(None)
+    return nodes, names
+
+
+def _chomp(text):
+    prefix = ' ' if text and text[0] == ' ' else ''
+    suffix = ' ' if text and text[-1] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+def _inline(markup, text, parent_tags):
+    if '_noformat' in parent_tags:
+        return text
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    return prefix + markup + text + markup + suffix
+
+
+def _next_block_content(nodes, names, index):
+    """
+    Name of the next sibling that is an element or non-blank text ("" for text), or None.
+    """
+    for i in range(index + 1, len(nodes)):
+        if names[i] is not None:
+            return names[i]
+        if isinstance(nodes[i], str) and nodes[i].strip() != '':
+            return ''
+    return None
+
+
+def _convert(name, el, text, parent_tags, parent, nodes, names, index):
+    """
+    Apply the conversion for a whitelisted tag to its converted children `text`.
+    """
+    if name == 'p':
+        if '_inline' in parent_tags:
+            return ' ' + text.strip(' \t\r\n') + ' '
+        text = text.strip(' \t\r\n')
+        return '\n\n%s\n\n' % text if text else ''
+
+    if name == 'hr':
+        return '\n\n---\n\n'
+
+    heading = re_heading.match(name)
+    if heading:
+        if '_inline' in parent_tags:
+            return text
+        n = max(1, min(6, int(heading.group(1))))
+        text = re_all_whitespace.sub(' ', text.strip())
+        return '\n\n%s %s\n\n' % ('#' * n, text)
+
+    if name in ('em', 'i'):
+        return _inline(EMPHASIS, text, parent_tags)
+
+    if name in ('b', 'strong'):
+        return _inline(2 * EMPHASIS, text, parent_tags)
+
+    if name in ('ul', 'ol'):
+        next_sibling = _next_block_content(nodes, names, index)
+        before_paragraph = next_sibling is not None and next_sibling not in ('ul', 'ol')
+        if 'li' in parent_tags:
+            return '\n' + text.rstrip()
+        return '\n\n' + text + ('\n' if before_paragraph else '')
+
+    if name == 'li':
+        text = (text or '').strip()
+        if not text:
+            return '\n'
+        if parent is not None and _tag_name(parent) == 'ol':
+            start = parent.get('start')
+            start = int(start) if start and start.isnumeric() else 1
+            previous = names[:index].count('li')
+            bullet = '%s.' % (start + previous)
+        else:
+            depth = -1
+            node = el
+            while node is not None:
+                if _tag_name(node) == 'ul':
+                    depth += 1
+                node = node.getparent()
+            bullet = BULLETS[depth % len(BULLETS)]
+        bullet = bullet + ' '
+        indent = ' ' * len(bullet)
+        text = re_line_with_content.sub(lambda m: indent + m.group(1) if m.group(1) else '', text)
+        return bullet + text[len(bullet):] + '\n'
+
+    if name == 'blockquote':
+        text = (text or '').strip(' \t\r\n')
+        if '_inline' in parent_tags:
+            return ' ' + text + ' '
+        if not text:
+            return '\n'
+        text = re_line_with_content.sub(lambda m: '> ' + m.group(1) if m.group(1) else '>', text)
+        return '\n' + text + '\n\n'
+
+    if name == 'code':
+        if '_noformat' in parent_tags:
+            return text
+        prefix, suffix, text = _chomp(text)
+        if not text:
+            return ''
+        max_backticks = max((len(run) for run in re_backtick_runs.findall(text)), default=0)
+        delimiter = '`' * (max_backticks + 1)
+        if max_backticks > 0:
+            text = ' ' + text + ' '
+        return prefix + delimiter + text + delimiter + suffix
+
+    if name == 'pre':
+        if not text:
+            return ''
+        text = re_pre_rstrip.sub('', re_pre_lstrip.sub('', text))
+        return '\n\n```\n%s\n```\n\n' % text
+
+    # Whitelisted but without a conversion (abbr): keep the children's text
+    return text
+
+
+def _process_text(text, parent_tags, parent_name, names, index):
+    if 'pre' not in parent_tags:
+        text = re_newline_whitespace.sub('\n', text)
+        text = re_whitespace.sub(' ', text)
+    if '_noformat' not in parent_tags:
+        text = text.replace('*', r'\*').replace('_', r'\_')
+
+    inside = _is_block(parent_name)
+    if index > 0:
+        if _is_block_or_pre(names[index - 1]):
+            text = text.lstrip(' \t\r\n')
+    elif inside:
+        text = text.lstrip(' \t\r\n')
+    if index + 1 < len(names):
+        if _is_block_or_pre(names[index + 1]):
+            text = text.rstrip()
+    elif inside:
+        text = text.rstrip()
+    return text
+
+
+def _process_element(el, name, parent_tags, parent=None, nodes=(), names=(), index=0):
+    """
+    Convert `el` and its subtree; `nodes[index]` is `el` within its parent's children.
+    """
+    children, child_names = _child_nodes(el)
+    remove_inside = _is_block(name)
+
+    child_tags = set(parent_tags)
+    child_tags.add(name)
+    if re_heading.match(name) is not None or name in ('td', 'th'):
+        child_tags.add('_inline')
+    if name in _NOFORMAT_TAGS:
+        child_tags.add('_noformat')
+
+    parts = []
+    last = len(children) - 1
+    for i, child in enumerate(children):
+        if isinstance(child, str):
+            if child.strip() == '':
+                # Whitespace next to block boundaries carries no content
+                if remove_inside and (i == 0 or i == last):
+                    continue
+                if ((i > 0 and _is_block_or_pre(child_names[i - 1]))
+                        or (i < last and _is_block_or_pre(child_names[i + 1]))):
+                    continue
+            part = _process_text(child, child_tags, name, child_names, i)
+        elif child_names[i] is None:
+            # Comments and processing instructions
+            continue
+        else:
+            part = _process_element(child, child_names[i], child_tags, el, children, child_names, i)
+        if part:
+            parts.append(part)
+
+    if len(parts) > 1 and name != 'pre' and 'pre' not in parent_tags:
+        # Collapse newlines at child boundaries to at most one blank line
+        collapsed = ['']
+        for part in parts:
+            leading, content, trailing = re_extract_newlines.match(part).groups()
+            if collapsed[-1] and leading:
+                previous = collapsed.pop()
+                leading = '\n' * min(2, max(len(previous), len(leading)))
+            collapsed.extend([leading, content, trailing])
+        parts = collapsed
+
+    text = ''.join(parts)
+    if name in _CONVERT:
+        text = _convert(name, el, text, parent_tags, parent, nodes, names, index)
+    return text
+
+
+def xhtml_to_markdown_lxml(xhtml):
+    """
+    Convert the <body> of an XHTML document (str without XML declaration, or bytes)
+    to Markdown. Returns None if the document is not well-formed or has no body.
+    """
+    try:
+        root = etree.fromstring(xhtml, _PARSER)
+    except (etree.XMLSyntaxError, ValueError):
+        return None
+    body = root if _tag_name(root) == 'body' else root.find(f"{{{XHTML_NS}}}body")
+    if body is None:
+        body = root.find("body")
+    if body is None:
+        return None
+    # The body's children are converted as a document fragment
+    return _process_element(body, '[document]', set())
@@ -0,0 +1,149 @@
+"""
+md_cache.py
+
+Content-addressed cache of per-chapter Markdown conversions.
+
+Each XHTML file is keyed on a hash of its bytes plus the converter settings,
+so unchanged chapters skip conversion entirely when a book is re-parsed and a
+settings change invalidates everything at once. Entries are stored
+zlib-compressed in SQLite (WAL mode, so several parse processes can share one
+cache), with hit/miss counters and least-recently-used eviction beyond a size
+cap.
+"""
+
+import time
+import zlib
+import sqlite3
+import hashlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    key TEXT PRIMARY KEY,
+    markdown BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chapters_last_used ON chapters (last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0);
+"""
+
+
+class MarkdownCache:
+    """
+    SQLite-backed chapter cache.
+
+    The connection is opened lazily and is not pickled, so a cache object can
+    be passed to parse workers in a process pool; each process opens its own
+    connection. Counters are kept in memory and added to the persistent totals
+    by `flush()`.
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+    def __getstate__(self):
+        return {"path": self.path, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], max_bytes=state["max_bytes"])
+
+    def _connect(self):
+        if self._conn is None:
+            # main.py opens the connection in the main thread (stats()), then with
+            # --workers 1 the pipeline's parse thread uses it. They never overlap:
+            # run_pipeline joins its parse threads before it returns, even on Ctrl-C
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+    def key(self, data, settings):
+        """
+        Cache key of an XHTML file: hash of the converter settings and the file bytes.
+        """
+        h = hashlib.blake2b(digest_size=20)
+        h.update(settings.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached Markdown for `key`, or None on a miss.
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT markdown FROM chapters WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute("UPDATE chapters SET last_used = ? WHERE key = ?", (time.time(), key))
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key, markdown):
+        data = zlib.compress(markdown.encode("utf-8"))
+        self._connect().execute(
+            "INSERT OR REPLACE INTO chapters VALUES (?, ?, ?, ?)",
+            (key, data, len(data), time.time())
+        )
+
+    def flush(self):
+        """
+        Add the in-memory counters to the persistent totals and enforce the size cap.
+        Called once per book, so the per-chapter path stays read-mostly.
+        """
+        conn = self._connect()
+        if self.hits or self.misses:
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (self.hits,))
+            conn.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (self.misses,))
+            self.hits = 0
+            self.misses = 0
+        self._evict()
+
+    def _evict(self):
+        """
+        Delete least recently used entries until the cache is below 90% of max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chapters").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        rows = conn.execute("SELECT key, size FROM chapters ORDER BY last_used").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= target:
+                break
+            stale.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM chapters WHERE key = ?", stale)
+
+    def stats(self):
+        """
+        Return persistent totals: hits, misses, entries and bytes.
+        """
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chapters").fetchone()
+        stats["hits"] += self.hits
+        stats["misses"] += self.misses
+        stats["entries"] = entries
+        stats["bytes"] = size
+        return stats
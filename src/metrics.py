@@ -0,0 +1,236 @@
+"""
+metrics.py
+
+Per-book, per-stage timing and memory instrumentation for a build run.
+
+Stages are timed with `timed(metrics, stage, book)`, which does nothing when
+`metrics` is None, so instrumented functions cost nothing when no run
+metrics are collected. Stages that run in parse worker processes measure
+themselves and hand back a `timings` dict with the parsed book (see
+`record_timings`).
+
+Memory per stage is the resident set size sampled when the stage ends, in the
+process that ran it, and, with `trace_memory`, the tracemalloc peak since the
+stage started. tracemalloc is process-wide, so with several clone or parse
+threads a stage's peak includes whatever ran concurrently.
+
+At the end of a run `write_report` writes a JSON summary (per-stage count,
+total, mean, p50, p95, max and peak memory, plus the slowest books) and
+`write_prometheus` a node_exporter textfile.
+"""
+
+import os
+import json
+import time
+import cProfile
+import tempfile
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+PROMETHEUS_PREFIX = "ebooks_build"
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes.
+    Falls back to the peak RSS where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def timed(metrics, stage, book=None):
+    """
+    Context manager timing `stage` for `book`; a no-op when `metrics` is None.
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(stage, book)
+
+
+def profile_call(profile_dir, func, *args, **kwargs):
+    """
+    Run `func` under cProfile and, if it returns a dict, dump the stats to a
+    file in `profile_dir` and add its path to the result as "profile_path". Top-level so that it
+    can be pickled to parse worker processes (via functools.partial).
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    if isinstance(result, dict):
+        os.makedirs(profile_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".prof.tmp", dir=profile_dir)
+        os.close(fd)
+        profiler.dump_stats(path)
+        result["profile_path"] = path
+    return result
+
+
+def keep_slowest_profiles(metrics, profiles, n):
+    """
+    Keep the cProfile dumps of the `n` slowest books as <book>.prof and delete the rest.
+    `profiles` maps book name -> dump path. Returns the kept paths.
+    """
+    slowest = set(metrics.slowest_books(n))
+    kept = []
+    for book, path in profiles.items():
+        if book in slowest:
+            target = os.path.join(os.path.dirname(path), f"{book}.prof")
+            os.replace(path, target)
+            kept.append(target)
+        elif os.path.exists(path):
+            os.remove(path)
+    return kept
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RunMetrics:
+    """
+    Thread-safe collector of stage samples for one run.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.books = {}
+        self.counters = {}
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage, book=None):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            traced = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+            self.record(stage, time.perf_counter() - start, book, rss=current_rss(), traced=traced)
+
+    def record(self, stage, seconds, book=None, rss=None, traced=None):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": [], "peak_rss": 0, "peak_traced": 0})
+            entry["seconds"].append(seconds)
+            if rss:
+                entry["peak_rss"] = max(entry["peak_rss"], rss)
+            if traced:
+                entry["peak_traced"] = max(entry["peak_traced"], traced)
+            if book is not None:
+                stages = self.books.setdefault(book, {})
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def record_timings(self, book, timings):
+        """
+        Merge the {"stage": seconds, ..., "rss_bytes": n} dict measured in a parse worker.
+        """
+        rss = timings.get("rss_bytes")
+        for stage, seconds in timings.items():
+            if stage != "rss_bytes":
+                self.record(stage, seconds, book, rss=rss)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def slowest_books(self, n=10):
+        with self._lock:
+            totals = [(sum(stages.values()), book) for book, stages in self.books.items()]
+        return [book for _, book in sorted(totals, reverse=True)[:n]]
+
+    def summary(self, slowest=10):
+        with self._lock:
+            stages = {}
+            for stage, entry in self.stages.items():
+                values = sorted(entry["seconds"])
+                stages[stage] = {
+                    "count": len(values),
+                    "total_seconds": round(sum(values), 6),
+                    "mean_seconds": round(sum(values) / len(values), 6),
+                    "p50_seconds": round(_percentile(values, 0.5), 6),
+                    "p95_seconds": round(_percentile(values, 0.95), 6),
+                    "max_seconds": round(values[-1], 6),
+                    "peak_rss_bytes": entry["peak_rss"],
+                }
+                if self.trace_memory:
+                    stages[stage]["peak_traced_bytes"] = entry["peak_traced"]
+            books = {book: dict(s) for book, s in self.books.items()}
+            counters = dict(self.counters)
+        slowest_books = [
+            {"book": book, "total_seconds": round(sum(books[book].values()), 6),
+             "stages": {k: round(v, 6) for k, v in books[book].items()}}
+            for book in self.slowest_books(slowest)
+        ]
+        return {
+            "started_at": self.started_at,
+            "duration_seconds": round(time.perf_counter() - self._start, 6),
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "books": len(books),
+            "counters": counters,
+            "stages": stages,
+            "slowest_books": slowest_books,
+        }
+
+    def write_report(self, path, slowest=10):
+        """
+        Write the JSON run report atomically and return the summary.
+        """
+        summary = self.summary(slowest)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, path)
+        return summary
+
+    def write_prometheus(self, path):
+        """
+        Write the summary in the Prometheus text format, for node_exporter's textfile collector.
+        The file is replaced atomically so a scrape never sees a partial file.
+        """
+        summary = self.summary(slowest=0)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{PROMETHEUS_PREFIX}_{name} {value}")
+
+        stages = summary["stages"]
+        metric("stage_seconds_total", "gauge", "Total time spent in each stage during the last run.",
+               [({"stage": s}, e["total_seconds"]) for s, e in stages.items()])
+        metric("stage_runs", "gauge", "Number of times each stage ran during the last run.",
+               [({"stage": s}, e["count"]) for s, e in stages.items()])
+        metric("stage_max_seconds", "gauge", "Slowest single run of each stage.",
+               [({"stage": s}, e["max_seconds"]) for s, e in stages.items()])
+        metric("stage_p95_seconds", "gauge", "95th percentile duration of each stage.",
+               [({"stage": s}, e["p95_seconds"]) for s, e in stages.items()])
+        metric("stage_peak_rss_bytes", "gauge", "Peak resident set size observed at the end of each stage.",
+               [({"stage": s}, e["peak_rss_bytes"]) for s, e in stages.items()])
+        metric("books", "gauge", "Books processed by the counter name.",
+               [({"status": k}, v) for k, v in summary["counters"].items()])
+        metric("run_duration_seconds", "gauge", "Wall time of the last run.", [({}, summary["duration_seconds"])])
+        metric("run_peak_rss_bytes", "gauge", "Peak resident set size of the build process.",
+               [({}, summary["peak_rss_bytes"])])
+        metric("last_run_timestamp_seconds", "gauge", "Start time of the last run.", [({}, summary["started_at"])])
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
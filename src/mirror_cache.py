@@ -0,0 +1,197 @@
+"""
+mirror_cache.py
+
+Opt-in persistent cache of bare, partial-clone (blob:none) git mirrors, one per
+Standard Ebooks repository.
+
+The first run clones commits and trees only. Later runs `git fetch` just the
+new commits, download the src/epub blobs of the fetched ref in one batch and
+read them with `git archive`, so nightly incremental runs transfer deltas
+instead of full trees. The cache tracks the size of every mirror and evicts
+the least recently used ones once `max_bytes` is exceeded.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+
+from src.archive import extract_epub_from_tar
+
+INDEX_FILE = "cache_index.json"
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    """
+    Directory of bare mirrors with size accounting and LRU eviction.
+    Safe to share between the clone threads of one pipeline.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, timeout=300):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._in_use = set()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_FILE)
+
+    def _load_index(self):
+        """
+        Load {name: {"last_used": ts, "bytes": n}}, dropping entries whose mirror is gone.
+        """
+        index = {}
+        if os.path.exists(self._index_path()):
+            try:
+                with open(self._index_path(), "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except Exception as e:
+                print(f"Error loading {self._index_path()}: {e}")
+        index = {name: entry for name, entry in index.items() if os.path.isdir(self.mirror_path(name))}
+        # Mirrors left behind by an interrupted run are accounted for too
+        for entry in os.listdir(self.cache_dir):
+            if not entry.endswith(".git"):
+                continue
+            name = entry[:-len(".git")]
+            if name not in index:
+                path = self.mirror_path(name)
+                index[name] = {"last_used": os.path.getmtime(path), "bytes": _dir_size(path)}
+        return index
+
+    def _save_index(self):
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self._index_path())
+
+    def mirror_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.git")
+
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self.index.values())
+
+    def _git(self, args, cwd=None, **kwargs):
+        return subprocess.run(
+            ["git"] + args,
+            cwd=cwd,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            timeout=self.timeout,
+            **kwargs
+        )
+
+    def update_mirror(self, clone_url, name, branch="master"):
+        """
+        Clone the mirror if it is missing, otherwise fetch only the new commits.
+        Returns the mirror path.
+        """
+        path = self.mirror_path(name)
+        if os.path.isdir(path):
+            try:
+                self._git([
+                    "fetch", "--no-tags", "--filter=blob:none", "origin",
+                    f"+refs/heads/{branch}:refs/heads/{branch}"
+                ], cwd=path, stdout=subprocess.DEVNULL)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                print(f"Mirror fetch failed for {clone_url}")
+                raise
+            return path
+
+        try:
+            self._git([
+                "clone", "--bare", "--filter=blob:none", "--no-tags",
+                "--single-branch", "--branch", branch, clone_url, path
+            ], stdout=subprocess.DEVNULL)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            print(f"Mirror clone failed for {clone_url}")
+            # A half-written mirror would be mistaken for a valid one next time
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return path
+
+    def read_epub(self, name, branch="master"):
+        """
+        Return the src/epub files at the tip of `branch` as {relative path: bytes}.
+        Missing blobs are fetched in a single batch before reading.
+        """
+        path = self.mirror_path(name)
+        ref = f"refs/heads/{branch}"
+        try:
+            listing = self._git(
+                ["rev-list", "--objects", "--missing=print", f"{ref}:src/epub"],
+                cwd=path, stdout=subprocess.PIPE, text=True
+            ).stdout
+        except subprocess.CalledProcessError:
+            # No src/epub in this repo
+            return {}
+        missing = [line[1:] for line in listing.splitlines() if line.startswith("?")]
+        if missing:
+            self._git(
+                ["fetch", "--no-tags", "--no-write-fetch-head", "--filter=blob:none", "--stdin", "origin"],
+                cwd=path, input="\n".join(missing) + "\n", stdout=subprocess.DEVNULL, text=True
+            )
+
+        proc = subprocess.Popen(
+            ["git", "archive", "--format=tar", f"--prefix={name}/", ref, "src/epub"],
+            cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        try:
+            files = extract_epub_from_tar(proc.stdout, mode="r|")
+        finally:
+            proc.stdout.close()
+            proc.wait(timeout=self.timeout)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "git archive")
+        return files
+
+    def fetch_epub(self, clone_url, name, branch="master"):
+        """
+        Update the mirror of `name` and return its src/epub files.
+        """
+        with self._lock:
+            self._in_use.add(name)
+        try:
+            path = self.update_mirror(clone_url, name, branch=branch)
+            files = self.read_epub(name, branch=branch)
+            size = _dir_size(path)
+        finally:
+            with self._lock:
+                self._in_use.discard(name)
+        with self._lock:
+            self.index[name] = {"last_used": time.time(), "bytes": size}
+            self._evict()
+            self._save_index()
+        return files
+
+    def _evict(self):
+        """
+        Remove least recently used mirrors until the cache fits in max_bytes.
+        Mirrors that are being fetched by another thread are never evicted,
+        and neither is the most recently used one.
+        """
+        if self.max_bytes is None:
+            return
+        by_age = sorted(self.index.items(), key=lambda item: item[1]["last_used"])
+        for name, entry in by_age[:-1]:
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if name in self._in_use:
+                continue
+            shutil.rmtree(self.mirror_path(name), ignore_errors=True)
+            del self.index[name]
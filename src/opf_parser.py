@@ -1,22 +1,174 @@
 import re
+import os
+import json
+import time
+import posixpath
+from collections.abc import Mapping
 from pathlib import Path
-from lxml.etree import parse as etree_parse
+from lxml.etree import fromstring as etree_fromstring
+from importlib.metadata import version
 from markdownify import markdownify as md
 
-def parse_opf_and_extract_text(epub_path, max_files=None):
+from src.markdown_converter import CONVERT_TAGS, xhtml_to_markdown_lxml
+from src.dataset import text_hash
+from src.metrics import current_rss
+
+MARKDOWN_OPTIONS = {
+    "convert": list(CONVERT_TAGS),
+    "heading_style": "ATX",
+    "bullets": "-",
+}
+# Bump CONVERTER_REVISION whenever xhtml_to_markdown changes its output;
+# it is part of the chapter cache key together with the options above.
+# (The lxml converter in revision 2 reproduces markdownify's output.)
+CONVERTER_REVISION = 2
+CONVERTER_SETTINGS = json.dumps({
+    "revision": CONVERTER_REVISION,
+    "markdownify": version("markdownify"),
+    "options": MARKDOWN_OPTIONS,
+}, sort_keys=True)
+
+
+re_heading_line = re.compile(r'^#{1,6} +(.+)$', re.M)
+
+
+def _custom_md_tag(tag, name, value):
+    if name == "p":
+        return "\n\n" + value + "\n\n"
+    if name == "hr":
+        return "\n\n---\n\n"
+    return None
+
+
+def xhtml_to_markdown(file_content):
+    """
+    Convert the body of one XHTML file to Markdown.
+    Uses the lxml tree walker; markdownify is only used for files that are not well-formed XML.
+    """
+    markdown = xhtml_to_markdown_lxml(file_content)
+    if markdown is None:
+        return xhtml_to_markdown_markdownify(file_content)
+
+    # Clean up excessive blank lines
+    if "\n\n\n" in markdown:
+        markdown = re.sub(r'\n{3,}', '\n\n', markdown)
+    return markdown.strip()
+
+
+def xhtml_to_markdown_markdownify(file_content):
+    """
+    Reference conversion with markdownify (BeautifulSoup + html.parser).
+    """
+    # Strip HTML head section that might contain duplicate title
+    body_match = re.search(r'<body[^>]*>(.*?)</body>', file_content, re.DOTALL)
+    if body_match:
+        file_content = body_match.group(1)
+
+    markdown = md(
+        file_content,
+        custom_tags=_custom_md_tag,
+        **MARKDOWN_OPTIONS
+    )
+
+    # Clean up excessive blank lines
+    markdown = re.sub(r'\n{3,}', '\n\n', markdown)
+    return markdown.strip()
+
+
+class DirectoryFiles(Mapping):
+    """
+    Read-only mapping of relative POSIX path -> bytes over a src/epub directory.
+    Files are read lazily, only when the parser asks for them.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, key):
+        return self.root / Path(*key.split("/"))
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        if not path.is_file():
+            raise KeyError(key)
+        return path.read_bytes()
+
+    def __contains__(self, key):
+        return self._path(key).is_file()
+
+    def __iter__(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                yield Path(dirpath, name).relative_to(self.root).as_posix()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _open_source(epub_path):
+    """
+    (files mapping, book name) of a src/epub directory or a mapping of files.
+    """
+    if isinstance(epub_path, Mapping):
+        return epub_path, ""
+    return DirectoryFiles(epub_path), Path(epub_path).parent.parent.name
+
+
+def _close_source(files):
+    """
+    Release what a mapping holds open while it is read (a zip handle, a git cat-file process).
+    Such mappings reopen it if they are read again.
+    """
+    close = getattr(files, "close", None)
+    if close is not None:
+        close()
+
+
+def parse_opf_and_extract_text(epub_path, max_files=None, md_cache=None, measure=False, with_chapters=False):
     """
     Parse src/epub/content.opf to get reading order.
     Extract title, author, language, and book text (using referenced xhtml files in order).
-    Output book text as Markdown using markdownify.
+    Output book text as Markdown (see xhtml_to_markdown).
     Only the first `max_files` valid content files are included.
+    `epub_path` is either the src/epub directory or a mapping of files (see parse_epub_files).
+    If `md_cache` (a MarkdownCache) is given, unchanged chapters are served from it.
+    With `measure`, the result has a "timings" dict for src/metrics.py.
+    With `with_chapters`, the result has the "chapters" the text was joined from (see iter_chapters).
     """
-    book_dir = Path(epub_path).parent.parent.name
-    opf_file = Path(epub_path) / "content.opf"
-    if not opf_file.exists():
-        print(f"DEBUG: OPF file not found at {opf_file}")
-        return None
+    files, book_name = _open_source(epub_path)
+    try:
+        return parse_epub_files(
+            files, max_files=max_files, book_name=book_name, md_cache=md_cache,
+            measure=measure, with_chapters=with_chapters
+        )
+    finally:
+        _close_source(files)
+
+
+def iter_chapters(epub_path, max_files=None, md_cache=None):
+    """
+    Lazily yield the chapters of a book in reading order, converting one spine file at a time.
+    Each chapter is a dict with "spine_index" (position in the OPF spine), "file_name"
+    (path relative to src/epub), "heading" (its first Markdown heading, or "") and "text".
+    Filtered and empty spine files are skipped, as in parse_opf_and_extract_text.
+    """
+    files, book_name = _open_source(epub_path)
+    try:
+        if "content.opf" not in files:
+            print(f"DEBUG: OPF file not found in {book_name or 'files'}")
+            return
+        _, keep_files = _read_package(files, max_files)
+        yield from _iter_chapters(files, keep_files, book_name=book_name, md_cache=md_cache)
+    finally:
+        _close_source(files)
+
 
-    tree = etree_parse(str(opf_file))
+def _read_package(files, max_files=None):
+    """
+    Read content.opf. Returns (title, author, language) and the [(spine index, path)]
+    of the spine files to convert.
+    """
+    tree = etree_fromstring(files["content.opf"])
     ns = {"opf": "http://www.idpf.org/2007/opf", "dc": "http://purl.org/dc/elements/1.1/"}
     title = tree.findtext(".//dc:title", namespaces=ns)
     author = tree.findtext(".//dc:creator", namespaces=ns)
@@ -25,78 +177,112 @@ def parse_opf_and_extract_text(epub_path, max_files=None):
     spine = [item.get("idref") for item in tree.findall(".//opf:itemref", namespaces=ns)]
 
     # Map idrefs to file paths
-    files = []
-    for idref in spine:
+    spine_files = []
+    for spine_index, idref in enumerate(spine):
         href = manifest.get(idref)
         if href:
-            file_path = Path(epub_path) / href
-            files.append(file_path)
+            spine_files.append((spine_index, posixpath.normpath(href)))
 
     # Only filter out the most obvious metadata files
     drop_keywords = ["imprint", "colophon", "uncopyright", "titlepage", "dedication", "acknowledgments", "foreword", "preface", "epigraph", "afterword", "appendix", "glossary", "index", "bibliography", "toc", "cover", "license"]
     keep_files = []
-    for f in files:
-        name = f.name.lower()
+    for spine_index, f in spine_files:
+        name = posixpath.basename(f).lower()
         if any(k in name for k in drop_keywords):
             continue
-        keep_files.append(f)
+        keep_files.append((spine_index, f))
 
     # Only process the first `max_files` valid files (or all if max_files is None)
     if max_files is not None:
         keep_files = keep_files[:max_files]
     if len(keep_files) == 0:
         print("WARNING: No files to process after filtering")
+    return (title, author, language), keep_files
 
-    text_parts = []
-    for f in keep_files:
-        if not f.exists():
-            continue
-        with open(f, "r", encoding="utf-8", errors='replace') as xf:
-            file_content = xf.read()
+
+def _iter_chapters(files, keep_files, book_name="", md_cache=None, timings=None):
+    """
+    Convert the `keep_files` of `_read_package` one at a time and yield their chapter dicts.
+    Seconds spent converting (including chapter cache lookups) are added to
+    timings["markdown_conversion"] if `timings` is given.
+    """
+    try:
+        for spine_index, f in keep_files:
+            if f not in files:
+                continue
+            # Decode like text-mode open(): replace bad bytes, normalise newlines
+            data = files[f]
+            file_content = data.decode("utf-8", errors="replace")
+            file_content = file_content.replace("\r\n", "\n").replace("\r", "\n")
             file_content = re.sub(r'<\?xml[^>]*\?>', '', file_content)
 
             # Only skip obvious copyright pages
             if "copyright" in file_content.lower() and "all rights reserved" in file_content.lower():
                 preview = file_content[:120].replace('\n', '\\n')
-                print(f"SKIP [{book_dir}]: {f.name} (copyright page) - {preview}...")
+                print(f"SKIP [{book_name}]: {posixpath.basename(f)} (copyright page) - {preview}...")
                 continue
 
-            # Strip HTML head section that might contain duplicate title
-            body_match = re.search(r'<body[^>]*>(.*?)</body>', file_content, re.DOTALL)
-            if body_match:
-                file_content = body_match.group(1)
-
-            # Markdownify conversion
-            def custom_md_tag(tag, name, value):
-                if name == "p":
-                    return "\n\n" + value + "\n\n"
-                if name == "hr":
-                    return "\n\n---\n\n"
-                return None
-
-            markdown = md(
-                file_content,
-                convert=['p', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'em', 'i', 'b', 'strong', 'abbr', 'blockquote', 'code', 'pre'],
-                heading_style="ATX",
-                bullets="-",
-                custom_tags=custom_md_tag
-            )
-
-            # Clean up excessive blank lines
-            markdown = re.sub(r'\n{3,}', '\n\n', markdown)
-            markdown = markdown.strip()
+            convert_start = time.perf_counter()
+            if md_cache is not None:
+                key = md_cache.key(data, CONVERTER_SETTINGS)
+                markdown = md_cache.get(key)
+                if markdown is None:
+                    markdown = xhtml_to_markdown(file_content)
+                    md_cache.put(key, markdown)
+            else:
+                markdown = xhtml_to_markdown(file_content)
+            if timings is not None:
+                timings["markdown_conversion"] += time.perf_counter() - convert_start
 
             if markdown:
-                text_parts.append(markdown)
+                heading = re_heading_line.search(markdown)
+                yield {
+                    "spine_index": spine_index,
+                    "file_name": f,
+                    "heading": heading.group(1).strip() if heading else "",
+                    "text": markdown,
+                }
+    finally:
+        if md_cache is not None:
+            md_cache.flush()
+
+
+def parse_epub_files(files, max_files=None, book_name="", md_cache=None, measure=False, with_chapters=False):
+    """
+    Same as parse_opf_and_extract_text, but reads the book from `files`:
+    a mapping of POSIX paths relative to src/epub (e.g. "text/chapter-1.xhtml") to bytes.
+    This lets fetch backends hand over in-memory files without a checkout on disk.
+    With `measure`, the result has "timings": seconds spent in "markdown_conversion"
+    (including chapter cache lookups), in "opf_parse" (everything else) and the
+    process's "rss_bytes" at the end.
+    """
+    start = time.perf_counter()
+    timings = {"markdown_conversion": 0.0}
+    if "content.opf" not in files:
+        print(f"DEBUG: OPF file not found in {book_name or 'files'}")
+        return None
+
+    (title, author, language), keep_files = _read_package(files, max_files)
+    chapters = list(_iter_chapters(files, keep_files, book_name=book_name, md_cache=md_cache, timings=timings))
 
-    # Join all parts with double line breaks
-    full_text = '\n\n'.join(text_parts)
+    # Join all chapters with double line breaks
+    full_text = '\n\n'.join(chapter["text"] for chapter in chapters)
     full_text = re.sub(r'\n{3,}', '\n\n', full_text)
     full_text = full_text.strip()
 
-    return {
+    book = {
         "title": title,
         "author": author,
         "language": language,
-        "text": full_text
+        "text": full_text,
+        "text_hash": text_hash(full_text)
     }
+    if with_chapters:
+        book["chapters"] = chapters
+    if measure:
+        book["timings"] = {
+            "opf_parse": time.perf_counter() - start - timings["markdown_conversion"],
+            "markdown_conversion": timings["markdown_conversion"],
+            "rss_bytes": current_rss(),
+        }
+    return book
@@ -0,0 +1,158 @@
+"""
+pipeline.py
+
+Runs the download -> parse -> write stages concurrently.
+
+Repos are fetched by a pool of clone threads, parsed by a pool of parse
+threads (each driving one process of a ProcessPoolExecutor when more than one
+parse worker is requested), and written by the calling thread. Stages are
+connected by bounded queues, and a semaphore caps how many checkouts can
+exist in the temp directory at once, so a fast network cannot fill the disk
+while parsing falls behind.
+"""
+
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+_DONE = object()
+_SKIPPED = object()
+
+
+def run_pipeline(repos, fetch, parse, write, cleanup,
+                 clone_workers=4, parse_workers=1, max_checkouts=8, desc="Processing books",
+                 on_state=None):
+    """
+    Process `repos` through the staged pipeline.
+
+    - `fetch(repo)` returns (tmp_dir, source); a `source` of None skips the repo.
+    - `parse(source)` returns the parsed book; it must be picklable when
+      `parse_workers` > 1 because it then runs in a worker process.
+    - `write(repo, book)` runs on the calling thread only, in completion order.
+      It may return False to mark the book as failed (e.g. no text extracted).
+    - `cleanup(tmp_dir)` removes a checkout once its book has been written.
+    - `on_state(repo, state, error=None)`, if given, is called on every stage
+      transition: "downloaded" (from a clone thread), then "parsed" and
+      "written" or "failed" (from the calling thread).
+
+    An exception in any stage is reported and only affects that repo.
+    """
+    if on_state is None:
+        on_state = lambda repo, state, error=None: None
+    repos = list(repos)
+    repo_queue = queue.Queue()
+    for repo in repos:
+        repo_queue.put(repo)
+    fetched_queue = queue.Queue(maxsize=max_checkouts)
+    result_queue = queue.Queue(maxsize=max_checkouts)
+    checkout_slots = threading.BoundedSemaphore(max_checkouts)
+    stop = threading.Event()
+
+    pool = None
+    if parse_workers > 1:
+        # spawn rather than fork: this process is already running threads
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=context)
+
+    def clone_stage():
+        while not stop.is_set():
+            try:
+                repo = repo_queue.get_nowait()
+            except queue.Empty:
+                return
+            checkout_slots.acquire()
+            try:
+                tmp_dir, source = fetch(repo)
+            except Exception as e:
+                result_queue.put((repo, None, None, e))
+                continue
+            if source is None:
+                result_queue.put((repo, tmp_dir, _SKIPPED, None))
+                continue
+            on_state(repo, "downloaded")
+            fetched_queue.put((repo, tmp_dir, source))
+
+    def parse_stage():
+        while True:
+            item = fetched_queue.get()
+            if item is _DONE:
+                return
+            repo, tmp_dir, source = item
+            if stop.is_set():
+                result_queue.put((repo, tmp_dir, _SKIPPED, None))
+                continue
+            try:
+                if pool is not None:
+                    book = pool.submit(parse, source).result()
+                else:
+                    book = parse(source)
+                result_queue.put((repo, tmp_dir, book, None))
+            except Exception as e:
+                result_queue.put((repo, tmp_dir, None, e))
+
+    cloners = [threading.Thread(target=clone_stage, daemon=True) for _ in range(max(1, clone_workers))]
+    parsers = [threading.Thread(target=parse_stage, daemon=True) for _ in range(max(1, parse_workers))]
+    for t in cloners + parsers:
+        t.start()
+
+    def close_parsers():
+        for t in cloners:
+            t.join()
+        for _ in parsers:
+            fetched_queue.put(_DONE)
+
+    closer = threading.Thread(target=close_parsers, daemon=True)
+    closer.start()
+
+    progress = tqdm(total=len(repos), desc=desc)
+    try:
+        for _ in range(len(repos)):
+            repo, tmp_dir, book, error = result_queue.get()
+            try:
+                if error is not None:
+                    print(f"Exception for {repo['name']}: {error}")
+                    on_state(repo, "failed", error)
+                elif book is _SKIPPED:
+                    on_state(repo, "failed", "skipped: nothing to parse")
+                else:
+                    on_state(repo, "parsed")
+                    if write(repo, book) is False:
+                        on_state(repo, "failed", "skipped by writer")
+                    else:
+                        on_state(repo, "written")
+            except Exception as e:
+                print(f"Exception for {repo['name']}: {e}")
+                on_state(repo, "failed", e)
+            finally:
+                if tmp_dir:
+                    cleanup(tmp_dir)
+                checkout_slots.release()
+                progress.update(1)
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        progress.close()
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        _join_parsers(parsers, fetched_queue, result_queue)
+
+
+def _join_parsers(parsers, fetched_queue, result_queue):
+    """
+    Wait for the parse threads to finish the book in hand and exit, so that nothing
+    they share with the caller (e.g. the Markdown cache connection) is still in use
+    when run_pipeline returns or raises. Results nobody will write are discarded,
+    so a parser never blocks on a full queue.
+    """
+    while any(t.is_alive() for t in parsers):
+        try:
+            fetched_queue.put_nowait(_DONE)
+        except queue.Full:
+            pass
+        try:
+            result_queue.get(timeout=0.05)
+        except queue.Empty:
+            pass
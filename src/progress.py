@@ -1,7 +1,35 @@
+"""
+progress.py
+
+Tracks which books have been processed.
+
+`ProgressJournal` appends one JSON line per state transition of a book
+(queued -> downloaded -> parsed -> written, or failed) to progress.jsonl, so
+recording progress is O(1) however large the catalog is. Every
+`compact_every` appends (and on close) the journal is rewritten atomically to
+one line per book, and books_list.json is rewritten atomically as a snapshot
+of the books that are in the dataset.
+"""
+
 import os
 import json
+import time
+import threading
 
 BOOKS_LIST_FILE = "books_list.json"
+JOURNAL_FILE = "progress.jsonl"
+
+STATES = ("queued", "downloaded", "parsed", "written", "failed")
+
+
+def _write_atomic(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 
 def load_books_list(path=BOOKS_LIST_FILE):
     """
@@ -29,8 +57,137 @@ def save_books_list(books_dict, path=BOOKS_LIST_FILE):
     """
     Save the books_list.json file.
     Accepts a dict mapping repo name to repo info.
-    Writes as a list of repo info dicts.
+    Writes as a list of repo info dicts, atomically.
     """
     books_list = list(books_dict.values())
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(books_list, f, indent=2, ensure_ascii=False)
+    _write_atomic(path, lambda f: json.dump(books_list, f, indent=2, ensure_ascii=False))
+
+
+def write_journal(path, entries, written):
+    """
+    Atomically write a compacted journal: one line per book with its latest
+    entry, plus its last written repo info if the latest state is not "written".
+    """
+    def write(f):
+        for name, entry in entries.items():
+            line = dict(entry)
+            if entry["state"] != "written" and name in written:
+                line["written"] = written[name]
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    _write_atomic(path, write)
+
+
+class ProgressJournal:
+    """
+    Append-only JSONL journal of per-book states.
+
+    Each line is {"name", "state", "ts", "repo"} plus "error" for failures.
+    `written` keeps the repo info of every book's last successful write, which
+    is what books_list.json used to hold; `entries` keeps the latest state.
+    Safe to record from several threads. A `read_only` journal is only
+    replayed (e.g. to merge shard outputs) and never touches its files.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, books_list_path=BOOKS_LIST_FILE, compact_every=1000, read_only=False):
+        self.path = path
+        self.books_list_path = books_list_path
+        self.compact_every = compact_every
+        self.entries = {}
+        self.written = {}
+        self._appended = 0
+        self._lock = threading.Lock()
+        self._file = None
+        rewrite = self._load()
+        if read_only:
+            return
+        self._file = open(self.path, "a", encoding="utf-8")
+        if rewrite:
+            self._compact()
+
+    def _load(self):
+        """
+        Replay the journal. Returns True if it must be rewritten before appending to it:
+        there was none and the books list was imported, or its last line was torn.
+        """
+        if not os.path.exists(self.path):
+            # First run with a journal: start from the books list of earlier runs
+            self.written = load_books_list(self.books_list_path)
+            self.entries = {
+                name: {"name": name, "state": "written", "ts": 0, "repo": repo}
+                for name, repo in self.written.items()
+            }
+            return True
+        torn = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                # A line torn by a crash mid-append; the next append would be glued to it
+                torn = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    torn = True
+                    continue
+                self._apply(record)
+        return torn
+
+    def _apply(self, record):
+        self.entries[record["name"]] = record
+        if record["state"] == "written":
+            self.written[record["name"]] = record["repo"]
+        elif "written" in record:
+            # Compacted line of a book whose latest state is not "written"
+            self.written[record["name"]] = record.pop("written")
+
+    def state(self, name):
+        entry = self.entries.get(name)
+        return entry["state"] if entry else None
+
+    def entry(self, name):
+        return self.entries.get(name)
+
+    def record(self, repo, state, error=None):
+        """
+        Append a state transition for `repo`.
+        """
+        if state not in STATES:
+            raise ValueError(f"Unknown state {state!r}")
+        if self._file is None:
+            raise ValueError("Cannot record to a read-only journal")
+        record = {"name": repo["name"], "state": state, "ts": time.time(), "repo": repo}
+        if error is not None:
+            record["error"] = str(error)
+        with self._lock:
+            self._apply(dict(record))
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._appended += 1
+            if self._appended >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrite the journal as one line per book and snapshot books_list.json.
+        """
+        self._file.close()
+        write_journal(self.path, self.entries, self.written)
+        save_books_list(self.written, self.books_list_path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._appended = 0
+
+    def close(self):
+        with self._lock:
+            if self._file is None or self._file.closed:
+                return
+            self._compact()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
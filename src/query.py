@@ -0,0 +1,184 @@
+"""
+query.py
+
+Selects books by their metadata and streams them out as JSONL or Arrow.
+
+Filters on `language`, `author`, `title` and `link` are evaluated with
+pyarrow compute against those columns only (see the `predicate` of
+`DatasetReader.iter_batches`): record batches without a match are skipped
+and the `text` of rejected rows is never copied, so a query touches the text
+of the matching books only. Matches are written as they are found, in
+slices of at most `batch_size` rows, so memory stays bounded however many
+books match.
+
+Output formats:
+- jsonl: one JSON object per line; a path ending in .zst is zstd-compressed,
+  and "-" writes to stdout.
+- arrow: an Arrow IPC file with the dataset's schema (or the selected columns).
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from src.dataset import DatasetReader, SCHEMA
+
+FORMATS = ("jsonl", "arrow")
+DEFAULT_BATCH_SIZE = 256
+
+
+def make_predicate(languages=None, authors=None, title=None, links=None):
+    """
+    Build a predicate for DatasetReader.iter_batches, or None if there are no filters.
+    - `languages`: language codes; "en" matches "en" and regional variants such as "en-US"
+    - `authors`: exact author names
+    - `title`: case-insensitive substring of the title
+    - `links`: exact links
+    All given filters must match.
+    """
+    languages = [language.lower() for language in languages or []]
+    authors = list(authors or [])
+    links = list(links or [])
+    if not (languages or authors or title or links):
+        return None
+
+    def predicate(batch):
+        masks = []
+        if languages:
+            language = pc.utf8_lower(batch.column("language"))
+            matches = pc.is_in(language, value_set=pa.array(languages, type=pa.string()))
+            for code in languages:
+                matches = pc.or_(matches, pc.starts_with(language, code + "-"))
+            masks.append(matches)
+        if authors:
+            masks.append(pc.is_in(batch.column("author"), value_set=pa.array(authors, type=pa.string())))
+        if title:
+            masks.append(pc.match_substring(batch.column("title"), title, ignore_case=True))
+        if links:
+            masks.append(pc.is_in(batch.column("link"), value_set=pa.array(links, type=pa.string())))
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = pc.and_(mask, other)
+        return mask
+
+    return predicate
+
+
+def iter_matches(dataset_path, predicate=None, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield the matching books as record batches of at most `batch_size` rows,
+    restricted to `columns` if given.
+    """
+    with DatasetReader(dataset_path) as reader:
+        for batch in reader.iter_batches(columns=columns, predicate=predicate):
+            for start in range(0, batch.num_rows, batch_size):
+                yield batch.slice(start, batch_size)
+
+
+def _open_text_sink(out_path):
+    """
+    Binary stream for JSONL output: stdout for "-", zstd-compressed for *.zst.
+    """
+    if out_path == "-":
+        return sys.stdout.buffer
+    if out_path.endswith(".zst"):
+        return pa.CompressedOutputStream(out_path + ".tmp", "zstd")
+    return open(out_path + ".tmp", "wb")
+
+
+def write_jsonl(batches, out_path):
+    """
+    Write `batches` as JSON lines to `out_path`. Returns the number of rows.
+    """
+    total = 0
+    sink = _open_text_sink(out_path)
+    try:
+        for batch in batches:
+            lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch.to_pylist())
+            sink.write(lines.encode("utf-8"))
+            total += batch.num_rows
+    finally:
+        if out_path == "-":
+            sink.flush()
+        else:
+            sink.close()
+    if out_path != "-":
+        os.replace(out_path + ".tmp", out_path)
+    return total
+
+
+def write_arrow(batches, out_path, schema):
+    """
+    Write `batches` to an Arrow IPC file at `out_path`. Returns the number of rows.
+    """
+    total = 0
+    tmp_path = out_path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            total += batch.num_rows
+    os.replace(tmp_path, out_path)
+    return total
+
+
+def run_query(dataset_path, out_path, fmt="jsonl", predicate=None, columns=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write the books matching `predicate` (see make_predicate) to `out_path` in `fmt`.
+    Returns the number of books written.
+    """
+    batches = iter_matches(dataset_path, predicate=predicate, columns=columns, batch_size=batch_size)
+    if fmt == "arrow":
+        schema = SCHEMA if columns is None else pa.schema([SCHEMA.field(c) for c in columns])
+        return write_arrow(batches, out_path, schema)
+    return write_jsonl(batches, out_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the books matching metadata filters.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to read.")
+    parser.add_argument(
+        "--out", default="-",
+        help="File to write; *.zst compresses JSONL with zstd (default: - for stdout, JSONL only)."
+    )
+    parser.add_argument("--format", choices=FORMATS, default=None, help="Output format (default: from --out).")
+    parser.add_argument(
+        "--language", action="append", default=[],
+        help="Keep books in this language; en also matches en-US, en-GB (repeatable)."
+    )
+    parser.add_argument("--author", action="append", default=[], help="Keep books by this author (repeatable).")
+    parser.add_argument("--title", default=None, help="Keep books whose title contains this (case-insensitive).")
+    parser.add_argument("--link", action="append", default=[], help="Keep the book at this link (repeatable).")
+    parser.add_argument(
+        "--columns", default=None,
+        help=f"Comma-separated columns to output (default: all of {', '.join(SCHEMA.names)})."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help=f"Maximum books held in memory at once (default: {DEFAULT_BATCH_SIZE})."
+    )
+    args = parser.parse_args(argv)
+    if args.format is None:
+        args.format = "arrow" if args.out.endswith(".arrow") else "jsonl"
+    if args.format == "arrow" and args.out == "-":
+        parser.error("--format arrow needs an --out file")
+    if args.columns is not None:
+        args.columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+        unknown = [c for c in args.columns if c not in SCHEMA.names]
+        if unknown:
+            parser.error(f"unknown columns: {', '.join(unknown)}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    predicate = make_predicate(args.language, args.author, args.title, args.link)
+    total = run_query(
+        args.dataset, args.out, fmt=args.format, predicate=predicate,
+        columns=args.columns, batch_size=args.batch_size
+    )
+    print(f"Exported {total} books.", file=sys.stderr)
@@ -0,0 +1,209 @@
+"""
+sharding.py
+
+Splits a build across machines and merges the results.
+
+`main.py --shard i/N` keeps the repos whose name hashes to shard i of N
+(blake2b, see src.export.shard_of, so every node agrees without
+coordination) and writes its outputs under shard-suffixed names, e.g.
+books_dataset.shard-0-of-4.arrow and progress.shard-0-of-4.jsonl.
+
+`main.py merge` collects those outputs and writes one dataset, chapters
+table, journal and books_list.json. When the same book appears in several
+shards (e.g. after N changed) the written copy whose repo info has the
+newest `updated_at` wins, then the one with the greater commit/tree SHA,
+then the later shard; its dataset row, chapters and books list entry are
+all taken from the same shard. Datasets are streamed one
+record batch at a time into a new base file, so the merge holds the links
+and repo info of the catalog in memory but never the texts.
+"""
+
+import os
+import re
+import glob
+import argparse
+
+import pyarrow as pa
+
+from src.export import shard_of
+from src.dataset import DatasetReader, write_dataset, SCHEMA
+from src.chapters import CHAPTERS_SCHEMA
+from src.progress import ProgressJournal, write_journal, save_books_list
+
+re_shard_suffix = re.compile(r"\.shard-(\d+)-of-(\d+)$")
+
+
+def parse_shard(value):
+    """
+    Parse "i/N" (0 <= i < N) into (i, N).
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got {value!r}")
+    return index, count
+
+
+def in_shard(repo, shard):
+    """
+    Whether `repo` belongs to `shard` ((i, N), or None for an unsharded build).
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(repo["name"], count) == index
+
+
+def shard_path(path, shard):
+    """
+    Output path of `path` for `shard`: books_dataset.arrow -> books_dataset.shard-0-of-4.arrow.
+    """
+    if shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def find_shards(directories, paths):
+    """
+    Find the shard outputs in `directories`. `paths` maps an output kind
+    ("dataset", "chapters", "journal", "books_list") to its unsharded file name.
+    Returns {(i, N): {kind: path}}; each shard is identified by its journal,
+    which every shard build writes, even one with no books.
+    """
+    root, ext = os.path.splitext(os.path.basename(paths["journal"]))
+    shards = {}
+    for directory in directories:
+        for journal in sorted(glob.glob(os.path.join(directory, f"{root}.shard-*-of-*{ext}"))):
+            match = re_shard_suffix.search(os.path.splitext(journal)[0])
+            if not match:
+                continue
+            shard = (int(match.group(1)), int(match.group(2)))
+            shards[shard] = {
+                kind: os.path.join(directory, os.path.basename(shard_path(path, shard)))
+                for kind, path in paths.items()
+            }
+    return shards
+
+
+def _book_key(repo, shard):
+    """
+    Sort key of one shard's written copy of a book: newest `updated_at`, then the
+    content SHAs (so the pick does not depend on shard numbering), then the shard.
+    """
+    return (
+        repo.get("updated_at") or "",
+        repo.get("commit") or "",
+        repo.get("epub_tree") or "",
+        shard,
+    )
+
+
+def _winners(shards):
+    """
+    Pick the shard that supplies each book. Returns ({link: shard}, {name: shard}, journals).
+    Each written book gets one key from its written repo info (see `_book_key`); the
+    dataset row, chapters and books list entry all come from the winning shard.
+    Rows without a written journal entry and books that were never written anywhere
+    (queued or failed) come from the last shard that has them.
+    """
+    journals = {}
+    best = {}
+    for shard, files in sorted(shards.items()):
+        journal = ProgressJournal(files["journal"], files["books_list"], read_only=True)
+        journals[shard] = journal
+        for name, repo in journal.written.items():
+            key = _book_key(repo, shard)
+            if name not in best or key > best[name][0]:
+                best[name] = (key, repo["link"])
+
+    by_name = {name: key[-1] for name, (key, _) in best.items()}
+    by_link = {link: key[-1] for key, link in best.values()}
+    written_links = set(by_link)
+    for shard, files in sorted(shards.items()):
+        with DatasetReader(files["dataset"]) as reader:
+            links = reader.links()
+        for link in links:
+            if link not in written_links:
+                by_link[link] = shard
+        for name in journals[shard].entries:
+            if name not in best:
+                by_name[name] = shard
+    return by_link, by_name, journals
+
+
+def _merged_batches(shards, kind, schema, winners):
+    """
+    Stream the rows of each shard's `kind` store that it won, one record batch at a time.
+    """
+    for shard, files in sorted(shards.items()):
+        with DatasetReader(files[kind], schema) as reader:
+            if not reader.exists():
+                continue
+            for batch in reader.iter_batches():
+                mask = pa.array([winners.get(link) == shard for link in batch.column("link").to_pylist()])
+                yield batch.filter(mask)
+
+
+def merge_shards(shards, dataset_path, chapters_path, journal_path, books_list_path):
+    """
+    Merge shard outputs ({(i, N): {kind: path}}, see `find_shards`) into one dataset,
+    chapters table, journal and books list. Returns the number of books in the merged dataset.
+    """
+    outputs = {dataset_path, chapters_path, journal_path, books_list_path}
+    if any(path in outputs for files in shards.values() for path in files.values()):
+        raise ValueError("The merge output must not overwrite a shard output")
+
+    by_link, by_name, journals = _winners(shards)
+    write_dataset(dataset_path, _merged_batches(shards, "dataset", SCHEMA, by_link), SCHEMA)
+    if any(DatasetReader(files["chapters"], CHAPTERS_SCHEMA).exists() for files in shards.values()):
+        write_dataset(chapters_path, _merged_batches(shards, "chapters", CHAPTERS_SCHEMA, by_link), CHAPTERS_SCHEMA)
+
+    entries = {name: journals[shard].entries[name] for name, shard in sorted(by_name.items())}
+    written = {
+        name: journals[shard].written[name]
+        for name, shard in sorted(by_name.items()) if name in journals[shard].written
+    }
+    write_journal(journal_path, entries, written)
+    save_books_list(written, books_list_path)
+    return len(by_link)
+
+
+def parse_merge_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="main.py merge", description="Merge the outputs of `main.py --shard i/N` builds."
+    )
+    parser.add_argument(
+        "directories", nargs="*", default=["."],
+        help="Directories holding the shard outputs (default: the current directory)."
+    )
+    parser.add_argument(
+        "--allow-missing", action="store_true",
+        help="Merge even if some shards of the N are missing."
+    )
+    return parser.parse_args(argv)
+
+
+def merge_main(argv, paths):
+    """
+    `main.py merge`: merge every shard found in the given directories into the unsharded `paths`.
+    """
+    args = parse_merge_args(argv)
+    shards = find_shards(args.directories, paths)
+    if not shards:
+        print(f"No shard outputs found in {', '.join(args.directories)}.")
+        return None
+    counts = {count for _, count in shards}
+    missing = sorted({(i, n) for n in counts for i in range(n)} - set(shards))
+    if missing:
+        print(f"Missing shards: {', '.join(f'{i}/{n}' for i, n in missing)}.")
+        if not args.allow_missing:
+            print("Not merging an incomplete build (use --allow-missing to merge anyway).")
+            return None
+    total = merge_shards(
+        shards, paths["dataset"], paths["chapters"], paths["journal"], paths["books_list"]
+    )
+    print(f"Merged {len(shards)} shards into {paths['dataset']} ({total} books).")
+    return total
@@ -0,0 +1,110 @@
+"""
+stats.py
+
+Per-book text statistics for filtering, as a metadata table next to the dataset.
+
+The books dataset is read one record batch at a time and every statistic is
+computed over the whole `text` column with pyarrow compute string kernels,
+so no text is ever turned into a Python string:
+
+- text_length: characters (utf8_length)
+- byte_length: UTF-8 bytes
+- word_count: runs of non-whitespace characters
+- paragraph_count: blocks separated by blank lines (headings count as paragraphs,
+  as in the Markdown output)
+- heading_count: Markdown heading lines
+- non_ascii_ratio: share of the characters outside ASCII (0 for an empty text)
+
+The output (`books_stats.arrow`) is kept in the dataset's store format
+(src/dataset.py) keyed by `link`, with the `text_hash` the statistics were
+computed from, so it can be joined to the dataset or exports on `link` and
+checked for staleness without reading any text.
+"""
+
+import argparse
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.dataset import DatasetReader, write_dataset
+
+STATS_SCHEMA = pa.schema([
+    ("link", pa.string()),
+    ("text_hash", pa.string()),
+    ("text_length", pa.int32()),
+    ("byte_length", pa.int32()),
+    ("word_count", pa.int32()),
+    ("paragraph_count", pa.int32()),
+    ("heading_count", pa.int32()),
+    ("non_ascii_ratio", pa.float64()),
+])
+
+
+def compute_stats(batch):
+    """
+    Statistics of a batch of dataset rows (needs link, text_hash and text) as a STATS_SCHEMA batch.
+    """
+    text = pc.fill_null(batch.column("text"), "")
+    length = pc.utf8_length(text)
+    non_empty = pc.greater(length, 0)
+    # Texts are stripped and separate paragraphs with one blank line
+    blank_lines = pc.count_substring_regex(text, r"\n\n+")
+    paragraphs = pc.if_else(non_empty, pc.add(blank_lines, 1), 0)
+    non_ascii = pc.count_substring_regex(text, r"[^\x00-\x7f]")
+    ratio = pc.if_else(
+        non_empty,
+        pc.divide(pc.cast(non_ascii, pa.float64()), pc.cast(length, pa.float64())),
+        0.0
+    )
+    return pa.record_batch([
+        batch.column("link"),
+        batch.column("text_hash"),
+        length,
+        pc.binary_length(text),
+        pc.count_substring_regex(text, r"\S+"),
+        paragraphs,
+        pc.count_substring_regex(text, r"(?m)^#{1,6} "),
+        ratio,
+    ], schema=STATS_SCHEMA)
+
+
+def build_stats(dataset_path, stats_path):
+    """
+    Compute the statistics of every book in the dataset and write them to `stats_path`.
+    Returns the number of books.
+    """
+    total = 0
+
+    def batches():
+        nonlocal total
+        with DatasetReader(dataset_path) as reader:
+            for batch in reader.iter_batches(columns=["link", "text_hash", "text"]):
+                if batch.num_rows:
+                    total += batch.num_rows
+                    yield compute_stats(batch)
+
+    write_dataset(stats_path, batches(), STATS_SCHEMA)
+    print(f"Wrote statistics of {total} books to {stats_path}.")
+    return total
+
+
+def read_stats(stats_path):
+    """
+    Return the statistics table, or None if it has not been built.
+    """
+    with DatasetReader(stats_path, STATS_SCHEMA) as reader:
+        if not reader.exists():
+            return None
+        return reader.read()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compute per-book text statistics of the books dataset.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to read.")
+    parser.add_argument("--out", default="books_stats.arrow", help="Arrow file to write (default: books_stats.arrow).")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_stats(args.dataset, args.out)
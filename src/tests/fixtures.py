@@ -0,0 +1,65 @@
+"""
+Shared mock Standard Ebooks sources for the tests.
+"""
+
+import os
+import zipfile
+
+OPF_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">
+    <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+        <dc:title>{title}</dc:title>
+        <dc:creator>Test Author</dc:creator>
+        <dc:language>en-US</dc:language>
+    </metadata>
+    <manifest>
+        <item id="chapter-1.xhtml" href="text/chapter-1.xhtml" media-type="application/xhtml+xml"/>
+    </manifest>
+    <spine>
+        <itemref idref="chapter-1.xhtml"/>
+    </spine>
+</package>'''
+
+CHAPTER_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>Chapter 1</title></head>
+<body>
+    <section id="chapter-1">
+        <h2>Chapter 1</h2>
+        <p>This is the text of {title}.</p>
+    </section>
+</body>
+</html>'''
+
+def mock_epub_files(title):
+    """Return the src/epub tree of a minimal mock book as {relative path: bytes}"""
+    return {
+        "content.opf": OPF_TEMPLATE.format(title=title).encode("utf-8"),
+        "text/chapter-1.xhtml": CHAPTER_TEMPLATE.format(title=title).encode("utf-8"),
+    }
+
+def create_mock_epub(root, title):
+    """Write a minimal src/epub tree and return the repo directory"""
+    epub_dir = os.path.join(root, title, "src", "epub")
+    for rel_path, data in mock_epub_files(title).items():
+        path = os.path.join(epub_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return os.path.join(root, title)
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="utf-8"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0">
+    <rootfiles>
+        <rootfile full-path="epub/content.opf" media-type="application/oebps-package+xml"/>
+    </rootfiles>
+</container>'''
+
+def create_mock_epub_zip(path, title):
+    """Write a minimal compiled .epub (OPF under epub/, as Standard Ebooks builds them) and return its path"""
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        archive.writestr("META-INF/container.xml", CONTAINER_XML)
+        for rel_path, data in mock_epub_files(title).items():
+            archive.writestr(f"epub/{rel_path}", data, compress_type=zipfile.ZIP_DEFLATED)
+    return path
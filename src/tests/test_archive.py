@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test the archive fetch backend against a local HTTP server serving fixture archives.
+"""
+
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from src.archive import archive_url, fetch_epub_archive
+from src.opf_parser import parse_opf_and_extract_text
+from src.tests.fixtures import mock_epub_files
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def write_fixture_archives(root, name, branch="master"):
+    """Write GitHub-style tar.gz and zip archives of a mock repo"""
+    prefix = f"{name}-{branch}/"
+    entries = {f"src/epub/{k}": v for k, v in mock_epub_files(name).items()}
+    entries["images/cover.source.jpg"] = b"\xff\xd8 not part of src/epub"
+    entries["README.md"] = b"# Mock repo"
+
+    os.makedirs(os.path.join(root, name, "archive", "refs", "heads"))
+    base = os.path.join(root, name, "archive", "refs", "heads", branch)
+    with tarfile.open(base + ".tar.gz", "w:gz") as tar:
+        for path, data in entries.items():
+            info = tarfile.TarInfo(prefix + path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    with zipfile.ZipFile(base + ".zip", "w") as archive:
+        for path, data in entries.items():
+            archive.writestr(prefix + path, data)
+
+def serve(root):
+    """Start a local HTTP server for `root` and return it"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_fetch_epub_archive():
+    """Test that only src/epub entries are kept and parse straight from memory"""
+    with tempfile.TemporaryDirectory() as tmp:
+        write_fixture_archives(tmp, "mock-book")
+        server = serve(tmp)
+        try:
+            repo = {
+                "name": "mock-book",
+                "link": f"http://127.0.0.1:{server.server_port}/mock-book",
+                "default_branch": "master",
+            }
+            url = archive_url(repo)
+            files = fetch_epub_archive(url)
+            assert sorted(files) == ["content.opf", "text/chapter-1.xhtml"]
+
+            book = parse_opf_and_extract_text(files)
+            assert book["title"] == "mock-book"
+            assert "This is the text of mock-book." in book["text"]
+
+            zip_files = fetch_epub_archive(url[:-len(".tar.gz")] + ".zip")
+            assert zip_files == files
+        finally:
+            server.shutdown()
+
+if __name__ == "__main__":
+    test_fetch_epub_archive()
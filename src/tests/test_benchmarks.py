@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test the synthetic corpus generator and the benchmark result comparison.
+"""
+
+from benchmarks.corpus import generate_book
+from benchmarks.run import bench_update_dataset, compare
+from src.opf_parser import parse_opf_and_extract_text
+
+def test_synthetic_book_parses_like_a_real_one():
+    """Test that generated books are deterministic and parse into chapters and endnotes"""
+    files = generate_book("synthetic", chapters=5, paragraphs=10, endnotes=3)
+    assert files == generate_book("synthetic", chapters=5, paragraphs=10, endnotes=3)
+    assert files != generate_book("synthetic", chapters=5, paragraphs=10, endnotes=3, seed=1)
+    assert "text/chapter-5.xhtml" in files and "text/endnotes.xhtml" in files
+
+    book = parse_opf_and_extract_text(files)
+    assert book["title"] and book["author"]
+    for heading in ("## I", "## V", "## Endnotes"):
+        assert heading + "\n" in book["text"]
+    # Front and back matter are filtered out by the parser
+    assert "Titlepage" not in book["text"] and "Colophon" not in book["text"]
+
+def test_update_benchmark_and_regression_check():
+    """Test that the dataset benchmark reports each size and that slowdowns are flagged"""
+    results = bench_update_dataset(sizes=(5, 10), updates=4, text_kb=1)
+    assert set(results) == {
+        "update_dataset.rows_5", "compact_dataset.rows_5", "update_dataset.rows_10", "compact_dataset.rows_10"
+    }
+    assert results["update_dataset.rows_10"]["unit"] == "ms"
+
+    baseline = {
+        "parse.memory": {"value": 10.0, "unit": "MB/s", "higher_is_better": True},
+        "update_dataset.rows_5": {"value": 1.0, "unit": "ms", "higher_is_better": False},
+    }
+    current = {
+        "parse.memory": {"value": 12.0, "unit": "MB/s", "higher_is_better": True},
+        "update_dataset.rows_5": {"value": 1.5, "unit": "ms", "higher_is_better": False},
+        "end_to_end.git": {"value": 3.0, "unit": "books/s", "higher_is_better": True},
+    }
+    rows = {name: (change, regressed) for name, _, _, change, regressed in compare(current, baseline, 0.1)}
+    assert set(rows) == {"parse.memory", "update_dataset.rows_5"}
+    assert rows["parse.memory"] == (0.2, False)
+    assert rows["update_dataset.rows_5"] == (-0.5, True)
+
+if __name__ == "__main__":
+    test_synthetic_book_parses_like_a_real_one()
+    test_update_benchmark_and_regression_check()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test SHA-based change detection against local file:// remotes and a stub GraphQL session.
+"""
+
+import os
+import re
+import tempfile
+
+from src.change_detection import annotate_content_shas, fetch_epub_trees, needs_processing, carry_over_shas
+from src.tests.test_mirror_cache import create_remote, git
+
+def make_repo(name, url):
+    return {
+        "name": name,
+        "link": f"https://github.com/standardebooks/{name}",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "clone_url": url,
+        "default_branch": "master",
+    }
+
+def test_ls_remote_ignores_metadata_updates():
+    """Test that a newer updated_at alone does not requeue a book, but a new commit does"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_dir, url = create_remote(os.path.join(tmp, "remotes"), "book-a")
+        old = annotate_content_shas([make_repo("book-a", url)])[0]
+        assert len(old["commit"]) == 40
+
+        # Stars or a description edit: updated_at moves, the commit does not
+        starred = annotate_content_shas([{**make_repo("book-a", url), "updated_at": "2025-01-01T00:00:00Z"}])[0]
+        assert not needs_processing(starred, old)
+
+        with open(os.path.join(repo_dir, "src", "epub", "content.opf"), "a", encoding="utf-8") as f:
+            f.write("\n")
+        git(["commit", "-q", "-am", "Edit"], repo_dir)
+        edited = annotate_content_shas([make_repo("book-a", url)])[0]
+        assert needs_processing(edited, old)
+
+        # Entries from before SHAs were recorded fall back to updated_at
+        legacy = {"name": "book-a", "updated_at": "2024-01-01T00:00:00Z"}
+        assert not needs_processing(old, legacy)
+        assert needs_processing(starred, legacy)
+
+        # A run that could not resolve the SHAs keeps the stored ones instead of erasing them
+        unresolved = annotate_content_shas([make_repo("book-a", "file:///nonexistent")])[0]
+        assert "commit" not in unresolved and not needs_processing(unresolved, old)
+        assert carry_over_shas(unresolved, old)["commit"] == old["commit"]
+        assert carry_over_shas(edited, old)["commit"] == edited["commit"]
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": self.data}
+
+class StubGraphQLSession:
+    """Answers batched queries with a fixed tree SHA per repo alias"""
+
+    def __init__(self):
+        self.queries = []
+
+    def post(self, url, json, timeout):
+        self.queries.append(json["query"])
+        aliases = re.findall(r"(r\d+): repository", json["query"])
+        return StubResponse({
+            alias: {"epub": {"oid": f"tree-{alias}"}, "head": {"target": {"oid": f"commit-{alias}"}}}
+            for alias in aliases
+        })
+
+def test_graphql_batches():
+    """Test that tree SHAs are requested in batches and mapped back to repo names"""
+    repos = [make_repo(f"book-{n}", "unused") for n in range(5)]
+    session = StubGraphQLSession()
+    shas = fetch_epub_trees(repos, session, batch_size=2)
+    assert len(session.queries) == 3
+    assert 'expression: "master:src/epub"' in session.queries[0]
+    assert shas["book-4"] == {"epub_tree": "tree-r0", "commit": "commit-r0"}
+    assert shas["book-1"]["epub_tree"] == "tree-r1"
+
+if __name__ == "__main__":
+    test_ls_remote_ignores_metadata_updates()
+    test_graphql_batches()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test chapter extraction and the chapters companion table.
+"""
+
+import os
+import tempfile
+
+from src.opf_parser import iter_chapters, parse_opf_and_extract_text
+from src.chapters import (
+    update_chapters, read_chapters, stored_text_hash, iter_chapter_batches, compact_chapters
+)
+from src.tests.fixtures import mock_epub_files
+
+def two_chapter_book(title):
+    files = mock_epub_files(title)
+    files["content.opf"] = files["content.opf"].replace(
+        b'</manifest>', b'<item id="chapter-2.xhtml" href="text/chapter-2.xhtml" media-type="application/xhtml+xml"/></manifest>'
+    ).replace(b'</spine>', b'<itemref idref="chapter-2.xhtml"/></spine>')
+    files["text/chapter-2.xhtml"] = files["text/chapter-1.xhtml"].replace(b"Chapter 1", b"Chapter 2")
+    return files
+
+def test_chapters_make_up_the_book_text():
+    """Test that chapters are yielded lazily and joined into the book text"""
+    files = two_chapter_book("chaptered-book")
+    chapters = iter_chapters(files)
+    first = next(chapters)
+    assert first == {
+        "spine_index": 0, "file_name": "text/chapter-1.xhtml", "heading": "Chapter 1",
+        "text": "## Chapter 1\n\nThis is the text of chaptered-book.",
+    }
+    assert [c["heading"] for c in chapters] == ["Chapter 2"]
+
+    book = parse_opf_and_extract_text(files, with_chapters=True)
+    assert book["text"] == "\n\n".join(c["text"] for c in book.pop("chapters"))
+    assert book == parse_opf_and_extract_text(files)
+
+def test_chapters_table_keyed_by_link():
+    """Test that chapters are replaced per link and flattened to one row per chapter"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "books_chapters.arrow")
+        for title in ("book-a", "book-b"):
+            book = parse_opf_and_extract_text(two_chapter_book(title), with_chapters=True)
+            update_chapters(title, book["chapters"], path, text_hash=book["text_hash"])
+        assert stored_text_hash("book-a", path) == parse_opf_and_extract_text(two_chapter_book("book-a"))["text_hash"]
+        assert stored_text_hash("book-c", path) is None
+
+        compact_chapters(path)
+        # A replaced book is tombstoned in the compacted base file
+        update_chapters("book-a", [{"spine_index": 3, "file_name": "text/x.xhtml", "heading": "", "text": "New"}], path)
+        assert [c["text"] for c in read_chapters("book-a", path)] == ["New"]
+
+        rows = [row for batch in iter_chapter_batches(path) for row in batch.to_pylist()]
+        assert [(r["link"], r["heading"]) for r in rows] == [
+            ("book-b", "Chapter 1"), ("book-b", "Chapter 2"), ("book-a", ""),
+        ]
+
+        # A row without a text hash compacts as is: there is no book text to hash
+        compact_chapters(path)
+        assert stored_text_hash("book-a", path) is None
+        assert [c["text"] for c in read_chapters("book-a", path)] == ["New"]
+
+if __name__ == "__main__":
+    test_chapters_make_up_the_book_text()
+    test_chapters_table_keyed_by_link()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test paragraph-aligned chunking of book texts.
+"""
+
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from src.chunking import build_chunks, chunk_batch
+from src.dataset import update_dataset_batch
+from src.tests.test_dataset import make_book
+
+def make_text(chapters=6, paragraphs=5):
+    parts = []
+    for c in range(chapters):
+        parts.append(f"## Chapter {c}")
+        for p in range(paragraphs):
+            parts.append(f"Paragraph {p} of chapter {c}, where the naïve café owner waits. " * (p + 1))
+    return "\n\n".join(parts)
+
+def chunk(text, **kwargs):
+    batch = pa.record_batch([pa.array(["https://example.com/b"]), pa.array([text])], names=["link", "text"])
+    return chunk_batch(batch, **kwargs).to_pylist()
+
+def test_chunks_are_bounded_and_aligned():
+    """Test limits, exact offsets, paragraph alignment, headings and overlap"""
+    text = make_text()
+    for unit in ("chars", "bytes"):
+        chunks = chunk(text, limit=600, unit=unit)
+        assert [c["chunk_idx"] for c in chunks] == list(range(len(chunks)))
+        for c in chunks:
+            size = len(c["text"].encode("utf-8")) if unit == "bytes" else len(c["text"])
+            assert size <= 600
+            assert text[c["offset"]:c["offset"] + len(c["text"])] == c["text"]
+            assert c["offset"] == 0 or text[c["offset"] - 2:c["offset"]] == "\n\n"
+            assert not c["text"].split("\n\n")[-1].startswith("#")
+        # Without overlap the chunks tile the text
+        assert "\n\n".join(c["text"] for c in chunks) == text
+
+    overlapping = chunk(text, limit=600, overlap=200)
+    assert len(overlapping) > len(chunk(text, limit=600))
+    first, second = overlapping[0], overlapping[1]
+    assert second["offset"] < first["offset"] + len(first["text"])
+
+def test_oversized_paragraph_and_build():
+    """Test that long paragraphs are split at sentences and the chunk file is written per batch"""
+    long_paragraph = "A sentence that goes on. " * 100
+    chunks = chunk("# Title\n\n" + long_paragraph, limit=300)
+    assert all(len(c["text"]) <= 300 for c in chunks)
+    assert all(c["text"].endswith(". ") or c is chunks[-1] for c in chunks[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        update_dataset_batch([make_book(n, text=make_text(chapters=n + 1)) for n in range(3)], dataset_path)
+        chunks_path = os.path.join(tmp, "chunks.arrow")
+        total = build_chunks(dataset_path, chunks_path, limit=1000)
+        table = ipc.open_file(chunks_path).read_all()
+        assert table.num_rows == total
+        assert sorted(set(table.column("link").to_pylist())) == [f"https://example.com/book{n}" for n in range(3)]
+
+if __name__ == "__main__":
+    test_chunks_are_bounded_and_aligned()
+    test_oversized_paragraph_and_build()
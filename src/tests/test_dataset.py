@@ -1,6 +1,13 @@
 import pyarrow as pa
 import pyarrow.ipc as ipc
 import os
+import tempfile
+
+from src import dataset
+from src.dataset import (
+    update_dataset, update_dataset_batch, compact_dataset, read_dataset,
+    DatasetReader, METADATA_FIELDS, text_hash,
+)
 
 def test_arrow_dataset():
     """Test creating, writing, and reading Arrow IPC dataset"""
@@ -76,5 +83,114 @@ def test_arrow_dataset():
     os.remove(dataset_path)
     print("\nTest completed successfully!")
 
+def make_book(n, text=None):
+    return {
+        "link": f"https://example.com/book{n}",
+        "title": f"Test Book {n}",
+        "author": f"Test Author {n}",
+        "text": text or f"This is the content of test book {n}.",
+        "language": "en"
+    }
+
+def test_segmented_upsert_and_compact():
+    """Test that segments are merged into one logical table and tombstoned rows are dropped"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+
+        update_dataset(make_book(1), dataset_path)
+        update_dataset_batch([make_book(2), make_book(3)], dataset_path)
+        update_dataset(make_book(2, text="Revised text."), dataset_path)
+
+        table = read_dataset(dataset_path)
+        assert table.num_rows == 3
+        texts = dict(zip(table.column("link").to_pylist(), table.column("text").to_pylist()))
+        assert texts["https://example.com/book2"] == "Revised text."
+
+        compact_dataset(dataset_path)
+        assert not os.path.exists(dataset_path + ".segments")
+        compacted = read_dataset(dataset_path)
+        assert compacted.num_rows == 3
+        assert sorted(compacted.column("link").to_pylist()) == sorted(texts)
+
+        # Updates after compaction tombstone rows in the base file
+        update_dataset(make_book(1, text="Second edition."), dataset_path)
+        table = read_dataset(dataset_path)
+        assert table.num_rows == 3
+        texts = dict(zip(table.column("link").to_pylist(), table.column("text").to_pylist()))
+        assert texts["https://example.com/book1"] == "Second edition."
+
+def test_reader_lookup_and_projection():
+    """Test O(1) link lookup, metadata-only projection and the persisted (or in-memory) base index"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        update_dataset_batch([make_book(n) for n in range(1, 6)], dataset_path)
+        compact_dataset(dataset_path)
+        assert os.path.exists(dataset_path + ".index.json")
+        update_dataset(make_book(4, text="Updated."), dataset_path)
+
+        with DatasetReader(dataset_path) as reader:
+            assert len(reader) == 5
+            assert "https://example.com/book3" in reader
+            assert "https://example.com/missing" not in reader
+            assert reader.get("https://example.com/book4", columns=["text"]) == {"text": "Updated."}
+            assert reader.get("https://example.com/book2")["title"] == "Test Book 2"
+
+            metadata = reader.read(METADATA_FIELDS)
+            assert metadata.column_names == METADATA_FIELDS
+            assert metadata.num_rows == 5
+
+            rows = sum(batch.num_rows for batch in reader.iter_batches(["link"]))
+            assert rows == 5
+
+        # Without write access the index is rebuilt in memory only
+        os.remove(dataset_path + ".index.json")
+        def read_only(path, data):
+            raise PermissionError(f"Read-only file system: {path}")
+        write_json = dataset._write_json
+        dataset._write_json = read_only
+        try:
+            assert read_dataset(dataset_path).num_rows == 5
+        finally:
+            dataset._write_json = write_json
+        assert not os.path.exists(dataset_path + ".index.json")
+
+def test_unchanged_text_is_not_rewritten():
+    """Test that upserts skip unchanged books, including rows from files without text_hash"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        # A base file written before the text_hash column existed
+        legacy = pa.table({k: [make_book(n)[k] for n in range(3)] for k in ["link", "title", "author", "text", "language"]})
+        with open(dataset_path, "wb") as f:
+            writer = ipc.RecordBatchFileWriter(f, legacy.schema)
+            writer.write_table(legacy)
+            writer.close()
+        assert read_dataset(dataset_path).column("text_hash").null_count == 3
+
+        statuses = update_dataset_batch(
+            [make_book(0), make_book(1, text="Revised."), {**make_book(2), "title": "Retitled"}, make_book(3)],
+            dataset_path
+        )
+        assert statuses == {
+            "https://example.com/book0": "unchanged",
+            "https://example.com/book1": "text_changed",
+            "https://example.com/book2": "metadata_changed",
+            "https://example.com/book3": "new",
+        }
+        with DatasetReader(dataset_path) as reader:
+            # Only the three changed books went into the new segment
+            assert len(reader.manifest["links"]) == 3
+            assert reader.get("https://example.com/book1")["text_hash"] == text_hash("Revised.")
+        assert update_dataset(make_book(1, text="Revised."), dataset_path) == "unchanged"
+
+        # Compaction fills in the hashes of legacy rows
+        compact_dataset(dataset_path)
+        table = read_dataset(dataset_path)
+        assert table.column("text_hash").null_count == 0
+        hashes = dict(zip(table.column("link").to_pylist(), table.column("text_hash").to_pylist()))
+        assert hashes["https://example.com/book0"] == text_hash(make_book(0)["text"])
+
 if __name__ == "__main__":
     test_arrow_dataset()
+    test_segmented_upsert_and_compact()
+    test_reader_lookup_and_projection()
+    test_unchanged_text_is_not_rewritten()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Test MinHash/LSH near-duplicate detection on a synthetic corpus.
+"""
+
+import os
+import random
+import tempfile
+
+import pyarrow.parquet as pq
+
+from src.dataset import update_dataset_batch
+from src.dedup import find_duplicates, write_dedup_groups, load_dedup_groups
+from src.export import export_parquet
+from src.tests.test_dataset import make_book
+
+def random_text(seed, words=3000):
+    rng = random.Random(seed)
+    vocabulary = [f"word{n}" for n in range(2000)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+def test_omnibus_and_near_copy_are_clustered():
+    """Test that a collection clusters with its titles and an edited copy with its original"""
+    texts = {n: random_text(n) for n in range(4)}
+    edited = texts[2].split()
+    for i in range(0, len(edited), 300):
+        edited[i] = "changed"
+    books = [make_book(n, text=texts[n]) for n in range(4)]
+    books.append(make_book(10, text=texts[0] + "\n\n" + texts[1]))
+    books.append(make_book(11, text=" ".join(edited)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        update_dataset_batch(books, dataset_path)
+        report = find_duplicates(dataset_path, workers=2)
+
+        clusters = [sorted(m["link"].rsplit("book", 1)[1] for m in c["members"]) for c in report["clusters"]]
+        assert sorted(clusters) == [["0", "1", "10"], ["11", "2"]]
+        # The omnibus is listed first in its cluster
+        omnibus_cluster = next(c for c in report["clusters"] if len(c["members"]) == 3)
+        assert omnibus_cluster["members"][0]["link"] == "https://example.com/book10"
+        assert report["num_books"] == 6
+
+        groups_path = os.path.join(tmp, "groups.arrow")
+        write_dedup_groups(report, groups_path)
+        groups = load_dedup_groups(groups_path)
+        assert "https://example.com/book3" not in groups
+        assert groups["https://example.com/book0"] == groups["https://example.com/book10"]
+
+        export_parquet(dataset_path, os.path.join(tmp, "export"), dedup_groups=groups)
+        table = pq.read_table(os.path.join(tmp, "export", "data"))
+        exported = dict(zip(table.column("link").to_pylist(), table.column("dedup_group").to_pylist()))
+        assert exported["https://example.com/book3"] is None
+        assert exported["https://example.com/book11"] == groups["https://example.com/book2"]
+
+if __name__ == "__main__":
+    test_omnibus_and_near_copy_are_clustered()
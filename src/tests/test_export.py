@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test the sharded Parquet export.
+"""
+
+import os
+import json
+import tempfile
+
+import pyarrow.parquet as pq
+
+from src.dataset import update_dataset_batch, compact_dataset, read_dataset
+from src.export import export_parquet, shard_of
+from src.tests.test_dataset import make_book
+
+def test_sharded_export():
+    """Test that shards are size-bounded, zstd/dictionary encoded and round-trip the dataset"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        update_dataset_batch([make_book(n) for n in range(40)], dataset_path)
+        compact_dataset(dataset_path)
+        # Live segment rows and a tombstoned base row are exported correctly too
+        update_dataset_batch([make_book(n, text=f"Revised text {n}. " * 200) for n in range(35, 45)], dataset_path)
+
+        out_dir = os.path.join(tmp, "export")
+        manifest = export_parquet(dataset_path, out_dir, row_group_size=8, max_shard_bytes=2048)
+        assert manifest["num_rows"] == 45
+        assert len(manifest["shards"]) > 1
+        with open(os.path.join(out_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            assert json.load(f) == manifest
+
+        total = len(manifest["shards"])
+        names = sorted(os.listdir(os.path.join(out_dir, "data")))
+        assert names == [f"train-{i:05d}-of-{total:05d}.parquet" for i in range(total)]
+
+        for shard in manifest["shards"]:
+            metadata = pq.ParquetFile(os.path.join(out_dir, shard["path"])).metadata
+            assert metadata.num_rows == shard["num_rows"]
+            assert metadata.num_row_groups == shard["num_row_groups"]
+            assert all(metadata.row_group(i).num_rows <= 8 for i in range(metadata.num_row_groups))
+            column = metadata.schema.names.index("author")
+            chunk = metadata.row_group(0).column(column)
+            assert chunk.compression == "ZSTD"
+            assert chunk.has_dictionary_page
+
+        exported = pq.read_table(os.path.join(out_dir, "data")).sort_by("link")
+        assert exported.equals(read_dataset(dataset_path).sort_by("link"))
+
+        # A smaller re-export replaces the previous shards
+        manifest = export_parquet(dataset_path, out_dir)
+        assert os.listdir(os.path.join(out_dir, "data")) == ["train-00000-of-00001.parquet"]
+
+def test_hash_partitioned_export():
+    """Test that with a fixed shard count an updated book only changes its own shard"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        update_dataset_batch([make_book(n) for n in range(30)], dataset_path)
+        out_dir = os.path.join(tmp, "export")
+
+        def shard_bytes():
+            manifest = export_parquet(dataset_path, out_dir, row_group_size=4, num_shards=4)
+            assert manifest["num_rows"] == 30
+            contents = {}
+            for shard in manifest["shards"]:
+                with open(os.path.join(out_dir, shard["path"]), "rb") as f:
+                    contents[shard["path"]] = f.read()
+            return contents
+
+        before = shard_bytes()
+        update_dataset_batch([make_book(7, text="A corrected text.")], dataset_path)
+        compact_dataset(dataset_path)
+        after = shard_bytes()
+        changed = [path for path in before if before[path] != after[path]]
+        assert changed == [f"data/train-{shard_of('https://example.com/book7', 4):05d}-of-00004.parquet"]
+
+if __name__ == "__main__":
+    test_sharded_export()
+    test_hash_partitioned_export()
@@ -7,6 +7,7 @@ This helps debug the dataset creation without needing GitHub API or actual repos
 import os
 import json
 from main import update_dataset, DATASET_FILE, BOOKS_LIST_FILE
+from src.dataset import read_dataset, remove_dataset
 
 def create_mock_book_data():
     """Create mock book entries to test the pipeline"""
@@ -57,10 +58,10 @@ def test_full_pipeline():
     print("=== Testing Full Pipeline with Mock Data ===\n")
 
     # Clean up any existing test files
-    for file in [DATASET_FILE, BOOKS_LIST_FILE]:
-        if os.path.exists(file):
-            print(f"Removing existing {file}")
-            os.remove(file)
+    remove_dataset(DATASET_FILE)
+    if os.path.exists(BOOKS_LIST_FILE):
+        print(f"Removing existing {BOOKS_LIST_FILE}")
+        os.remove(BOOKS_LIST_FILE)
 
     mock_books = create_mock_book_data()
     successful_repos = []
@@ -112,18 +113,13 @@ def test_full_pipeline():
     # Verify final results
     print("=== Final Verification ===")
 
-    # Check dataset file
-    if os.path.exists(DATASET_FILE):
-        file_size = os.path.getsize(DATASET_FILE)
-        print(f"✅ Dataset file created: {DATASET_FILE} ({file_size} bytes)")
+    # Check dataset (base file plus segments)
+    table = read_dataset(DATASET_FILE)
+    if table is not None:
+        print(f"✅ Dataset created: {DATASET_FILE}")
 
         # Try to read and verify content
         try:
-            import pyarrow.ipc as ipc
-            with open(DATASET_FILE, 'rb') as f:
-                reader = ipc.RecordBatchFileReader(f)
-                table = reader.read_all()
-
             print(f"✅ Dataset contains {table.num_rows} books")
             print(f"✅ Schema: {[field.name for field in table.schema]}")
 
@@ -139,7 +135,7 @@ def test_full_pipeline():
         except Exception as e:
             print(f"❌ Failed to read dataset: {e}")
     else:
-        print(f"❌ Dataset file not found: {DATASET_FILE}")
+        print(f"❌ Dataset not found: {DATASET_FILE}")
 
     # Check books list file
     if os.path.exists(BOOKS_LIST_FILE):
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Test reading src/epub through git cat-file from a bare, blob-less clone.
+"""
+
+import os
+import pickle
+import tempfile
+
+from src.git_blobs import clone_objects, GitBlobFiles, list_tree
+from src.opf_parser import parse_opf_and_extract_text
+from src.tests.test_mirror_cache import create_remote, git
+
+def test_blob_files_parse_like_a_checkout():
+    """Test that a book read from git objects parses exactly like its working tree"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_dir, url = create_remote(os.path.join(tmp, "remotes"), "book-a")
+        dest = os.path.join(tmp, "book-a.git")
+        tree = clone_objects(url, dest)
+        assert "content.opf" in tree and "text/chapter-1.xhtml" in tree
+        # No working tree: only the object store is on disk
+        assert not os.path.exists(os.path.join(dest, "src"))
+
+        files = GitBlobFiles(dest, tree)
+        epub_dir = os.path.join(repo_dir, "src", "epub")
+        with open(os.path.join(epub_dir, "content.opf"), "rb") as f:
+            assert files["content.opf"] == f.read()
+        assert "missing.xhtml" not in files
+        files.close()
+
+        expected = parse_opf_and_extract_text(epub_dir)
+        assert parse_opf_and_extract_text(files)["text"] == expected["text"]
+        # Parse workers get the mapping pickled and start their own cat-file process
+        assert parse_opf_and_extract_text(pickle.loads(pickle.dumps(files)))["text"] == expected["text"]
+        assert files._proc is None
+
+def test_repo_without_epub():
+    """Test that a repo without src/epub lists an empty tree"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_dir, url = create_remote(os.path.join(tmp, "remotes"), "book-a")
+        git(["rm", "-q", "-r", "src"], repo_dir)
+        git(["commit", "-q", "-m", "Remove src"], repo_dir)
+        assert clone_objects(url, os.path.join(tmp, "book-a.git")) == {}
+        assert list_tree(repo_dir, "HEAD~1") != {}
+
+if __name__ == "__main__":
+    test_blob_files_parse_like_a_checkout()
+    test_repo_without_epub()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test the paginated, conditionally cached repo list fetch against a local mock API server.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src.github_api import fetch_repo_list
+from src.http_cache import HTTPCache
+
+PER_PAGE = 100
+
+def make_repo(n):
+    return {
+        "name": f"author_book-{n}",
+        "html_url": f"https://github.com/standardebooks/author_book-{n}",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "clone_url": f"https://github.com/standardebooks/author_book-{n}.git",
+        "default_branch": "master",
+    }
+
+class MockAPIHandler(BaseHTTPRequestHandler):
+    """Serves `server.repos` in pages of 100 with ETag and Link headers"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        repos = self.server.repos
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        last = max(1, -(-len(repos) // PER_PAGE))
+        body = json.dumps(repos[(page - 1) * PER_PAGE:page * PER_PAGE]).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        self.server.requests.append((page, self.headers.get("If-None-Match") == etag))
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        base = f"http://127.0.0.1:{self.server.server_port}/orgs/standardebooks/repos?per_page=100&type=public"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        if last > 1:
+            links = [f'<{base}&page={min(page + 1, last)}>; rel="next"', f'<{base}&page={last}>; rel="last"']
+            self.send_header("Link", ", ".join(links))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(repos):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    server.repos = repos
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_conditional_pagination():
+    """Test that all pages are fetched and unchanged pages are served from the cache on 304"""
+    repos = [make_repo(n) for n in range(250)] + [{**make_repo(0), "name": "tools"}]
+    server = serve(repos)
+    try:
+        api_url = f"http://127.0.0.1:{server.server_port}/orgs/standardebooks/repos?per_page=100&type=public"
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, "github_cache.json")
+
+            first = fetch_repo_list(api_url, cache=HTTPCache(cache_path))
+            assert [r["name"] for r in first] == [f"author_book-{n}" for n in range(250)]
+            assert sorted(page for page, _ in server.requests) == [1, 2, 3]
+
+            # Nothing changed: every page is a 304 and the result is identical
+            server.requests.clear()
+            cache = HTTPCache(cache_path)
+            assert fetch_repo_list(api_url, cache=cache) == first
+            assert cache.hits == 3 and cache.misses == 0
+
+            # Only the changed page is downloaded again
+            server.requests.clear()
+            repos[150]["updated_at"] = "2025-01-01T00:00:00Z"
+            cache = HTTPCache(cache_path)
+            second = fetch_repo_list(api_url, cache=cache)
+            assert cache.hits == 2 and cache.misses == 1
+            assert second[150]["updated_at"] == "2025-01-01T00:00:00Z"
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test_conditional_pagination()
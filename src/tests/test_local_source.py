@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test building from local .epub files and repo checkouts.
+"""
+
+import os
+import pickle
+import zipfile
+import tempfile
+
+from src.local_source import EpubZipFiles, find_local_books, open_local_book
+from src.opf_parser import parse_opf_and_extract_text
+from src.pipeline import run_pipeline
+from src.tests.fixtures import (
+    create_mock_epub, create_mock_epub_zip, mock_epub_files, OPF_TEMPLATE, CHAPTER_TEMPLATE, CONTAINER_XML
+)
+
+def test_epub_is_read_in_place():
+    """Test that the OPF is found via container.xml and members are read from the zip"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = create_mock_epub_zip(os.path.join(tmp, "zipped-book.epub"), "zipped-book")
+        files = EpubZipFiles(path)
+        assert files.opf_path == "epub/content.opf"
+        assert sorted(files) == ["content.opf", "text/chapter-1.xhtml"]
+        assert "text/chapter-1.xhtml" in files and "epub/text/chapter-1.xhtml" not in files
+
+        book = parse_opf_and_extract_text(files)
+        assert book == parse_opf_and_extract_text(mock_epub_files("zipped-book"))
+        # Pickled copies (as sent to pool workers) reopen the archive
+        files.close()
+        assert pickle.loads(pickle.dumps(files))["text/chapter-1.xhtml"] == mock_epub_files("zipped-book")["text/chapter-1.xhtml"]
+        assert os.listdir(tmp) == ["zipped-book.epub"]
+
+def test_spine_outside_the_opf_directory():
+    """Test that spine hrefs climbing out of the OPF's directory resolve to their zip members"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "other-layout.epub")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("META-INF/container.xml", CONTAINER_XML.replace("epub/content.opf", "OEBPS/content.opf"))
+            opf = OPF_TEMPLATE.format(title="other-layout").replace("text/chapter-1.xhtml", "../Text/chapter-1.xhtml")
+            archive.writestr("OEBPS/content.opf", opf)
+            archive.writestr("Text/chapter-1.xhtml", CHAPTER_TEMPLATE.format(title="other-layout"))
+
+        files = EpubZipFiles(path)
+        assert "../Text/chapter-1.xhtml" in files
+        assert "This is the text of other-layout." in parse_opf_and_extract_text(files)["text"]
+
+def test_local_books_through_pipeline():
+    """Test that .epub files and checkouts are listed and parsed in a process pool"""
+    with tempfile.TemporaryDirectory() as tmp:
+        create_mock_epub_zip(os.path.join(tmp, "author_book-a.epub"), "book-a")
+        # Another download variant of the same book is not listed twice
+        create_mock_epub_zip(os.path.join(tmp, "author_book-a_advanced.epub"), "book-a")
+        create_mock_epub(tmp, "author_book-b")
+        with open(os.path.join(tmp, "notes.txt"), "w") as f:
+            f.write("not a book")
+
+        repos = find_local_books(tmp)
+        assert [(r["name"], r["kind"]) for r in repos] == [("author_book-a", "epub"), ("author_book-b", "checkout")]
+        assert repos[0]["link"] == "https://github.com/standardebooks/author_book-a"
+
+        written = {}
+        run_pipeline(
+            repos, lambda repo: (None, open_local_book(repo)), parse_opf_and_extract_text,
+            lambda repo, book: written.update({repo["name"]: book["title"]}), lambda tmp_dir: None,
+            parse_workers=2
+        )
+        assert written == {"author_book-a": "book-a", "author_book-b": "author_book-b"}
+
+if __name__ == "__main__":
+    test_epub_is_read_in_place()
+    test_spine_outside_the_opf_directory()
+    test_local_books_through_pipeline()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Parity test and benchmark: lxml tree-walking converter vs. the markdownify reference.
+"""
+
+import difflib
+import re
+import time
+
+from src.markdown_converter import xhtml_to_markdown_lxml
+from src.opf_parser import xhtml_to_markdown, xhtml_to_markdown_markdownify
+from src.tests.test_parsing import create_mock_xhtml_files
+
+# Body fragments covering the whitelisted tags and Standard Ebooks idioms
+CASES = [
+ '<section id="c1" epub:type="chapter"><h2 epub:type="title">The <i>Sisters</i></h2>\n\t<p>There was *no* hope_for him: it was <em>the</em> third <abbr>Mr.</abbr> stroke.</p>\n\t<p>Every night <b> bold </b> and <strong>strong</strong>.</p>\n</section>',
+ '<section><header><h2>I</h2><p epub:type="subtitle">Sub</p></header><p>Text</p><hr/><p>More</p></section>',
+ '<blockquote><p>Line one</p><p>Line two</p></blockquote><p>After</p>',
+ '<blockquote epub:type="z3998:poem"><p><span>Roses are red,</span><br/>\n\t\t<span class="i1">Violets are blue.</span></p></blockquote>',
+ '<ol><li><p>First <a href="#n1">1</a></p></li><li id="x"><p>Second</p><ul><li>Nested</li><li>Nested 2</li></ul></li></ol><p>tail</p>',
+ '<ul>\n<li>One</li>\n<li>Two</li>\n</ul>\ntext after',
+ '<section id="endnotes" epub:type="endnotes"><h2>Endnotes</h2><ol start="3"><li id="note-1" epub:type="endnote"><p>Note text. <a href="c.xhtml#noteref-1" epub:type="backlink">↩</a></p></li><li><p>Second note.</p></li></ol></section>',
+ '<pre>  code\n  block *x*\n</pre><p>A <code>x_y</code> and <code>a`b</code></p>',
+ '<p>nbsp here and  multiple   spaces\n and\nnewlines</p><!-- comment --><p>after comment</p>',
+ '<div><p>In div</p>text<span> span </span><p>p2</p></div>',
+ '<table><tr><td>cell <p>para</p></td></tr></table>',
+ '<h3>Heading <p>inside</p> h</h3><h1>  Big   title </h1>',
+ '<p>a<i> b </i>c<i></i>d<b>  </b></p>',
+ '<article><section><h2>x</h2><section><h3>y</h3><p>z</p></section></section></article>',
+ '<p>text <span>inline<br/>break</span> more</p>',
+ '<p>1. not a list</p><p># not heading</p><p>- dash</p>',
+ '<figure><img src="a.png" alt="alt"/><figcaption>Caption</figcaption></figure>',
+ '<p>x</p>\n\n   \n<p>y</p>',
+ 'loose text <i>it</i> <p>p</p> tail',
+ '<dl><dt>Term</dt><dd>Def</dd></dl>',
+ '<section><p>a</p><blockquote><p>q<br/>r</p><p class="x">s</p></blockquote><p>b</p></section>',
+ '<ul><li><ul><li>deep</li></ul></li></ul>',
+ '<p>A <i epub:type="se:name.ship">Titanic</i>’s “quoted” — dash — and <abbr epub:type="z3998:initialism">U.S.A.</abbr></p>',
+ '<li>orphan li</li><ol><li></li><li>x</li></ol>',
+ '<p>  <i>lead</i> trailing <b>b</b>  </p>',
+ '<blockquote>\n<p>one</p>\n\n<p>two</p>\n</blockquote>',
+ '<h2 epub:type="title z3998:roman">XII</h2><p>Tab\there</p>',
+ '<p>Star * and underscore _ and back\\slash</p>',
+ '<ol><li><blockquote><p>nested quote</p></blockquote></li></ol>',
+ '<pre><code>def f():\n    return 1\n</code></pre>',
+]
+
+def wrap(body):
+    """Wrap a body fragment in a Standard Ebooks style XHTML document"""
+    return (
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en-US">\n'
+        '<head>\n<title>T</title>\n</head>\n'
+        '<body epub:type="bodymatter z3998:fiction">\n' + body + '\n</body>\n</html>'
+    )
+
+def fixture_documents():
+    """All parity fixtures as XHTML strings without the XML declaration"""
+    docs = [wrap(case) for case in CASES]
+    for content in create_mock_xhtml_files().values():
+        docs.append(re.sub(r'<\?xml[^>]*\?>', '', content))
+    return docs
+
+def test_lxml_converter_parity():
+    """Test that the lxml converter output is byte-identical to markdownify's"""
+    diffs = []
+    for doc in fixture_documents():
+        expected = xhtml_to_markdown_markdownify(doc)
+        actual = xhtml_to_markdown(doc)
+        if actual != expected:
+            diffs.append("\n".join(difflib.unified_diff(
+                expected.splitlines(), actual.splitlines(), "markdownify", "lxml", lineterm=""
+            )))
+    assert not diffs, "\n\n".join(diffs)
+
+def test_malformed_xhtml_falls_back():
+    """Test that documents lxml cannot parse still convert through markdownify"""
+    doc = wrap("<p>Broken &nbsp; entity</p>")
+    assert xhtml_to_markdown_lxml(doc) is None
+    assert xhtml_to_markdown(doc) == xhtml_to_markdown_markdownify(doc)
+
+def benchmark_converters(rounds=50):
+    """Print the time per document for both converters"""
+    docs = fixture_documents()
+    # One large chapter, closer to a real book
+    docs.append(wrap("\n".join(CASES) * 20))
+    results = {}
+    for name, convert in [("markdownify", xhtml_to_markdown_markdownify), ("lxml", xhtml_to_markdown)]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for doc in docs:
+                convert(doc)
+        results[name] = (time.perf_counter() - start) / (rounds * len(docs))
+        print(f"{name}: {results[name] * 1000:.3f} ms/document")
+    print(f"Speedup: {results['markdownify'] / results['lxml']:.1f}x")
+
+if __name__ == "__main__":
+    test_lxml_converter_parity()
+    test_malformed_xhtml_falls_back()
+    benchmark_converters()
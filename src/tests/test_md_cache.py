@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test the content-addressed chapter cache used by the OPF parser.
+"""
+
+import os
+import json
+import pickle
+import tempfile
+
+import main
+from src.dataset import read_dataset
+from src.md_cache import MarkdownCache
+from src.opf_parser import parse_opf_and_extract_text
+from src.tests.fixtures import mock_epub_files
+from src.tests.test_mirror_cache import create_remote
+
+def test_unchanged_chapters_hit_cache():
+    """Test that re-parsing a book serves unchanged chapters from the cache"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MarkdownCache(os.path.join(tmp, "cache.sqlite"))
+        files = mock_epub_files("cached-book")
+
+        first = parse_opf_and_extract_text(files, md_cache=cache)
+        assert cache.stats()["misses"] == 1
+
+        second = parse_opf_and_extract_text(files, md_cache=cache)
+        assert second == first
+        assert cache.stats()["hits"] == 1
+
+        # A typo fix changes the bytes, so the chapter is converted again
+        files["text/chapter-1.xhtml"] = files["text/chapter-1.xhtml"].replace(b"text of", b"texts of")
+        third = parse_opf_and_extract_text(files, md_cache=cache)
+        assert "This is the texts of cached-book." in third["text"]
+        assert cache.stats()["misses"] == 2
+
+        # Pickled copies (as sent to pool workers) share the same database
+        clone = pickle.loads(pickle.dumps(cache))
+        assert clone.stats()["entries"] == 2
+        cache.close()
+
+def test_size_cap_evicts_oldest():
+    """Test that entries beyond max_bytes are evicted least recently used first"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = MarkdownCache(os.path.join(tmp, "cache.sqlite"), max_bytes=400)
+        for n in range(20):
+            cache.put(f"key-{n}", os.urandom(100).hex())
+        cache.flush()
+        stats = cache.stats()
+        assert 0 < stats["bytes"] <= 400
+        assert cache.get("key-19") is not None
+        assert cache.get("key-0") is None
+        cache.close()
+
+def test_default_build_uses_cache():
+    """Test a build with default options (cache on, --workers 1), where the parse thread uses the cache"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repos = []
+        for name in ("book-a", "book-b"):
+            _, url = create_remote(os.path.join(tmp, "remotes"), name)
+            repos.append({
+                "name": name, "link": f"https://example.com/{name}", "updated_at": "2024-01-01T00:00:00Z",
+                "clone_url": url, "default_branch": "master",
+            })
+        repo_list = os.path.join(tmp, "repos.json")
+        with open(repo_list, "w", encoding="utf-8") as f:
+            json.dump(repos, f)
+        work = os.path.join(tmp, "work")
+        os.makedirs(work)
+        cwd = os.getcwd()
+        token = os.environ.pop("GITHUB_TOKEN", None)
+        os.chdir(work)
+        try:
+            main.main(["--repo-list", repo_list])
+            assert sorted(read_dataset(main.DATASET_FILE).column("link").to_pylist()) == [r["link"] for r in repos]
+            assert MarkdownCache(main.MD_CACHE_FILE).stats()["misses"] == 2
+        finally:
+            os.chdir(cwd)
+            if token is not None:
+                os.environ["GITHUB_TOKEN"] = token
+
+if __name__ == "__main__":
+    test_unchanged_chapters_hit_cache()
+    test_size_cap_evicts_oldest()
+    test_default_build_uses_cache()
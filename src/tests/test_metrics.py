@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test the per-stage run metrics, their JSON and Prometheus outputs and parse profiling.
+"""
+
+import os
+import json
+import pstats
+import tempfile
+from functools import partial
+
+from src.metrics import RunMetrics, timed, profile_call, keep_slowest_profiles
+from src.opf_parser import parse_opf_and_extract_text
+from src.tests.fixtures import mock_epub_files
+
+def test_run_report_and_prometheus_textfile():
+    """Test that stage samples are summarised per stage and per book"""
+    metrics = RunMetrics(trace_memory=True)
+    with timed(metrics, "fetch_list"):
+        pass
+    with timed(None, "ignored"):
+        pass
+    metrics.record("clone", 2.0, "book-a")
+    metrics.record("clone", 1.0, "book-b")
+    metrics.record_timings("book-b", {"opf_parse": 0.5, "markdown_conversion": 3.0, "rss_bytes": 1024})
+    metrics.count("written", 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report_path = os.path.join(tmp, "run_report.json")
+        metrics.write_report(report_path)
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        assert set(report["stages"]) == {"fetch_list", "clone", "opf_parse", "markdown_conversion"}
+        assert report["stages"]["clone"]["count"] == 2
+        assert report["stages"]["clone"]["total_seconds"] == 3.0
+        assert report["stages"]["clone"]["max_seconds"] == 2.0
+        assert report["stages"]["markdown_conversion"]["peak_rss_bytes"] == 1024
+        assert "peak_traced_bytes" in report["stages"]["fetch_list"]
+        assert [b["book"] for b in report["slowest_books"]] == ["book-b", "book-a"]
+        assert report["slowest_books"][0]["total_seconds"] == 4.5
+        assert report["counters"] == {"written": 2}
+
+        prom_path = os.path.join(tmp, "build.prom")
+        metrics.write_prometheus(prom_path)
+        with open(prom_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        assert 'ebooks_build_stage_seconds_total{stage="clone"} 3.0' in text
+        assert 'ebooks_build_books{status="written"} 2' in text
+        assert "# TYPE ebooks_build_run_duration_seconds gauge" in text
+
+def test_profiles_of_slowest_books_are_kept():
+    """Test that parse timings come back with the book and only the slowest profiles are kept"""
+    metrics = RunMetrics()
+    with tempfile.TemporaryDirectory() as tmp:
+        parse = partial(profile_call, tmp, partial(parse_opf_and_extract_text, measure=True))
+        profiles = {}
+        for name in ("fast-book", "slow-book"):
+            book = parse(mock_epub_files(name))
+            assert set(book["timings"]) == {"opf_parse", "markdown_conversion", "rss_bytes"}
+            metrics.record_timings(name, book.pop("timings"))
+            profiles[name] = book.pop("profile_path")
+        metrics.record("dataset_write", 10.0, "slow-book")
+
+        kept = keep_slowest_profiles(metrics, profiles, 1)
+        assert kept == [os.path.join(tmp, "slow-book.prof")]
+        assert os.listdir(tmp) == ["slow-book.prof"]
+        assert pstats.Stats(kept[0]).total_calls > 0
+
+if __name__ == "__main__":
+    test_run_report_and_prometheus_textfile()
+    test_profiles_of_slowest_books_are_kept()
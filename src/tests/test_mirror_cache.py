@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test the persistent git mirror cache against local file:// remotes.
+"""
+
+import os
+import subprocess
+import tempfile
+
+from src.mirror_cache import MirrorCache
+from src.tests.fixtures import create_mock_epub
+
+def git(args, cwd):
+    subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com"] + args,
+        cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def create_remote(root, name):
+    """Create a git repo with a mock src/epub tree and return its file:// URL"""
+    repo_dir = create_mock_epub(root, name)
+    git(["init", "-q", "-b", "master"], repo_dir)
+    git(["config", "uploadpack.allowFilter", "true"], repo_dir)
+    git(["add", "-A"], repo_dir)
+    git(["commit", "-q", "-m", "Initial commit"], repo_dir)
+    return repo_dir, "file://" + os.path.abspath(repo_dir)
+
+def test_incremental_fetch():
+    """Test that a second fetch picks up new commits in the cached mirror"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repo_dir, url = create_remote(os.path.join(tmp, "remotes"), "book-a")
+        cache = MirrorCache(os.path.join(tmp, "cache"))
+
+        files = cache.fetch_epub(url, "book-a")
+        assert b"This is the text of book-a." in files["text/chapter-1.xhtml"]
+        assert cache.index["book-a"]["bytes"] > 0
+
+        chapter = os.path.join(repo_dir, "src", "epub", "text", "chapter-1.xhtml")
+        with open(chapter, "r", encoding="utf-8") as f:
+            content = f.read()
+        with open(chapter, "w", encoding="utf-8") as f:
+            f.write(content.replace("This is the text", "This is the corrected text"))
+        git(["commit", "-q", "-am", "Typo fix"], repo_dir)
+
+        files = cache.fetch_epub(url, "book-a")
+        assert b"This is the corrected text of book-a." in files["text/chapter-1.xhtml"]
+
+        # The index survives a restart
+        assert "book-a" in MirrorCache(os.path.join(tmp, "cache")).index
+
+def test_lru_eviction():
+    """Test that the least recently used mirror is evicted once the cache is too big"""
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = {name: create_remote(os.path.join(tmp, "remotes"), name)[1] for name in ["book-a", "book-b"]}
+        cache = MirrorCache(os.path.join(tmp, "cache"))
+        cache.fetch_epub(urls["book-a"], "book-a")
+        cache.max_bytes = cache.total_bytes()
+
+        cache.fetch_epub(urls["book-b"], "book-b")
+        assert list(cache.index) == ["book-b"]
+        assert not os.path.exists(cache.mirror_path("book-a"))
+        assert os.path.exists(cache.mirror_path("book-b"))
+
+if __name__ == "__main__":
+    test_incremental_fetch()
+    test_lru_eviction()
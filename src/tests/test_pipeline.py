@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test the concurrent download -> parse -> write pipeline with mock src/epub trees.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from src.opf_parser import parse_opf_and_extract_text
+from src.pipeline import run_pipeline
+from src.tests.fixtures import create_mock_epub
+
+def run_mock_pipeline(tmp, parse_workers):
+    """Run the pipeline over six mock repos, one of which fails to clone"""
+    repos = [{"name": f"book-{n}", "link": f"https://example.com/book-{n}"} for n in range(6)]
+    written = {}
+    lock = threading.Lock()
+    live = {"now": 0, "peak": 0}
+
+    def fetch(repo):
+        if repo["name"] == "book-3":
+            raise RuntimeError("clone failed")
+        repo_dir = create_mock_epub(tmp, repo["name"])
+        with lock:
+            live["now"] += 1
+            live["peak"] = max(live["peak"], live["now"])
+        return repo_dir, os.path.join(repo_dir, "src", "epub")
+
+    def cleanup(repo_dir):
+        shutil.rmtree(repo_dir)
+        with lock:
+            live["now"] -= 1
+
+    def write(repo, book):
+        written[repo["name"]] = book
+
+    run_pipeline(
+        repos, fetch, parse_opf_and_extract_text, write, cleanup,
+        clone_workers=3, parse_workers=parse_workers, max_checkouts=2
+    )
+    return written, live["peak"]
+
+def test_pipeline_isolates_failures():
+    """Test that a failing book does not stop the others and checkouts stay bounded"""
+    with tempfile.TemporaryDirectory() as tmp:
+        written, peak = run_mock_pipeline(tmp, parse_workers=1)
+        assert sorted(written) == ["book-0", "book-1", "book-2", "book-4", "book-5"]
+        assert "This is the text of book-4." in written["book-4"]["text"]
+        assert peak <= 2
+        # Checkouts are cleaned up once their result has been written
+        assert os.listdir(tmp) == []
+
+def test_pipeline_process_pool():
+    """Test parsing in a process pool"""
+    with tempfile.TemporaryDirectory() as tmp:
+        written, peak = run_mock_pipeline(tmp, parse_workers=2)
+        assert len(written) == 5
+        assert peak <= 2
+        assert os.listdir(tmp) == []
+
+def test_interrupt_waits_for_parse_thread():
+    """Test that after Ctrl-C the pipeline only returns once the book being parsed is done"""
+    repos = [{"name": "book-a"}, {"name": "book-b"}]
+    b_started = threading.Event()
+    finished = []
+
+    def parse(name):
+        if name == "book-b":
+            b_started.set()
+            time.sleep(0.2)
+            finished.append(name)
+        return {"name": name}
+
+    def write(repo, book):
+        b_started.wait(timeout=5)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        run_pipeline(
+            repos, lambda repo: (None, repo["name"]), parse, write, lambda tmp_dir: None,
+            clone_workers=1, parse_workers=1
+        )
+    assert finished == ["book-b"]
+
+if __name__ == "__main__":
+    test_pipeline_isolates_failures()
+    test_pipeline_process_pool()
+    test_interrupt_waits_for_parse_thread()
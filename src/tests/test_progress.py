@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test the append-only progress journal and its books_list.json snapshot.
+"""
+
+import os
+import json
+import tempfile
+
+from src.progress import ProgressJournal, load_books_list, save_books_list
+from src.pipeline import run_pipeline
+
+def make_repo(name, commit="a" * 40):
+    return {"name": name, "link": f"https://example.com/{name}", "updated_at": "2024-01-01T00:00:00Z", "commit": commit}
+
+def test_journal_replay_and_compaction():
+    """Test that states survive a restart, a torn line (and appends after it) and compaction"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "progress.jsonl")
+        books_list = os.path.join(tmp, "books_list.json")
+        # Books written before the journal existed are imported from books_list.json
+        save_books_list({"old-book": make_repo("old-book")}, books_list)
+
+        journal = ProgressJournal(path, books_list)
+        assert journal.state("old-book") == "written"
+        for state in ("queued", "downloaded", "parsed", "written"):
+            journal.record(make_repo("book-a"), state)
+        journal.record(make_repo("old-book", commit="b" * 40), "queued")
+        journal.record(make_repo("old-book", commit="b" * 40), "failed", error="clone failed")
+        journal._file.close()
+
+        # Simulate a crash in the middle of an append
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"name": "book-b", "sta')
+
+        journal = ProgressJournal(path, books_list)
+        assert journal.state("book-a") == "written"
+        assert journal.state("book-b") is None
+        assert journal.entry("old-book")["error"] == "clone failed"
+        # A failed retry keeps the last successful write
+        assert journal.written["old-book"]["commit"] == "a" * 40
+        # The torn tail is dropped on open, so this record is not glued to it
+        journal.record(make_repo("book-c"), "written")
+        journal._file.close()
+        assert ProgressJournal(path, books_list, read_only=True).state("book-c") == "written"
+        journal = ProgressJournal(path, books_list)
+        journal.close()
+
+        with open(path, "r", encoding="utf-8") as f:
+            assert len(f.readlines()) == 3
+        assert sorted(load_books_list(books_list)) == ["book-a", "book-c", "old-book"]
+        journal = ProgressJournal(path, books_list)
+        assert journal.state("old-book") == "failed"
+        assert journal.written["old-book"]["commit"] == "a" * 40
+        journal.close()
+
+def test_pipeline_records_stages():
+    """Test that the pipeline reports every stage transition to the journal"""
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ProgressJournal(os.path.join(tmp, "progress.jsonl"), os.path.join(tmp, "books_list.json"),
+                                  compact_every=3)
+        repos = [make_repo("book-ok"), make_repo("book-empty"), make_repo("book-broken")]
+
+        def fetch(repo):
+            if repo["name"] == "book-broken":
+                raise RuntimeError("clone failed")
+            return None, repo["name"]
+
+        def write(repo, book):
+            return book != "book-empty"
+
+        run_pipeline(repos, fetch, lambda source: source, write, lambda tmp_dir: None, on_state=journal.record)
+        journal.close()
+
+        with open(journal.path, "r", encoding="utf-8") as f:
+            states = {r["name"]: r["state"] for r in map(json.loads, f)}
+        assert states == {"book-ok": "written", "book-empty": "failed", "book-broken": "failed"}
+        assert list(load_books_list(journal.books_list_path)) == ["book-ok"]
+
+if __name__ == "__main__":
+    test_journal_replay_and_compaction()
+    test_pipeline_records_stages()
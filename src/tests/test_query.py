@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Test metadata filters and the streaming query export.
+"""
+
+import os
+import json
+import tempfile
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from src.query import make_predicate, run_query
+from src.dataset import update_dataset, update_dataset_batch, DatasetReader
+
+BOOKS = [
+    ("a", "Jane Austen", "Emma", "en-GB"),
+    ("b", "Jane Austen", "Persuasion", "en-US"),
+    ("c", "Victor Hugo", "Les Misérables", "fr"),
+    ("d", "Mark Twain", "Emmeline", "en-US"),
+]
+
+def make_entries():
+    return [
+        {"link": f"https://example.com/{name}", "title": title, "author": author,
+         "text": f"Text of {title}.", "language": language}
+        for name, author, title, language in BOOKS
+    ]
+
+def test_filters_and_export():
+    """Test that filters combine, skip tombstoned rows and stream to JSONL/zstd and Arrow"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = os.path.join(tmp, "books.arrow")
+        update_dataset_batch(make_entries(), dataset)
+        # A newer copy of book a in a segment tombstones the first one
+        update_dataset({**make_entries()[0], "text": "New text of Emma."}, dataset)
+
+        def titles(predicate):
+            with DatasetReader(dataset) as reader:
+                return sorted(t for b in reader.iter_batches(predicate=predicate) for t in b.column("title").to_pylist())
+
+        assert titles(make_predicate(languages=["en"])) == ["Emma", "Emmeline", "Persuasion"]
+        assert titles(make_predicate(languages=["en"], authors=["Jane Austen"])) == ["Emma", "Persuasion"]
+        assert titles(make_predicate(title="emm")) == ["Emma", "Emmeline"]
+        assert titles(make_predicate(links=["https://example.com/c"], languages=["FR"])) == ["Les Misérables"]
+        assert make_predicate() is None
+
+        out = os.path.join(tmp, "austen.jsonl.zst")
+        total = run_query(dataset, out, predicate=make_predicate(authors=["Jane Austen"]), batch_size=1)
+        assert total == 2
+        with pa.input_stream(out, compression="zstd") as f:
+            rows = [json.loads(line) for line in f.read().decode("utf-8").splitlines()]
+        assert {row["title"]: row["text"] for row in rows} == {
+            "Emma": "New text of Emma.", "Persuasion": "Text of Persuasion."
+        }
+
+        out = os.path.join(tmp, "french.arrow")
+        assert run_query(dataset, out, fmt="arrow", predicate=make_predicate(languages=["fr"]),
+                         columns=["link", "title"]) == 1
+        with pa.memory_map(out) as source:
+            table = ipc.open_file(source).read_all()
+        assert table.column_names == ["link", "title"]
+        assert table.column("title").to_pylist() == ["Les Misérables"]
+
+if __name__ == "__main__":
+    test_filters_and_export()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test sharded builds and merging their outputs.
+"""
+
+import os
+import tempfile
+
+import main
+from src.sharding import in_shard, shard_path, find_shards, merge_shards
+from src.dataset import update_dataset, read_dataset
+from src.chapters import read_chapters
+from src.progress import ProgressJournal, load_books_list
+from src.tests.fixtures import create_mock_epub
+
+def make_repo(name, updated_at):
+    return {"name": name, "link": f"https://example.com/{name}", "updated_at": updated_at}
+
+def build_shard(root, shard, books):
+    """Write a shard's dataset and journal for {name: (updated_at, text[, commit])}"""
+    dataset = os.path.join(root, shard_path("books_dataset.arrow", shard))
+    journal = ProgressJournal(
+        os.path.join(root, shard_path("progress.jsonl", shard)), os.path.join(root, shard_path("books_list.json", shard))
+    )
+    for name, (updated_at, text, *commit) in books.items():
+        repo = make_repo(name, updated_at)
+        if commit:
+            repo["commit"] = commit[0]
+        update_dataset({"link": repo["link"], "title": name, "author": "", "text": text, "language": "en"}, dataset)
+        journal.record(repo, "written")
+    journal.close()
+
+def test_merge_prefers_newest_copy():
+    """Test that the merge keeps one row per book, from the written copy with the newest updated_at, then commit"""
+    repos = [make_repo(f"book-{i}", "2024-01-01T00:00:00Z") for i in range(20)]
+    assert all(sum(in_shard(repo, (i, 3)) for i in range(3)) == 1 for repo in repos)
+    assert {in_shard(repo, (0, 3)) for repo in repos} == {True, False}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        build_shard(tmp, (0, 2), {
+            "book-a": ("2024-01-01T00:00:00Z", "old a"), "book-b": ("2024-01-01T00:00:00Z", "b"),
+            "book-d": ("2024-01-01T00:00:00Z", "d from 0", "bbbb"), "book-e": ("2024-01-01T00:00:00Z", "e"),
+        })
+        build_shard(tmp, (1, 2), {
+            "book-a": ("2024-06-01T00:00:00Z", "new a"), "book-c": ("2024-01-01T00:00:00Z", "c"),
+            "book-d": ("2024-01-01T00:00:00Z", "d from 1", "aaaa"),
+        })
+        # Queued but never written in shard 1: the written copy in shard 0 still wins
+        journal = ProgressJournal(
+            os.path.join(tmp, shard_path("progress.jsonl", (1, 2))), os.path.join(tmp, shard_path("books_list.json", (1, 2)))
+        )
+        journal.record(make_repo("book-e", "2024-09-01T00:00:00Z"), "queued")
+        journal.close()
+
+        paths = main.OUTPUT_FILES
+        shards = find_shards([tmp], paths)
+        assert sorted(shards) == [(0, 2), (1, 2)]
+        out = {kind: os.path.join(tmp, "merged-" + path) for kind, path in paths.items()}
+        assert merge_shards(shards, out["dataset"], out["chapters"], out["journal"], out["books_list"]) == 5
+
+        rows = {r["link"]: r["text"] for r in read_dataset(out["dataset"]).to_pylist()}
+        assert rows == {
+            "https://example.com/book-a": "new a", "https://example.com/book-b": "b", "https://example.com/book-c": "c",
+            "https://example.com/book-d": "d from 0", "https://example.com/book-e": "e",
+        }
+        books = load_books_list(out["books_list"])
+        assert books["book-a"]["updated_at"] == "2024-06-01T00:00:00Z"
+        assert books["book-d"]["commit"] == "bbbb"
+        assert books["book-e"]["updated_at"] == "2024-01-01T00:00:00Z"
+        assert ProgressJournal(out["journal"], out["books_list"], read_only=True).state("book-c") == "written"
+
+def test_sharded_build_and_merge_command():
+    """Test that --shard builds split the catalog and `main.py merge` puts it back together"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        names = [f"author_book-{i}" for i in range(6)]
+        for name in names:
+            create_mock_epub(source, name)
+        work = os.path.join(tmp, "work")
+        os.makedirs(work)
+        cwd = os.getcwd()
+        os.chdir(work)
+        try:
+            for i in range(2):
+                main.main(["--local", source, "--shard", f"{i}/2"])
+            main.main(["merge"])
+            links = sorted(read_dataset(main.DATASET_FILE).column("link").to_pylist())
+            assert links == [f"https://github.com/standardebooks/{name}" for name in names]
+            assert read_chapters(links[0], main.CHAPTERS_FILE)[0]["heading"] == "Chapter 1"
+            assert sorted(load_books_list(main.BOOKS_LIST_FILE)) == names
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    test_merge_prefers_newest_copy()
+    test_sharded_build_and_merge_command()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test the vectorized per-book statistics.
+"""
+
+import os
+import tempfile
+
+from src.stats import build_stats, read_stats
+from src.dataset import update_dataset_batch, text_hash
+
+def make_entry(name, text):
+    return {"link": f"https://example.com/{name}", "title": name, "author": "A", "text": text, "language": "en"}
+
+def test_stats_match_python():
+    """Test that the pyarrow statistics agree with the same measures computed in Python"""
+    texts = {
+        "plain": "# Title\n\nOne two  three.\n\n## I\n\nA café, naïvely.\nSecond line.",
+        "empty": "",
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = os.path.join(tmp, "books.arrow")
+        stats_path = os.path.join(tmp, "stats.arrow")
+        update_dataset_batch([make_entry(name, text) for name, text in texts.items()], dataset)
+        assert build_stats(dataset, stats_path) == 2
+
+        rows = {row["link"].rsplit("/", 1)[1]: row for row in read_stats(stats_path).to_pylist()}
+        for name, text in texts.items():
+            row = rows[name]
+            assert row["text_hash"] == text_hash(text)
+            assert row["text_length"] == len(text)
+            assert row["byte_length"] == len(text.encode("utf-8"))
+            assert row["word_count"] == len(text.split())
+            assert row["paragraph_count"] == len([p for p in text.split("\n\n") if p])
+            assert row["heading_count"] == sum(line.startswith("#") for line in text.splitlines())
+        assert rows["plain"]["non_ascii_ratio"] == 2 / len(texts["plain"])
+        assert rows["empty"]["non_ascii_ratio"] == 0.0
+
+if __name__ == "__main__":
+    test_stats_match_python()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test the pre-tokenized token stream and its incremental rebuilds.
+"""
+
+import os
+import tempfile
+
+from src.tokens import build_tokens, open_tokens, VocabTokenizer
+from src.dataset import update_dataset, update_dataset_batch
+
+VOCAB = ["<unk>", "</s>", " ", "the", "th", "e", "a", "b", "c", "t", "h", "o", "n"]
+
+def make_entry(name, text):
+    return {"link": f"https://example.com/{name}", "title": name, "author": "A", "text": text, "language": "en"}
+
+def decode(ids):
+    return "".join(VOCAB[i] for i in ids)
+
+def test_greedy_vocab_tokenizer():
+    """Test longest-match tokenization and <unk> for uncovered characters"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vocab.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(VOCAB) + "\n")
+        tokenizer = VocabTokenizer(path)
+        assert tokenizer.get_vocab_size() == len(VOCAB)
+        assert tokenizer.encode_ids("the theta") == [3, 2, 3, 9, 6]
+        assert tokenizer.encode_ids("bz") == [7, 0]
+
+def test_incremental_token_stream():
+    """Test that books slice out of the memmap and that only changed books are re-tokenized"""
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab = os.path.join(tmp, "vocab.txt")
+        with open(vocab, "w", encoding="utf-8") as f:
+            f.write("\n".join(VOCAB) + "\n")
+        dataset = os.path.join(tmp, "books.arrow")
+        out = os.path.join(tmp, "tokens")
+        texts = {"a": "the cat", "b": "bob the boa", "c": "a bath"}
+        update_dataset_batch([make_entry(name, text) for name, text in texts.items()], dataset)
+
+        assert build_tokens(dataset, out, vocab, eos="</s>", workers=1) == (3, 0)
+        tokens, index = open_tokens(out)
+        assert tokens.dtype.name == "uint16"
+        for row in index.to_pylist():
+            ids = tokens[row["offset"]:row["offset"] + row["length"]]
+            assert decode(ids) == texts[row["link"].rsplit("/", 1)[1]] + "</s>"
+
+        texts["b"] = "the ten oat cob"
+        update_dataset(make_entry("b", texts["b"]), dataset)
+        assert build_tokens(dataset, out, vocab, eos="</s>", workers=2, batch_size=1) == (1, 2)
+        tokens, index = open_tokens(out)
+        books = {
+            row["link"].rsplit("/", 1)[1]: decode(tokens[row["offset"]:row["offset"] + row["length"]])
+            for row in index.to_pylist()
+        }
+        assert books == {name: text + "</s>" for name, text in texts.items()}
+        assert sorted(os.listdir(out)) == ["index.1.arrow", "meta.json", "tokens.1.bin"]
+
+        # Another EOS token changes every book's tokens
+        assert build_tokens(dataset, out, vocab, workers=1) == (3, 0)
+
+if __name__ == "__main__":
+    test_greedy_vocab_tokenizer()
+    test_incremental_token_stream()
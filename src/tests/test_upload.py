@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test delta uploads of Parquet shards against a local stand-in for the Hub API.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+pytest.importorskip("huggingface_hub")
+from huggingface_hub import CommitOperationAdd, CommitOperationDelete
+from huggingface_hub.errors import EntryNotFoundError
+
+from src.dataset import update_dataset_batch
+from src.tests.test_dataset import make_book
+from upload_to_hf import upload_delta_to_huggingface, UPLOAD_MANIFEST
+
+class LocalHubApi:
+    """Keeps the files of one dataset repo in a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+        self.commits = []
+
+    def hf_hub_download(self, repo_id, filename, repo_type=None):
+        path = os.path.join(self.root, filename)
+        if not os.path.exists(path):
+            raise EntryNotFoundError(f"{filename} not found in {repo_id}")
+        return path
+
+    def list_repo_files(self, repo_id, repo_type=None):
+        assert repo_type == "dataset"
+        return sorted(
+            os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+            for dirpath, _, names in os.walk(self.root) for name in names
+        )
+
+    def create_commit(self, repo_id, operations, commit_message, repo_type=None, num_threads=5):
+        assert repo_type == "dataset"
+        uploaded = []
+        for op in operations:
+            path = os.path.join(self.root, op.path_in_repo)
+            if isinstance(op, CommitOperationDelete):
+                os.remove(path)
+                continue
+            assert isinstance(op, CommitOperationAdd)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if isinstance(op.path_or_fileobj, bytes):
+                with open(path, "wb") as f:
+                    f.write(op.path_or_fileobj)
+            else:
+                shutil.copyfile(op.path_or_fileobj, path)
+            uploaded.append(op.path_in_repo)
+        self.commits.append(uploaded)
+
+def test_delta_upload():
+    """Test that only changed shards are sent, in one commit, and the Hub ends up matching the export"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        export_dir = os.path.join(tmp, "export")
+        api = LocalHubApi(os.path.join(tmp, "hub"))
+        update_dataset_batch([make_book(n, text=f"Text of book {n}. " * 2000) for n in range(60)], dataset_path)
+
+        first = upload_delta_to_huggingface(api, dataset_path, export_dir, repo_id="user/books", max_shard_bytes=100_000)
+        assert len(api.commits) == 1
+        num_shards = len(first)
+        assert num_shards > 2
+        assert api.commits[0] == first + [UPLOAD_MANIFEST]
+
+        # Nothing changed: no commit at all
+        assert upload_delta_to_huggingface(api, dataset_path, export_dir, repo_id="user/books", max_shard_bytes=100_000) == []
+        assert len(api.commits) == 1
+
+        update_dataset_batch([make_book(3, text="A corrected text.")], dataset_path)
+        second = upload_delta_to_huggingface(api, dataset_path, export_dir, repo_id="user/books", max_shard_bytes=100_000)
+        assert len(second) == 1 and len(api.commits) == 2
+        for path in first:
+            with open(os.path.join(export_dir, path), "rb") as local, open(os.path.join(api.root, path), "rb") as hub:
+                assert local.read() == hub.read()
+        assert len(os.listdir(os.path.join(api.root, "data"))) == num_shards
+
+def test_first_delta_upload_replaces_push_to_hub_shards():
+    """Test that shards of a repo without an upload manifest are deleted unless re-exported"""
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_path = os.path.join(tmp, "books.arrow")
+        export_dir = os.path.join(tmp, "export")
+        api = LocalHubApi(os.path.join(tmp, "hub"))
+        # What push_to_hub left behind, under a name the hash-partitioned export does not use
+        stale = "data/train-00000-of-00001-0123456789abcdef.parquet"
+        os.makedirs(os.path.join(api.root, "data"))
+        for path in (stale, "README.md"):
+            with open(os.path.join(api.root, path), "wb") as f:
+                f.write(b"old")
+        update_dataset_batch([make_book(n) for n in range(5)], dataset_path)
+
+        uploaded = upload_delta_to_huggingface(api, dataset_path, export_dir, repo_id="user/books")
+        assert sorted(os.listdir(os.path.join(api.root, "data"))) == sorted(os.path.basename(p) for p in uploaded)
+        assert os.path.exists(os.path.join(api.root, "README.md"))
+
+if __name__ == "__main__":
+    test_delta_upload()
+    test_first_delta_upload_replaces_push_to_hub_shards()
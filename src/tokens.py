@@ -0,0 +1,350 @@
+"""
+tokens.py
+
+Pre-tokenizes the books dataset into a flat, memory-mappable token stream.
+
+The tokenizer is a local file: a Hugging Face `tokenizer.json` (needs the
+optional `tokenizers` package) or a plain vocab file with one token per
+line, whose line number is the token id, tokenized by greedy longest match.
+Texts are tokenized in a process pool (`workers`), `batch_size` books per
+task, each worker loading the tokenizer once.
+
+The output directory holds:
+- tokens.<generation>.bin: the token ids of every book back to back, as
+  uint16 when the vocabulary fits, else uint32
+- index.<generation>.arrow: one row per book with link, text_hash, offset
+  and length (in tokens) into the .bin file
+- meta.json: the current generation's file names, dtype, vocab size and a
+  fingerprint of the tokenizer
+
+Training jobs `np.memmap` the .bin file named by meta.json (see
+`open_tokens`) and slice books out of it without copying.
+
+Rebuilds are incremental: a book whose `text_hash` matches the previous
+index has its tokens copied from the previous .bin file instead of being
+tokenized again, and the texts of those books are never read. A new
+generation is written next to the old one and becomes current when
+meta.json is replaced, so an interrupted rebuild leaves the previous
+output intact. A different tokenizer (or EOS token) starts from scratch.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+from src.dataset import DatasetReader
+
+META_FILE = "meta.json"
+INDEX_SCHEMA = pa.schema([
+    ("link", pa.string()),
+    ("text_hash", pa.string()),
+    ("offset", pa.int64()),
+    ("length", pa.int64()),
+])
+DEFAULT_BATCH_SIZE = 64
+UNK_TOKEN = "<unk>"
+
+
+class VocabTokenizer:
+    """
+    Greedy longest-match tokenizer over a vocab file with one token per line.
+    Characters no token covers become `<unk>`, which must then be in the vocab.
+    """
+
+    def __init__(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            tokens = f.read().split("\n")
+        if tokens and tokens[-1] == "":
+            tokens.pop()
+        self.vocab = {}
+        for token_id, token in enumerate(tokens):
+            self.vocab.setdefault(token, token_id)
+        self.max_length = max((len(token) for token in self.vocab), default=1)
+        self.unk_id = self.vocab.get(UNK_TOKEN)
+        self.size = len(tokens)
+
+    def get_vocab_size(self):
+        return self.size
+
+    def token_to_id(self, token):
+        return self.vocab.get(token)
+
+    def encode_ids(self, text):
+        ids = []
+        i = 0
+        while i < len(text):
+            for length in range(min(self.max_length, len(text) - i), 0, -1):
+                token_id = self.vocab.get(text[i:i + length])
+                if token_id is not None:
+                    ids.append(token_id)
+                    i += length
+                    break
+            else:
+                if self.unk_id is None:
+                    raise ValueError(f"No token for {text[i]!r} and no {UNK_TOKEN} in the vocab")
+                ids.append(self.unk_id)
+                i += 1
+        return ids
+
+
+class HFTokenizer:
+    """
+    A Hugging Face `tokenizer.json`, through the `tokenizers` package.
+    """
+
+    def __init__(self, path):
+        from tokenizers import Tokenizer
+        self.tokenizer = Tokenizer.from_file(path)
+
+    def get_vocab_size(self):
+        return self.tokenizer.get_vocab_size()
+
+    def token_to_id(self, token):
+        return self.tokenizer.token_to_id(token)
+
+    def encode_ids(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False).ids
+
+
+def load_tokenizer(path):
+    """
+    Tokenizer for `path`: HFTokenizer for *.json files, VocabTokenizer otherwise.
+    """
+    if path.endswith(".json"):
+        return HFTokenizer(path)
+    return VocabTokenizer(path)
+
+
+def token_dtype(vocab_size):
+    return np.dtype(np.uint16) if vocab_size <= 2**16 else np.dtype(np.uint32)
+
+
+def tokenizer_fingerprint(path, eos=None):
+    """
+    Hash of the tokenizer file and EOS token; tokens are only reused while it is unchanged.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read())
+    digest.update(repr(eos).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Set once per worker process by _init_worker
+_encoder = None
+
+
+def _init_worker(tokenizer_path, eos):
+    global _encoder
+    tokenizer = load_tokenizer(tokenizer_path)
+    eos_id = None
+    if eos is not None:
+        eos_id = tokenizer.token_to_id(eos)
+        if eos_id is None:
+            raise ValueError(f"EOS token {eos!r} is not in the vocab")
+    dtype = token_dtype(tokenizer.get_vocab_size())
+    _encoder = (tokenizer, eos_id, dtype)
+
+
+def _encode_texts(texts):
+    """
+    Token ids of each text (followed by the EOS token, if any) as arrays of the output dtype.
+    """
+    tokenizer, eos_id, dtype = _encoder
+    encoded = []
+    for text in texts:
+        ids = tokenizer.encode_ids(text or "")
+        if eos_id is not None:
+            ids.append(eos_id)
+        encoded.append(np.asarray(ids, dtype=dtype))
+    return encoded
+
+
+def load_meta(out_dir):
+    path = os.path.join(out_dir, META_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
+        return None
+
+
+def _read_index(path):
+    with pa.memory_map(path, "r") as source:
+        return ipc.open_file(source).read_all()
+
+
+def open_tokens(out_dir):
+    """
+    Return (token stream as a read-only np.memmap, index table) of the current generation,
+    or None if nothing has been built. Book i's tokens are tokens[offset:offset + length].
+    """
+    meta = load_meta(out_dir)
+    if meta is None:
+        return None
+    index = _read_index(os.path.join(out_dir, meta["index"]))
+    tokens_path = os.path.join(out_dir, meta["tokens"])
+    if meta["num_tokens"] == 0:
+        return np.zeros(0, dtype=meta["dtype"]), index
+    return np.memmap(tokens_path, dtype=meta["dtype"], mode="r"), index
+
+
+def _write_meta(out_dir, meta):
+    path = os.path.join(out_dir, META_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def build_tokens(dataset_path, out_dir, tokenizer_path, eos=None, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Tokenize the dataset into `out_dir`, reusing the tokens of books whose text is unchanged.
+    Returns (books tokenized, books reused).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    fingerprint = tokenizer_fingerprint(tokenizer_path, eos)
+    _init_worker(tokenizer_path, eos)
+    tokenizer, _, dtype = _encoder
+
+    meta = load_meta(out_dir)
+    generation = meta["generation"] + 1 if meta else 0
+    previous = {}
+    old_tokens = None
+    if meta and meta["tokenizer"] == fingerprint and meta["dtype"] == dtype.name:
+        old = open_tokens(out_dir)
+        if old is not None:
+            old_tokens, old_index = old
+            for row in old_index.to_pylist():
+                previous[row["link"]] = row
+
+    tokens_name = f"tokens.{generation}.bin"
+    index_name = f"index.{generation}.arrow"
+    tokens_path = os.path.join(out_dir, tokens_name)
+    index = {name: [] for name in INDEX_SCHEMA.names}
+    position = 0
+    reused = 0
+    workers = workers or os.cpu_count() or 1
+
+    with open(tokens_path + ".tmp", "wb") as sink:
+
+        def append(link, hash_, ids):
+            nonlocal position
+            ids.tofile(sink)
+            index["link"].append(link)
+            index["text_hash"].append(hash_)
+            index["offset"].append(position)
+            index["length"].append(len(ids))
+            position += len(ids)
+
+        with DatasetReader(dataset_path) as reader:
+            # Unchanged books: copy their tokens without reading their texts
+            changed = []
+            for batch in reader.iter_batches(columns=["link", "text_hash"]):
+                for link, hash_ in zip(batch.column("link").to_pylist(), batch.column("text_hash").to_pylist()):
+                    old = previous.get(link)
+                    if old is not None and hash_ is not None and old["text_hash"] == hash_:
+                        append(link, hash_, old_tokens[old["offset"]:old["offset"] + old["length"]])
+                        reused += 1
+                    else:
+                        changed.append(link)
+
+            pool = None
+            if workers > 1 and changed:
+                pool = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(tokenizer_path, eos)
+                )
+            try:
+                pending = []
+
+                def collect(limit):
+                    while len(pending) > limit:
+                        links, hashes, result = pending.pop(0)
+                        encoded = result.result() if pool is not None else result
+                        for link, hash_, ids in zip(links, hashes, encoded):
+                            append(link, hash_, ids)
+
+                value_set = pa.array(changed, type=pa.string())
+                predicate = lambda batch: pc.is_in(batch.column("link"), value_set=value_set)
+                batches = reader.iter_batches(columns=["link", "text_hash", "text"], predicate=predicate)
+                for batch in batches if changed else []:
+                    for start in range(0, batch.num_rows, batch_size):
+                        part = batch.slice(start, batch_size)
+                        links = part.column("link").to_pylist()
+                        hashes = part.column("text_hash").to_pylist()
+                        texts = part.column("text").to_pylist()
+                        if pool is not None:
+                            pending.append((links, hashes, pool.submit(_encode_texts, texts)))
+                        else:
+                            pending.append((links, hashes, _encode_texts(texts)))
+                        # Bound the texts held by in-flight tasks
+                        collect(2 * workers)
+                collect(0)
+            finally:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+
+    index_path = os.path.join(out_dir, index_name)
+    with pa.OSFile(index_path + ".tmp", "wb") as sink, ipc.new_file(sink, INDEX_SCHEMA) as writer:
+        writer.write_table(pa.table(index, schema=INDEX_SCHEMA))
+    os.replace(tokens_path + ".tmp", tokens_path)
+    os.replace(index_path + ".tmp", index_path)
+    del old_tokens
+    # The new generation becomes current here
+    _write_meta(out_dir, {
+        "generation": generation,
+        "tokens": tokens_name,
+        "index": index_name,
+        "dtype": dtype.name,
+        "vocab_size": tokenizer.get_vocab_size(),
+        "eos": eos,
+        "tokenizer": fingerprint,
+        "num_books": len(index["link"]),
+        "num_tokens": position,
+    })
+    for pattern in ("tokens.*.bin*", "index.*.arrow*"):
+        for path in glob.glob(os.path.join(out_dir, pattern)):
+            if os.path.basename(path) not in (tokens_name, index_name):
+                os.remove(path)
+
+    tokenized = len(index["link"]) - reused
+    print(f"Tokenized {tokenized} books, reused {reused}: {position} tokens ({dtype.name}) in {out_dir}.")
+    return tokenized, reused
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-tokenize the books dataset into a memory-mappable token stream.")
+    parser.add_argument("--dataset", default="books_dataset.arrow", help="Arrow dataset to read.")
+    parser.add_argument("--out", default="tokens", help="Output directory (default: tokens).")
+    parser.add_argument(
+        "--tokenizer", required=True,
+        help="tokenizer.json (needs the tokenizers package) or a vocab file with one token per line."
+    )
+    parser.add_argument("--eos", default=None, help="Token appended after every book, e.g. </s>.")
+    parser.add_argument("--workers", type=int, default=None, help="Tokenizer processes (default: CPU count).")
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help=f"Books per tokenization task (default: {DEFAULT_BATCH_SIZE})."
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_tokens(
+        args.dataset, args.out, args.tokenizer, eos=args.eos,
+        workers=args.workers, batch_size=args.batch_size
+    )
@@ -1,17 +1,137 @@
 import os
-import pyarrow as pa
-import pyarrow.ipc as ipc
-from datasets import Dataset
-from huggingface_hub import login
+import json
+import math
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from src.dataset import read_dataset, SEGMENTS_SUFFIX
+from src.export import export_parquet, DATA_DIR, DEFAULT_MAX_SHARD_BYTES
 
 # --- Configuration ---
 DATASET_FILE = "books_dataset.arrow"
 HF_REPO_ID = "Nelathan/standardebooks"
+EXPORT_DIR = "hf_export"
+# Written to the Hub repo in the same commit as the shards it describes
+UPLOAD_MANIFEST = "upload_manifest.json"
+# Rough zstd ratio of book text, used to size the first hash-partitioned export
+COMPRESSION_RATIO = 3
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_shards(export_dir, workers=8):
+    """
+    Hash every shard under `export_dir`/data.
+    Returns {path in repo: {"sha256", "bytes"}}.
+    """
+    data_dir = os.path.join(export_dir, DATA_DIR)
+    paths = sorted(f"{DATA_DIR}/{name}" for name in os.listdir(data_dir) if name.endswith(".parquet"))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = executor.map(file_sha256, [os.path.join(export_dir, p) for p in paths])
+        return {
+            path: {"sha256": digest, "bytes": os.path.getsize(os.path.join(export_dir, path))}
+            for path, digest in zip(paths, digests)
+        }
+
+def load_remote_manifest(api, repo_id):
+    """
+    Download the manifest of the last delta upload, or return {} if there is none.
+    """
+    try:
+        path = api.hf_hub_download(repo_id, UPLOAD_MANIFEST, repo_type="dataset")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"No upload manifest in {repo_id} ({e.__class__.__name__}), uploading every shard.")
+        return {}
+
+def list_remote_shards(api, repo_id):
+    """
+    Parquet shards under data/ in the Hub repo, e.g. from an earlier push_to_hub.
+    """
+    try:
+        files = api.list_repo_files(repo_id, repo_type="dataset")
+    except Exception as e:
+        print(f"Could not list the files of {repo_id} ({e.__class__.__name__}).")
+        return []
+    return [path for path in files if path.startswith(f"{DATA_DIR}/") and path.endswith(".parquet")]
+
+def estimate_num_shards(dataset_path, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES):
+    """
+    Shard count for a first hash-partitioned export, from the size of the Arrow store.
+    """
+    size = os.path.getsize(dataset_path) if os.path.exists(dataset_path) else 0
+    segments_dir = dataset_path + SEGMENTS_SUFFIX
+    if os.path.isdir(segments_dir):
+        size += sum(os.path.getsize(os.path.join(segments_dir, name)) for name in os.listdir(segments_dir))
+    return max(1, math.ceil(size / COMPRESSION_RATIO / max_shard_bytes))
+
+def upload_delta(export_dir, repo_id, api, remote=None, workers=8):
+    """
+    Upload the shards of `export_dir` that differ from the last upload, and delete
+    the ones that no longer exist, in a single commit with `workers` concurrent uploads.
+    Returns the list of uploaded paths.
+    """
+    from huggingface_hub import CommitOperationAdd, CommitOperationDelete
+
+    if remote is None:
+        remote = load_remote_manifest(api, repo_id)
+    remote_files = remote.get("files", {})
+    local_files = hash_shards(export_dir, workers=workers)
+
+    changed = [path for path, info in local_files.items() if remote_files.get(path, {}).get("sha256") != info["sha256"]]
+    # Without a manifest the repo was filled some other way (push_to_hub); its shards
+    # would otherwise stay next to ours and be loaded twice by the data/ glob
+    known_remote = remote_files if "files" in remote else list_remote_shards(api, repo_id)
+    deleted = [path for path in known_remote if path not in local_files]
+    print(f"{len(changed)} of {len(local_files)} shards changed, {len(deleted)} to delete.")
+    if not changed and not deleted:
+        print("Hub is up to date, nothing to upload.")
+        return []
+
+    manifest = {"num_shards": len(local_files), "files": local_files}
+    operations = [CommitOperationAdd(path_in_repo=path, path_or_fileobj=os.path.join(export_dir, path)) for path in changed]
+    operations += [CommitOperationDelete(path_in_repo=path) for path in deleted]
+    operations.append(CommitOperationAdd(
+        path_in_repo=UPLOAD_MANIFEST,
+        path_or_fileobj=json.dumps(manifest, indent=2).encode("utf-8")
+    ))
+    api.create_commit(
+        repo_id, operations,
+        commit_message=f"Update {len(changed)} shards, delete {len(deleted)}",
+        repo_type="dataset", num_threads=workers
+    )
+    print(f"Uploaded {sum(local_files[p]['bytes'] for p in changed) / (1024*1024):.1f} MB in one commit.")
+    return changed
+
+def upload_delta_to_huggingface(api=None, dataset_path=DATASET_FILE, export_dir=EXPORT_DIR, repo_id=HF_REPO_ID,
+                                max_shard_bytes=DEFAULT_MAX_SHARD_BYTES, workers=8):
+    """
+    Export the dataset as hash-partitioned Parquet shards and upload only the changed ones.
+    The shard count of the last upload is kept, so unchanged books keep producing identical shards.
+    """
+    if api is None:
+        from huggingface_hub import HfApi
+        api = HfApi()
+    remote = load_remote_manifest(api, repo_id)
+    num_shards = remote.get("num_shards") or estimate_num_shards(dataset_path, max_shard_bytes)
+    if export_parquet(dataset_path, export_dir, num_shards=num_shards) is None:
+        print(f"Error: Dataset file not found at {dataset_path}. Please run main.py first to generate it.")
+        return None
+    return upload_delta(export_dir, repo_id, api, remote=remote, workers=workers)
 
 def upload_dataset_to_huggingface():
     """
     Loads the Arrow dataset from disk and uploads it to the Hugging Face Hub.
     """
+    from datasets import Dataset
+    from huggingface_hub import login
+
     print("Logging in to Hugging Face Hub...")
     try:
         login(new_session=False)
@@ -20,20 +140,17 @@ def upload_dataset_to_huggingface():
         print(f"Error logging in to Hugging Face Hub. Please run 'huggingface-cli login' or set HF_TOKEN. Details: {e}")
         return
 
-    if not os.path.exists(DATASET_FILE):
-        print(f"Error: Dataset file not found at {DATASET_FILE}. Please run main.py first to generate it.")
-        return
-
     try:
         print(f"Loading data from {DATASET_FILE}...")
-        # Use pyarrow.ipc.RecordBatchFileReader to read the .arrow file
-        with pa.memory_map(DATASET_FILE, 'r') as source:
-             reader = ipc.RecordBatchFileReader(source)
-             pa_table = reader.read_all()
+        # Memory-mapped: buffers are paged in from disk as the upload reads them
+        pa_table = read_dataset(DATASET_FILE)
+        if pa_table is None:
+            print(f"Error: Dataset file not found at {DATASET_FILE}. Please run main.py first to generate it.")
+            return
 
         dataset = Dataset(pa_table)
         print(f"Successfully loaded dataset with {len(dataset)} rows.")
-        print(f"Dataset size in memory: {pa_table.get_total_buffer_size() / (1024*1024):.2f} MB")
+        print(f"Dataset size on disk: {pa_table.get_total_buffer_size() / (1024*1024):.2f} MB")
 
         print(f"Uploading dataset to {HF_REPO_ID}...")
         dataset.push_to_hub(HF_REPO_ID)
@@ -47,4 +164,14 @@ def upload_dataset_to_huggingface():
 
 
 if __name__ == "__main__":
-    upload_dataset_to_huggingface()
+    parser = argparse.ArgumentParser(description="Upload the dataset to the Hugging Face Hub.")
+    parser.add_argument(
+        "--mode", choices=["delta", "full"], default="delta",
+        help="delta: upload only changed Parquet shards in one commit; full: push_to_hub the whole dataset."
+    )
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent hashing and upload threads.")
+    args = parser.parse_args()
+    if args.mode == "full":
+        upload_dataset_to_huggingface()
+    else:
+        upload_delta_to_huggingface(workers=args.workers)